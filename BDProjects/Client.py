@@ -6,11 +6,11 @@ from sqlalchemy.orm.session import Session as orm_Session
 from sqlalchemy.exc import ArgumentError
 from sqlalchemy.exc import IntegrityError
 
-from passlib.apps import custom_app_context as pwd_context
 from passlib import pwd
 
 from BDProjects import Base
 from BDProjects.Config import read_config
+from BDProjects.Passwords import password_context, hash_passwords
 from BDProjects.Entities import Role, User, LogCategory, ParameterType, Session, Project
 from BDProjects.EntityManagers import VersionManager
 from BDProjects.EntityManagers import LogManager
@@ -23,6 +23,7 @@ class Connector(object):
     def __init__(self, config=None, config_file_name=None):
         if config is None:
             config = read_config(config_file_name)
+        self.__config = config
         credentials = config['user'] + ':' + config['password'] if config['password'] else config['user']
         if credentials:
             credentials += '@'
@@ -41,10 +42,26 @@ class Connector(object):
         self.__session = sessionmaker()
         self.__session.configure(bind=self.engine)
 
+    @property
+    def config(self):
+        return self.__config
+
     @property
     def engine(self):
         return self.__engine
 
+    @property
+    def password_scheme(self):
+        return self.config.get('password_scheme', None)
+
+    @property
+    def password_rounds(self):
+        return self.config.get('password_rounds', None)
+
+    @property
+    def password_context(self):
+        return password_context(self.password_scheme, self.password_rounds)
+
     @property
     def metadata(self):
         return self.__metadata
@@ -144,7 +161,7 @@ class Installer(object):
         if email is None:
             email = 'admin@bdprojects'
         print('  user: @%s' % admin_login)
-        password_hash = pwd_context.encrypt(password)
+        password_hash = self.connector.password_context.hash(password)
         user = User(name_first='Storage', name_last='Administrator', email=email,
                     login=admin_login, password_hash=password_hash, roles=roles)
         try:
@@ -157,11 +174,14 @@ class Installer(object):
         print('adding default system users')
         roles = self.session.query(Role).filter(Role.name == 'system').all()
         for user_data in system_users:
+            if system_users[user_data]['password'] is None:
+                system_users[user_data]['password'] = pwd.genword()
+        password_hashes = hash_passwords([system_users[user_data]['password'] for user_data in system_users],
+                                         scheme=self.connector.password_scheme,
+                                         rounds=self.connector.password_rounds)
+        for user_data, password_hash in zip(system_users, password_hashes):
             user_fields = system_users[user_data]
             print('  user: @%s' % user_fields['login'])
-            if user_fields['password'] is None:
-                user_fields['password'] = pwd.genword()
-            password_hash = pwd_context.encrypt(user_fields['password'])
             user = User(name_first=str(user_fields['first']), name_last=str(user_fields['last']),
                         email=str(user_fields['email']), login=user_fields['login'], password_hash=password_hash,
                         roles=roles)
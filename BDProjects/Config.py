@@ -9,6 +9,23 @@ except ImportError:
 from BDProjects import default_connection_parameters
 
 
+def _boolean(value):
+    if value.lower() in ('1', 'yes', 'true', 'on'):
+        return True
+    if value.lower() in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError('Wrong boolean value')
+
+
+optional_parameters = {'Security': {'password_scheme': str,
+                                    'password_rounds': int},
+                       'Sessions': {'session_timeout': int,
+                                    'heartbeat_interval': int},
+                       'Parameters': {'fingerprint_tolerance': float},
+                       'Loading': {'strict_loading': _boolean},
+                       }
+
+
 def read_config(file_name=None):
     if file_name is None:
         connection_parameters = default_connection_parameters
@@ -48,9 +65,26 @@ def read_config(file_name=None):
                                  'user': user,
                                  'password': password
                                  }
+        connection_parameters.update(_read_optional_parameters(config))
     return connection_parameters
 
 
+def _read_optional_parameters(config):
+    parameters = {}
+    for section in optional_parameters:
+        if not config.has_section(section):
+            continue
+        for option, option_type in optional_parameters[section].items():
+            if config.has_option(section, option):
+                value = config.get(section, option)
+                if value:
+                    try:
+                        parameters[option] = option_type(value)
+                    except ValueError:
+                        raise ValueError('Wrong value of option %s in config file' % option)
+    return parameters
+
+
 def write_config(connection_parameters, file_name):
     if isinstance(connection_parameters['port'], int):
         if connection_parameters['port'] == 0:
@@ -76,6 +110,13 @@ def write_config(connection_parameters, file_name):
         config.set('Database', 'port', port_string)
         config.set('Database', 'user', connection_parameters['user'])
         config.set('Database', 'password', connection_parameters['password'])
+    for section in optional_parameters:
+        options = [option for option in optional_parameters[section]
+                   if connection_parameters.get(option) is not None]
+        if options:
+            config.add_section(section)
+            for option in options:
+                config.set(section, option, str(connection_parameters[option]))
     with open(file_name, 'w') as configfile:
         config.write(configfile)
 
@@ -12,8 +12,8 @@ from BDProjects.Entities import Parameter
 
 channel_parameter_table = Table('channel_parameter', Base.metadata,
                                 Column('id', Integer, primary_key=True),
-                                Column('channel_id', Integer, ForeignKey('data_channel.id')),
-                                Column('parameter_id', Integer, ForeignKey('parameter.id')),
+                                Column('channel_id', Integer, ForeignKey('data_channel.id', ondelete='CASCADE')),
+                                Column('parameter_id', Integer, ForeignKey('parameter.id'), index=True),
                                 UniqueConstraint('channel_id', 'parameter_id', name='_channel_parameter'))
 
 
@@ -21,12 +21,14 @@ class DataChannel(Base):
 
     __tablename__ = 'data_channel'
     id = Column(Integer, primary_key=True)
-    measurement_id = Column(Integer, ForeignKey('measurement.id'), nullable=False)
+    measurement_id = Column(Integer, ForeignKey('measurement.id', ondelete='CASCADE'), nullable=False, index=True)
     measurement = relationship(Measurement, backref=backref('data_channels', uselist=True,
                                                             cascade='all, delete-orphan'))
     name = Column(String)
     description = Column(Text)
     unit_name = Column(String)
+    deleted_at = Column(DateTime, index=True)
+    revision = Column(Integer, default=0)
     parameters = relationship(Parameter, secondary=channel_parameter_table,
                               backref='data_channels')
     session_id = Column(Integer, ForeignKey('session.id'))
@@ -39,7 +41,7 @@ class DataPoint(Base):
 
     __tablename__ = 'data_point'
     id = Column(Integer, primary_key=True)
-    channel_id = Column(Integer, ForeignKey('data_channel.id'))
+    channel_id = Column(Integer, ForeignKey('data_channel.id', ondelete='CASCADE'), index=True)
     channel = relationship(DataChannel, backref=backref('data_points', uselist=True,
                                                         cascade='all, delete-orphan'))
     point_index = Column(Integer, default=0)
@@ -1,6 +1,6 @@
 from __future__ import division, print_function
 
-from sqlalchemy import Table, Column, UniqueConstraint, Integer, String, Text, DateTime, ForeignKey, func
+from sqlalchemy import Table, Column, UniqueConstraint, Index, Integer, String, Text, DateTime, ForeignKey, func
 from sqlalchemy.orm import relationship, backref
 
 from BDProjects import Base, default_date_time_format
@@ -18,7 +18,7 @@ equipment_assembly_table = Table('assembly_parts', Base.metadata,
 equipment_parameters_table = Table('equipment_parameters', Base.metadata,
                                    Column('id', Integer, primary_key=True),
                                    Column('equipment_id', Integer, ForeignKey('equipment.id')),
-                                   Column('parameter_id', Integer, ForeignKey('parameter.id')),
+                                   Column('parameter_id', Integer, ForeignKey('parameter.id'), index=True),
                                    UniqueConstraint('equipment_id', 'parameter_id', name='equipment_parameter'))
 
 equipment_measurement_table = Table('equipment_measurement', Base.metadata,
@@ -28,6 +28,16 @@ equipment_measurement_table = Table('equipment_measurement', Base.metadata,
                                     UniqueConstraint('equipment_id', 'measurement_type_id',
                                                      name='equipment_measurement_type'))
 
+equipment_category_closure_table = Table('equipment_category_closure', Base.metadata,
+                                         Column('ancestor_id', Integer,
+                                                ForeignKey('equipment_category.id', ondelete='CASCADE'),
+                                                primary_key=True),
+                                         Column('descendant_id', Integer,
+                                                ForeignKey('equipment_category.id', ondelete='CASCADE'),
+                                                primary_key=True),
+                                         Column('depth', Integer, nullable=False),
+                                         Index('ix_equipment_category_closure_descendant', 'descendant_id', 'depth'))
+
 
 class Manufacturer(Base):
 
@@ -31,7 +31,7 @@ class Log(Base):
     session_id = Column(Integer, ForeignKey('session.id'))
     session = relationship(Session, backref=backref('logs', uselist=True,
                                                     cascade='all, delete-orphan'))
-    project_id = Column(Integer, ForeignKey('project.id'))
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'))
     project = relationship(Project, backref=backref('logs', uselist=True,
                                                     cascade='all, delete-orphan'))
     created = Column(DateTime, default=func.now())
@@ -1,6 +1,6 @@
 from __future__ import division, print_function
 
-from sqlalchemy import Table, Column, UniqueConstraint, Integer, Float, String, Text, DateTime, ForeignKey, func
+from sqlalchemy import Table, Column, UniqueConstraint, Index, Integer, Float, String, Text, DateTime, ForeignKey, func
 from sqlalchemy.orm import relationship, backref
 
 from BDProjects import Base, default_date_time_format
@@ -14,24 +14,24 @@ from BDProjects.Entities import Sample
 
 measurement_sample_table = Table('measurement_sample', Base.metadata,
                                  Column('id', Integer, primary_key=True),
-                                 Column('measurement_id', Integer, ForeignKey('measurement.id')),
-                                 Column('sample_id', Integer, ForeignKey('sample.id')),
+                                 Column('measurement_id', Integer, ForeignKey('measurement.id', ondelete='CASCADE')),
+                                 Column('sample_id', Integer, ForeignKey('sample.id', ondelete='CASCADE')),
                                  UniqueConstraint('measurement_id', 'sample_id', name='_measurement_sample'))
 
 measurement_collection_table = Table('measurement_collection', Base.metadata,
                                      Column('id', Integer, primary_key=True),
                                      Column('collection_id', Integer,
-                                            ForeignKey('measurements_collection.id')),
+                                            ForeignKey('measurements_collection.id', ondelete='CASCADE')),
                                      Column('measurement_id', Integer,
-                                            ForeignKey('measurement.id')),
+                                            ForeignKey('measurement.id', ondelete='CASCADE')),
                                      UniqueConstraint('collection_id', 'measurement_id',
                                                       name='_measurement_collection'))
 
 
 measurement_parameter_table = Table('measurement_parameter', Base.metadata,
                                     Column('id', Integer, primary_key=True),
-                                    Column('measurement_id', Integer, ForeignKey('measurement.id')),
-                                    Column('parameter_id', Integer, ForeignKey('parameter.id')),
+                                    Column('measurement_id', Integer, ForeignKey('measurement.id', ondelete='CASCADE')),
+                                    Column('parameter_id', Integer, ForeignKey('parameter.id'), index=True),
                                     UniqueConstraint('measurement_id', 'parameter_id', name='_measurement_parameter'))
 
 
@@ -41,7 +41,7 @@ class MeasurementsCollection(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String)
     description = Column(Text)
-    project_id = Column(Integer, ForeignKey('project.id'))
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'), index=True)
     project = relationship(Project, backref=backref('measurements_collections', uselist=True,
                                                     cascade='all, delete-orphan'))
     session_id = Column(Integer, ForeignKey('session.id'))
@@ -58,19 +58,19 @@ class Measurement(Base):
     __tablename__ = 'measurement'
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    measurement_type_id = Column(Integer, ForeignKey('measurement_type.id'))
+    measurement_type_id = Column(Integer, ForeignKey('measurement_type.id'), index=True)
     measurement_type = relationship(MeasurementType, backref=backref('measurements', uselist=True,
                                                                      cascade='all, delete-orphan'))
-    equipment_id = Column(Integer, ForeignKey('equipment.id'))
+    equipment_id = Column(Integer, ForeignKey('equipment.id'), index=True)
     equipment = relationship(Equipment, backref=backref('measurements', uselist=True,
                                                         cascade='all, delete-orphan'))
-    project_id = Column(Integer, ForeignKey('project.id'))
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'), index=True)
     project = relationship(Project, backref=backref('measurements', uselist=True,
                                                     cascade='all, delete-orphan'))
     session_id = Column(Integer, ForeignKey('session.id'))
     session = relationship(Session, backref=backref('measurements', uselist=True,
                                                     cascade='all, delete-orphan'))
-    input_data_id = Column(Integer, ForeignKey('measurements_collection.id'))
+    input_data_id = Column(Integer, ForeignKey('measurements_collection.id', ondelete='SET NULL'))
     input_data = relationship(MeasurementsCollection, backref=backref('analyses', uselist=True,
                                                                       cascade='all, delete-orphan'))
     samples = relationship(Sample, secondary=measurement_sample_table, backref='measurements')
@@ -79,6 +79,8 @@ class Measurement(Base):
     started = Column(DateTime, default=func.now())
     finished = Column(DateTime)
     progress = Column(Float, default=0.0)
+    deleted_at = Column(DateTime, index=True)
+    __table_args__ = (Index('ix_measurement_project_started', 'project_id', 'started'),)
 
     def __str__(self):
         description = 'Measurement: %s' % self.name
@@ -15,6 +15,7 @@ class MeasurementType(Base):
     subtypes = relationship('MeasurementType', backref=backref('parent', remote_side=[id],
                                                                cascade='all, delete'))
     name = Column(String, unique=True)
+    path = Column(String, index=True)
     description = Column(Text)
     session_id = Column(Integer, ForeignKey('session.id'))
     session = relationship(Session, backref=backref('measurement_types', uselist=True,
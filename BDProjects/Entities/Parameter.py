@@ -1,7 +1,7 @@
 from __future__ import division, print_function
 import numpy as np
 
-from sqlalchemy import Column, DateTime, String, Text, Integer, Float, ForeignKey, func
+from sqlalchemy import Column, Index, DateTime, String, Text, Integer, Float, LargeBinary, ForeignKey, func
 from sqlalchemy.orm import relationship, backref
 
 from BDProjects import Base, default_date_time_format
@@ -36,7 +36,7 @@ class Parameter(Base):
     type_id = Column(Integer, ForeignKey('parameter_type.id'))
     type = relationship(ParameterType, backref=backref('parameters', uselist=True,
                                                        cascade='all, delete-orphan'))
-    parent_id = Column(Integer, ForeignKey('parameter.id'))
+    parent_id = Column(Integer, ForeignKey('parameter.id'), index=True)
     children = relationship('Parameter', backref=backref('parent', remote_side=[id]),
                             cascade='all, delete')
     name = Column(String)
@@ -45,11 +45,14 @@ class Parameter(Base):
     index = Column(Integer, nullable=False, default=0)
     string_value = Column(String)
     float_value = Column(Float)
+    binary_value = Column(LargeBinary)
+    fingerprint = Column(String(64), index=True)
     session_id = Column(Integer, ForeignKey('session.id'))
     session = relationship(Session, backref=backref('parameters', uselist=True,
                                                     cascade='all, delete-orphan'))
     value_added = Column(DateTime, default=func.now())
     value_altered = Column(DateTime, default=func.now(), onupdate=func.now())
+    __table_args__ = (Index('ix_parameter_name_float_value', 'name', 'float_value'),)
 
     def __str__(self):
         description = 'Parameter: %s' % self.name
@@ -68,7 +71,14 @@ class Parameter(Base):
         return description
 
     def equals(self, other):
+        """
+        Compares parameter trees recursively, float values are compared with np.allclose.
+        Equal fingerprints short-cut the comparison, since fingerprint tolerance is below np.allclose
+        absolute tolerance. Fingerprints are recomputed on flush, so changes must be flushed before comparison.
+        """
         assert isinstance(other, Parameter)
+        if self.fingerprint is not None and self.fingerprint == other.fingerprint:
+            return True
         result = True
         if self.name != other.name:
             result = False
@@ -82,6 +92,8 @@ class Parameter(Base):
             result = False
         if self.string_value != other.string_value:
             result = False
+        if self.binary_value != other.binary_value:
+            result = False
         if self.float_value is None or other.float_value is None:
             if self.float_value != other.float_value:
                 result = False
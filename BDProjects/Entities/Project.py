@@ -13,7 +13,7 @@ class SessionProject(Base):
     id = Column(Integer, primary_key=True)
     session_id = Column(Integer, ForeignKey('session.id'))
     session = relationship('Session', back_populates='projects_opened', cascade='all, delete')
-    project_id = Column(Integer, ForeignKey('project.id'))
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'))
     project = relationship('Project', back_populates='sessions', cascade='all, delete')
     opened = Column(DateTime, default=func.now())
     closed = Column(DateTime)
@@ -30,6 +30,8 @@ class Project(Base):
     created_session = relationship(Session, backref=backref('projects_created', uselist=True,
                                                             cascade='all, delete-orphan'))
     data_dir = Column(String)
+    deleted_at = Column(DateTime, index=True)
+    revision = Column(Integer, default=0)
     sessions = relationship('SessionProject', back_populates='project', cascade='all, delete-orphan')
 
     def __str__(self):
@@ -11,8 +11,8 @@ from BDProjects.Entities import Parameter
 
 association_table = Table('sample_parameter', Base.metadata,
                           Column('id', Integer, primary_key=True),
-                          Column('sample_id', Integer, ForeignKey('sample.id')),
-                          Column('parameter_id', Integer, ForeignKey('parameter.id')),
+                          Column('sample_id', Integer, ForeignKey('sample.id', ondelete='CASCADE')),
+                          Column('parameter_id', Integer, ForeignKey('parameter.id'), index=True),
                           UniqueConstraint('sample_id', 'parameter_id', name='_sample_parameter'))
 
 
@@ -23,7 +23,8 @@ class Sample(Base):
     name = Column(String)
     description = Column(Text)
     created = Column(DateTime, default=func.now())
-    project_id = Column(Integer, ForeignKey('project.id'))
+    deleted_at = Column(DateTime, index=True)
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'), index=True)
     project = relationship(Project, backref=backref('samples', uselist=True, cascade='all, delete-orphan'))
     session_id = Column(Integer, ForeignKey('session.id'))
     session = relationship(Session, backref=backref('samples', uselist=True, cascade='all, delete-orphan'))
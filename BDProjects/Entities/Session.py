@@ -1,6 +1,6 @@
 from __future__ import division, print_function
 
-from sqlalchemy import Column, Integer, Boolean, String, DateTime, ForeignKey, func
+from sqlalchemy import Column, Index, Integer, Boolean, String, DateTime, ForeignKey, func
 from sqlalchemy.orm import relationship, backref
 
 from BDProjects import Base
@@ -16,9 +16,11 @@ class Session(Base):
     active = Column(Boolean, default=True)
     opened = Column(DateTime, default=func.now())
     closed = Column(DateTime, onupdate=func.now())
+    last_seen = Column(DateTime, default=func.now(), index=True)
     host = Column(String)
     python = Column(String)
     platform = Column(String)
-    token = Column(String)
+    token = Column(String, unique=True, index=True)
     projects_opened = relationship('SessionProject', back_populates='session',
                                    cascade='all, delete-orphan')
+    __table_args__ = (Index('ix_session_active_user', 'active', 'user_id'),)
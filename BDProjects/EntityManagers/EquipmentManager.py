@@ -2,14 +2,19 @@ from __future__ import division, print_function
 
 from sqlalchemy import or_, and_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm.exc import NoResultFound
 
 from BDProjects.Entities import Manufacturer, EquipmentCategory, EquipmentAssembly, Equipment
 from BDProjects.Entities import MeasurementType
 from BDProjects.Entities import Parameter
+from BDProjects.Entities.Equipment import equipment_category_closure_table
 
 from .EntityManager import EntityManager
 from ._helpers import require_signed_in
+from ._bulk import load_parameter_trees
+from ._hierarchy import insert_category_closure, delete_stale_category_closure
+from ._loading import loading_options
 
 
 class EquipmentManager(EntityManager):
@@ -40,6 +45,8 @@ class EquipmentManager(EntityManager):
         if isinstance(manufacturer, Manufacturer):
             self.session.delete(manufacturer)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('equipment')
+            self.session_manager.name_cache.invalidate('equipment_types')
             record = 'Manufacturer "%s" successfully deleted' % manufacturer.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
@@ -84,6 +91,8 @@ class EquipmentManager(EntityManager):
             return similar[0]
         try:
             self.session.add(equipment_category)
+            self.session.flush()
+            insert_category_closure(self.session, equipment_category.id, equipment_category.parent_id)
             self.session.commit()
             record = 'Equipment category "%s" created' % equipment_category.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
@@ -99,7 +108,11 @@ class EquipmentManager(EntityManager):
     def delete_equipment_category(self, category):
         if isinstance(category, EquipmentCategory):
             self.session.delete(category)
+            self.session.flush()
+            delete_stale_category_closure(self.session)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('equipment')
+            self.session_manager.name_cache.invalidate('equipment_types')
             record = 'Equipment category "%s" successfully deleted' % category.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
@@ -110,22 +123,28 @@ class EquipmentManager(EntityManager):
 
     @require_signed_in
     def get_equipment_categories_tree(self, root=None):
-        equipment_categories = {}
+        """
+        Returns nested dict of category names. If root name is given returns tree of its subcategories.
+        The tree is built from single query over the closure table.
+        """
         if root is None:
-            roots = self.session.query(EquipmentCategory.name).filter(
-                EquipmentCategory.parent_id == None).all()
+            q = self.session.query(EquipmentCategory.id, EquipmentCategory.name, EquipmentCategory.parent_id)
         else:
-            roots = []
-            try:
-                root_id = self.session.query(EquipmentCategory.id).filter(
-                    EquipmentCategory.name == str(root)).one()
-                if root_id:
-                    roots = self.session.query(EquipmentCategory.name).filter(
-                        EquipmentCategory.parent_id == root_id[0]).all()
-            except NoResultFound:
-                pass
-        for root in roots:
-            equipment_categories[root[0]] = self.get_equipment_categories_tree(root[0])
+            closure = equipment_category_closure_table
+            ancestor = aliased(EquipmentCategory)
+            q = self.session.query(EquipmentCategory.id, EquipmentCategory.name, EquipmentCategory.parent_id)
+            q = q.join(closure, closure.c.descendant_id == EquipmentCategory.id).join(
+                ancestor, ancestor.id == closure.c.ancestor_id).filter(ancestor.name == str(root),
+                                                                       closure.c.depth > 0)
+        rows = q.order_by(EquipmentCategory.id).all()
+        ids = set(row[0] for row in rows)
+        nodes = dict((row[0], {}) for row in rows)
+        equipment_categories = {}
+        for category_id, name, parent_id in rows:
+            if parent_id in ids:
+                nodes[parent_id][name] = nodes[category_id]
+            else:
+                equipment_categories[name] = nodes[category_id]
         return equipment_categories
 
     @require_signed_in
@@ -193,6 +212,7 @@ class EquipmentManager(EntityManager):
         try:
             self.session.add(equipment)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('equipment', equipment.name)
             record = 'Equipment "%s" created' % equipment.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
         except IntegrityError:
@@ -209,6 +229,8 @@ class EquipmentManager(EntityManager):
         if isinstance(equipment, Equipment):
             self.session.delete(equipment)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('equipment', equipment.name)
+            self.session_manager.name_cache.invalidate('equipment_types', equipment.id)
             record = 'Equipment "%s" successfully deleted' % equipment.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
@@ -218,14 +240,26 @@ class EquipmentManager(EntityManager):
             return False
 
     @require_signed_in
-    def get_equipment(self, name=None, category=None, serial_number=None):
+    def get_equipment(self, name=None, category=None, serial_number=None, profile=None):
+        """
+        Finds equipment by name, serial number and category, including equipment of all its subcategories.
+        Related entities are loaded eagerly according to loading profile ('summary' or 'full').
+        """
         q = self.session.query(Equipment)
+        q = q.options(*loading_options(Equipment, profile, self.session_manager.strict_loading))
         if name is not None and len(str(name)) > 2:
             template = '%' + str(name) + '%'
             q = q.filter(Equipment.name.ilike(template))
-        if category is not None and len(str(category)) > 2:
-            template = '%' + str(category) + '%'
-            q = q.filter(Equipment.category.name.ilike(template))
+        if isinstance(category, EquipmentCategory) or (category is not None and len(str(category)) > 2):
+            closure = equipment_category_closure_table
+            q = q.join(closure, closure.c.descendant_id == Equipment.category_id)
+            if isinstance(category, EquipmentCategory):
+                q = q.filter(closure.c.ancestor_id == category.id)
+            else:
+                template = '%' + str(category) + '%'
+                ancestor_ids = self.session.query(EquipmentCategory.id).filter(
+                    EquipmentCategory.name.ilike(template))
+                q = q.filter(closure.c.ancestor_id.in_(ancestor_ids)).distinct()
         if serial_number is not None and len(str(serial_number)) > 2:
             template = '%' + str(serial_number) + '%'
             q = q.filter(Equipment.serial_number.ilike(template))
@@ -255,6 +289,8 @@ class EquipmentManager(EntityManager):
         if isinstance(assembly, EquipmentAssembly):
             self.session.delete(assembly)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('equipment')
+            self.session_manager.name_cache.invalidate('equipment_types')
             record = 'Equipment assembly "%s" successfully deleted' % assembly.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
@@ -277,6 +313,7 @@ class EquipmentManager(EntityManager):
             try:
                 equipment.measurement_types.append(measurement_type)
                 self.session.commit()
+                self.session_manager.name_cache.invalidate('equipment_types', equipment.id)
                 record = 'Measurement type "%s" added to equipment "%s"' % (str(measurement_type.name),
                                                                             str(equipment.name))
                 self.session_manager.log_manager.log_record(record=record, category='Information')
@@ -298,6 +335,7 @@ class EquipmentManager(EntityManager):
             if measurement_type in equipment.measurement_types:
                 equipment.measurement_types.remove(measurement_type)
                 self.session.commit()
+                self.session_manager.name_cache.invalidate('equipment_types', equipment.id)
                 record = 'Measurement type "%s" removed from equipment "%s"' % (str(measurement_type.name),
                                                                                 str(equipment.name))
                 self.session_manager.log_manager.log_record(record=record, category='Information')
@@ -315,6 +353,7 @@ class EquipmentManager(EntityManager):
     @require_signed_in
     def add_parameter_to_equipment(self, equipment, parameter):
         if isinstance(equipment, Equipment) and isinstance(parameter, Parameter):
+            parameter = self.session_manager.parameter_manager.intern_parameter(parameter)
             try:
                 equipment.parameters.append(parameter)
                 self.session.commit()
@@ -351,14 +390,17 @@ class EquipmentManager(EntityManager):
             return False
 
     @require_signed_in
-    def get_equipment_parameters(self, equipment, parameter_name=None):
+    def get_equipment_parameters(self, equipment, parameter_name=None, load_trees=False):
         if isinstance(equipment, Equipment):
-            q = self.session.query(Parameter).join((Equipment, Parameter.equipment))
+            q = self.session.query(Parameter).join(Parameter.equipment)
             q = q.filter(Equipment.id == equipment.id)
             if parameter_name is not None and len(str(parameter_name)) > 2:
                 template = '%' + str(parameter_name) + '%'
                 q = q.filter(Parameter.name.ilike(template))
-            return q.all()
+            parameters = q.all()
+            if load_trees:
+                load_parameter_trees(self.session, parameters)
+            return parameters
         else:
             raise ValueError('Wrong argument value')
 
@@ -5,15 +5,23 @@ import numpy as np
 
 from sqlalchemy.exc import IntegrityError
 
+from BDProjects.Entities import Project
 from BDProjects.Entities import MeasurementType
 from BDProjects.Entities import Measurement, MeasurementsCollection
+from BDProjects.Entities.Measurement import measurement_sample_table
 from BDProjects.Entities import DataChannel, DataPoint
 from BDProjects.Entities import Equipment
+from BDProjects.Entities.Equipment import equipment_measurement_table
 from BDProjects.Entities import Sample
 from BDProjects.Entities import Parameter
 
 from .EntityManager import EntityManager
 from ._helpers import require_signed_in, require_project_opened
+from ._bulk import delete_measurement_rows, tombstone, load_parameter_trees, measurement_parameter_table
+from ._bulk import insert_returning_ids, touch_project, touch_data_channel
+from ._search import parameter_criteria, parameter_owners, keyset_criterion
+from ._hierarchy import subtree_criterion
+from ._loading import loading_options
 
 
 class MeasurementManager(EntityManager):
@@ -30,15 +38,141 @@ class MeasurementManager(EntityManager):
         measurement.session_id = self.session_manager.session_data.id
         if description is not None:
             measurement.description = str(description)
+        resolved = self._measurement_type_and_equipment_ids(measurement_type, equipment)
+        if resolved is None:
+            return None
+        measurement.measurement_type_id, measurement.equipment_id = resolved
+        self.session.add(measurement)
+        self.session.commit()
+        record = 'Measurement "%s" created' % measurement.name
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return measurement
+
+    @require_signed_in
+    @require_project_opened
+    def create_measurements(self, manifest):
+        """
+        Creates measurements from manifest, a list of dicts with keys name, measurement_type, equipment and
+        optional description, samples (Sample objects or names), parameters (Parameter objects or dict
+        of values as for create_parameters_from_dict) and channels (names or dicts with keys name,
+        description and unit_name). All specs are validated before anything is written, then measurements,
+        association rows and data channels are inserted with executemany in one transaction.
+        Returns list of created measurements or None if any spec is invalid.
+        """
+        project = self.session_manager.project_manager.project
+        session_id = self.session_manager.session_data.id
+        parameter_manager = self.session_manager.parameter_manager
+        if not isinstance(manifest, (list, tuple)):
+            record = 'Expected list of measurement specs'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        sample_names = set(str(sample) for spec in manifest if isinstance(spec, dict)
+                           for sample in spec.get('samples', None) or [] if not isinstance(sample, Sample))
+        sample_ids = {}
+        if sample_names:
+            sample_ids = dict(self.session.query(Sample.name, Sample.id).filter(
+                Sample.project_id == project.id, Sample.deleted_at == None, Sample.name.in_(sample_names)))
+        measurement_rows, sample_links, parameter_links, channel_specs, new_parameters = [], [], [], [], []
+        for number, spec in enumerate(manifest):
+            if not isinstance(spec, dict) or 'name' not in spec:
+                record = 'Measurement spec #%d must be dict with measurement name' % number
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
+            resolved = self._measurement_type_and_equipment_ids(spec.get('measurement_type', None),
+                                                                spec.get('equipment', None))
+            if resolved is None:
+                return None
+            description = spec.get('description', None)
+            measurement_rows.append({'name': str(spec['name']),
+                                     'measurement_type_id': resolved[0],
+                                     'equipment_id': resolved[1],
+                                     'project_id': project.id,
+                                     'session_id': session_id,
+                                     'description': None if description is None else str(description)})
+            linked_samples = set()
+            for sample in spec.get('samples', None) or []:
+                sample_id = sample.id if isinstance(sample, Sample) else sample_ids.get(str(sample), None)
+                if sample_id is None:
+                    record = 'Sample "%s" not found for measurement "%s"' % (sample, spec['name'])
+                    self.session_manager.log_manager.log_record(record=record, category='Warning')
+                    return None
+                if sample_id not in linked_samples:
+                    linked_samples.add(sample_id)
+                    sample_links.append((number, sample_id))
+            parameters = spec.get('parameters', None) or []
+            if isinstance(parameters, dict):
+                parameters = parameter_manager.build_parameters_from_dict(parameters)
+                new_parameters += parameters
+            elif not all(isinstance(parameter, Parameter) for parameter in parameters):
+                record = 'Wrong parameters for measurement "%s"' % spec['name']
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
+            parameter_links += [(number, parameter) for parameter in parameters]
+            channel_names = set()
+            for channel in spec.get('channels', None) or []:
+                if not isinstance(channel, dict):
+                    channel = {'name': channel}
+                if 'name' not in channel or str(channel['name']) in channel_names:
+                    record = 'Wrong or duplicate data channel name for measurement "%s"' % spec['name']
+                    self.session_manager.log_manager.log_record(record=record, category='Warning')
+                    return None
+                channel_names.add(str(channel['name']))
+                channel_specs.append((number, channel))
+        if new_parameters:
+            self.session.add_all(new_parameters)
+            self.session.flush()
+        measurement_ids = insert_returning_ids(self.session, Measurement.__table__, measurement_rows)
+        if len(measurement_ids) != len(measurement_rows) or None in measurement_ids or \
+                len(set(measurement_ids)) != len(measurement_ids):
+            self.session.rollback()
+            record = 'Database did not return IDs of created measurements, changes rolled back'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        if sample_links:
+            self.session.execute(measurement_sample_table.insert(),
+                                 [{'measurement_id': measurement_ids[number], 'sample_id': sample_id}
+                                  for number, sample_id in sample_links])
+        parameter_rows, linked_parameters = [], set()
+        for number, parameter in parameter_links:
+            link = (measurement_ids[number], parameter_manager.intern_parameter(parameter).id)
+            if link not in linked_parameters:
+                linked_parameters.add(link)
+                parameter_rows.append({'measurement_id': link[0], 'parameter_id': link[1]})
+        if parameter_rows:
+            self.session.execute(measurement_parameter_table.insert(), parameter_rows)
+        channel_rows = []
+        for number, channel in channel_specs:
+            description = channel.get('description', None)
+            unit_name = channel.get('unit_name', None)
+            channel_rows.append({'name': str(channel['name']),
+                                 'measurement_id': measurement_ids[number],
+                                 'session_id': session_id,
+                                 'description': None if description is None else str(description),
+                                 'unit_name': None if unit_name is None else str(unit_name)})
+        if channel_rows:
+            self.session.execute(DataChannel.__table__.insert(), channel_rows)
+        self.session.commit()
+        measurements = dict((measurement.id, measurement) for measurement in
+                            self.session.query(Measurement).filter(Measurement.id.in_(measurement_ids)))
+        measurements = [measurements[measurement_id] for measurement_id in measurement_ids]
+        record = 'Created %d measurements with %d data channels' % (len(measurements), len(channel_rows))
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return measurements
+
+    def _measurement_type_and_equipment_ids(self, measurement_type, equipment):
+        """
+        Resolves measurement type and equipment (objects or names) to IDs and checks that equipment
+        supports measurement type. Logs warning and returns None on failure.
+        """
         if isinstance(measurement_type, MeasurementType):
-            measurement.measurement_type_id = measurement_type.id
+            measurement_type_id = measurement_type.id
+            measurement_type_name = measurement_type.name
         else:
-            measurement_types = self.session_manager.measurement_type_manager.get_measurement_types(
-                measurement_type)
-            if len(measurement_types) == 1:
-                measurement.measurement_type_id = measurement_types[0].id
-                measurement_type = measurement_types[0]
-            elif len(measurement_types) == 0:
+            measurement_type_ids = self._measurement_type_ids(measurement_type)
+            if len(measurement_type_ids) == 1:
+                measurement_type_id = measurement_type_ids[0]
+                measurement_type_name = str(measurement_type)
+            elif len(measurement_type_ids) == 0:
                 record = 'No measurement type found for keyword "%s"' % measurement_type
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
                 return None
@@ -47,13 +181,14 @@ class MeasurementManager(EntityManager):
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
                 return None
         if isinstance(equipment, Equipment):
-            measurement.equipment_id = equipment.id
+            equipment_id = equipment.id
+            equipment_name = equipment.name
         else:
-            equipment_list = self.session_manager.equipment_manager.get_equipment(equipment)
-            if len(equipment_list) == 1:
-                measurement.equipment_id = equipment_list[0].id
-                equipment = equipment_list[0]
-            elif len(equipment_list) == 0:
+            equipment_ids = self._equipment_ids(equipment)
+            if len(equipment_ids) == 1:
+                equipment_id = equipment_ids[0]
+                equipment_name = str(equipment)
+            elif len(equipment_ids) == 0:
                 record = 'No equipment found for keyword "%s"' % equipment
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
                 return None
@@ -61,27 +196,89 @@ class MeasurementManager(EntityManager):
                 record = 'More than one equipment item found for keyword "%s"' % equipment
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
                 return None
-        if measurement_type not in equipment.measurement_types:
-            record = 'Equipment "%s" does not support measurement type "%s"' % \
-                     (measurement.equipment.name, measurement.measurement_type.name)
+        if measurement_type_id not in self._equipment_measurement_type_ids(equipment_id):
+            record = 'Equipment "%s" does not support measurement type "%s"' % (equipment_name,
+                                                                                measurement_type_name)
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return None
-        self.session.add(measurement)
-        self.session.commit()
-        record = 'Measurement "%s" created' % measurement.name
-        self.session_manager.log_manager.log_record(record=record, category='Information')
-        return measurement
+        return measurement_type_id, equipment_id
+
+    def _measurement_type_ids(self, name):
+        """
+        Resolves measurement type name to IDs. Exact matches are cached in client name cache,
+        otherwise falls back to fuzzy search.
+        """
+        cache = self.session_manager.name_cache
+        type_ids = cache.get('measurement_type', str(name))
+        if type_ids is None:
+            type_ids = tuple(type_id for type_id, in self.session.query(MeasurementType.id).filter(
+                MeasurementType.name == str(name)))
+            if type_ids:
+                cache.put('measurement_type', str(name), type_ids)
+            else:
+                measurement_types = self.session_manager.measurement_type_manager.get_measurement_types(name)
+                type_ids = tuple(measurement_type.id for measurement_type in measurement_types or [])
+        return type_ids
+
+    def _equipment_ids(self, name):
+        """
+        Resolves equipment name to IDs. Exact matches are cached in client name cache,
+        otherwise falls back to fuzzy search.
+        """
+        cache = self.session_manager.name_cache
+        equipment_ids = cache.get('equipment', str(name))
+        if equipment_ids is None:
+            equipment_ids = tuple(equipment_id for equipment_id, in self.session.query(Equipment.id).filter(
+                Equipment.name == str(name)).order_by(Equipment.id))
+            if equipment_ids:
+                cache.put('equipment', str(name), equipment_ids)
+            else:
+                equipment_ids = tuple(item.id for item in self.session_manager.equipment_manager.get_equipment(name))
+        return equipment_ids
+
+    def _equipment_measurement_type_ids(self, equipment_id):
+        cache = self.session_manager.name_cache
+        type_ids = cache.get('equipment_types', equipment_id)
+        if type_ids is None:
+            type_ids = frozenset(type_id for type_id, in self.session.query(
+                equipment_measurement_table.c.measurement_type_id).filter(
+                equipment_measurement_table.c.equipment_id == equipment_id))
+            cache.put('equipment_types', equipment_id, type_ids)
+        return type_ids
 
     @require_signed_in
     @require_project_opened
-    def delete_measurement(self, measurement):
+    def delete_measurement(self, measurement, bulk=False, soft=False, chunk_size=10000, progress=None):
+        """
+        Deletes measurement with all its data. With bulk=True data channels and data points are removed
+        with chunked set-based DELETE statements, progress(table_name, deleted_rows) is called after every chunk.
+        With soft=True measurement is only marked as deleted and is physically removed later by purge job.
+        """
         if not isinstance(measurement, Measurement):
             record = 'Expected valid Measurement object for delete operation'
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return False
-        self.session.delete(measurement)
-        self.session.commit()
-        record = 'Measurement "%s" successfully deleted' % measurement.name
+        project_id = measurement.project_id
+        if soft:
+            if not tombstone(self.session, Measurement, measurement.id, project_id):
+                record = 'Measurement "%s" is already deleted' % measurement.name
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return False
+            record = 'Measurement "%s" marked as deleted' % measurement.name
+        elif bulk:
+            self.session.refresh(measurement)
+            self.session.expunge(measurement)
+            counts = delete_measurement_rows(self.session, Measurement.__table__.c.id == measurement.id,
+                                             chunk_size, progress)
+            touch_project(self.session, project_id)
+            self.session.commit()
+            self.session.expire_all()
+            record = 'Measurement "%s" (%i data points) deleted in bulk' % (measurement.name, counts['data_points'])
+        else:
+            touch_project(self.session, project_id)
+            self.session.delete(measurement)
+            self.session.commit()
+            record = 'Measurement "%s" successfully deleted' % measurement.name
         self.session_manager.log_manager.log_record(record=record, category='Information')
         return True
 
@@ -127,6 +324,7 @@ class MeasurementManager(EntityManager):
     @require_project_opened
     def add_parameter_to_measurement(self, measurement, parameter):
         if isinstance(measurement, Measurement) and isinstance(parameter, Parameter):
+            parameter = self.session_manager.parameter_manager.intern_parameter(parameter)
             try:
                 measurement.parameters.append(parameter)
                 self.session.commit()
@@ -161,6 +359,21 @@ class MeasurementManager(EntityManager):
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return False
 
+    @require_signed_in
+    def get_measurement_parameters(self, measurement, parameter_name=None, load_trees=False):
+        if isinstance(measurement, Measurement):
+            q = self.session.query(Parameter).join(Parameter.measurements)
+            q = q.filter(Measurement.id == measurement.id)
+            if parameter_name is not None and len(str(parameter_name)) > 2:
+                template = '%' + str(parameter_name) + '%'
+                q = q.filter(Parameter.name.ilike(template))
+            parameters = q.all()
+            if load_trees:
+                load_parameter_trees(self.session, parameters)
+            return parameters
+        else:
+            raise ValueError('Wrong argument value')
+
     @require_signed_in
     @require_project_opened
     def create_collection(self, name, description=None):
@@ -282,14 +495,135 @@ class MeasurementManager(EntityManager):
 
     @require_signed_in
     @require_project_opened
-    def get_measurements(self, name=None):
+    def get_measurements(self, name=None, include_deleted=False, type_subtree=None, profile=None):
+        """
+        Returns measurements of opened project. If type_subtree (MeasurementType or its name) is given
+        only measurements of that type or any of its subtypes are returned. Related entities are loaded
+        eagerly according to loading profile ('summary' or 'full').
+        """
         project = self.session_manager.project_manager.project
         q = self.session.query(Measurement).filter(Measurement.project_id == project.id)
+        q = q.options(*loading_options(Measurement, profile, self.session_manager.strict_loading))
+        if type_subtree is not None:
+            if isinstance(type_subtree, MeasurementType):
+                type_path = type_subtree.path
+            else:
+                type_path = self.session.query(MeasurementType.path).filter(
+                    MeasurementType.name == str(type_subtree)).scalar()
+            if type_path is None:
+                return []
+            q = q.join(MeasurementType, Measurement.measurement_type_id == MeasurementType.id).filter(
+                subtree_criterion(MeasurementType.path, type_path))
+        if not include_deleted:
+            q = q.filter(Measurement.deleted_at == None)
         if name is not None and len(str(name)) > 2:
             template = '%' + str(name) + '%'
             q = q.filter(Measurement.name.ilike(template))
         return q.all()
 
+    @require_signed_in
+    def search_measurements(self, project=None, name=None, type=None, equipment=None, sample=None,
+                            started_between=None, finished=None, parameter_filters=None, order_by='started',
+                            limit=None, after=None, profile=None):
+        """
+        Searches measurements of given project (opened project by default) with single joined query.
+        name is substring of measurement name, type is MeasurementType or its name matching its whole subtree,
+        equipment and sample are objects or exact names, started_between is (start, end) tuple with optional
+        bounds, finished is True or False, parameter_filters is list of criteria dicts as for
+        find_measurements_by_parameter. Results are ordered by order_by ('started', 'name' or 'id',
+        prefixed with '-' for descending order) and then by ID. For keyset pagination pass the last
+        measurement of the previous page as after. Related entities are loaded according to loading profile.
+        """
+        if project is None:
+            project = self.session_manager.project_manager.project
+        elif not isinstance(project, Project):
+            project = self.session_manager.project_manager.get_projects(name=project, exact=True)
+            project = project[0] if project else None
+        if project is None:
+            record = 'Project to search measurements in not found'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        descending = str(order_by).startswith('-')
+        order_column = {'started': Measurement.started,
+                        'name': Measurement.name,
+                        'id': Measurement.id}.get(str(order_by).lstrip('-'), None)
+        if order_column is None:
+            record = 'Measurements can not be ordered by "%s"' % order_by
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        if after is not None and not isinstance(after, Measurement):
+            record = 'Expected last Measurement of previous page'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        q = self.session.query(Measurement).filter(Measurement.project_id == project.id,
+                                                   Measurement.deleted_at == None)
+        q = q.options(*loading_options(Measurement, profile, self.session_manager.strict_loading))
+        if name is not None:
+            q = q.filter(Measurement.name.ilike('%' + str(name) + '%'))
+        if type is not None:
+            if isinstance(type, MeasurementType):
+                type_path = type.path
+            else:
+                type_path = self.session.query(MeasurementType.path).filter(
+                    MeasurementType.name == str(type)).scalar()
+            if type_path is None:
+                return []
+            q = q.join(MeasurementType, Measurement.measurement_type_id == MeasurementType.id).filter(
+                subtree_criterion(MeasurementType.path, type_path))
+        if equipment is not None:
+            if isinstance(equipment, Equipment):
+                q = q.filter(Measurement.equipment_id == equipment.id)
+            else:
+                q = q.join(Equipment, Measurement.equipment_id == Equipment.id).filter(
+                    Equipment.name == str(equipment))
+        if sample is not None:
+            q = q.join(measurement_sample_table, measurement_sample_table.c.measurement_id == Measurement.id)
+            if isinstance(sample, Sample):
+                q = q.filter(measurement_sample_table.c.sample_id == sample.id)
+            else:
+                q = q.join(Sample, measurement_sample_table.c.sample_id == Sample.id).filter(
+                    Sample.name == str(sample))
+        if started_between is not None:
+            start, end = started_between
+            if start is not None:
+                q = q.filter(Measurement.started >= start)
+            if end is not None:
+                q = q.filter(Measurement.started <= end)
+        if finished is not None:
+            q = q.filter(Measurement.finished != None if finished else Measurement.finished == None)
+        if parameter_filters:
+            for number, criterion in enumerate(parameter_criteria(criteria=parameter_filters)):
+                q = q.filter(Measurement.id.in_(parameter_owners(self.session, measurement_parameter_table,
+                                                                 'measurement_id', criterion, number)))
+        if after is not None:
+            after_value = self.session.query(order_column).filter(Measurement.id == after.id).scalar_subquery()
+            q = q.filter(keyset_criterion(order_column, after_value, Measurement.id, after.id, descending))
+        if descending:
+            q = q.order_by(order_column.desc(), Measurement.id.desc())
+        else:
+            q = q.order_by(order_column, Measurement.id)
+        if limit is not None:
+            q = q.limit(int(limit))
+        return q.all()
+
+    @require_signed_in
+    @require_project_opened
+    def find_measurements_by_parameter(self, name=None, min=None, max=None, equals=None, unit=None, criteria=None,
+                                       profile=None):
+        """
+        Finds measurements of opened project having parameter (top-level or nested) with given name, unit
+        and value in [min, max] or equal to given value. Additional criteria dicts with the same keys
+        must all match as well.
+        """
+        project = self.session_manager.project_manager.project
+        q = self.session.query(Measurement).filter(Measurement.project_id == project.id,
+                                                   Measurement.deleted_at == None)
+        q = q.options(*loading_options(Measurement, profile, self.session_manager.strict_loading))
+        for number, criterion in enumerate(parameter_criteria(name, min, max, equals, unit, criteria)):
+            q = q.filter(Measurement.id.in_(parameter_owners(self.session, measurement_parameter_table,
+                                                             'measurement_id', criterion, number)))
+        return q.order_by(Measurement.id).all()
+
     @require_signed_in
     @require_project_opened
     def get_collection(self, name=None):
@@ -325,20 +659,33 @@ class MeasurementManager(EntityManager):
             q = self.session.query(DataChannel).filter(DataChannel.name == str(name))
             q = q.filter(DataChannel.measurement_id == measurement.id)
             data_channel = q.all()[0]
+            if data_channel.deleted_at is not None:
+                record = 'Data channel "%s" is deleted and waits for purge' % data_channel.name
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
             record = 'Data channel "%s" already exists' % data_channel.name
             self.session_manager.log_manager.log_record(record=record, category='Warning')
         return data_channel
 
     @require_signed_in
     @require_project_opened
-    def delete_data_channel(self, data_channel):
+    def delete_data_channel(self, data_channel, soft=False):
         if not isinstance(data_channel, DataChannel):
             record = 'Expected valid DataChannel object for delete operation'
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return False
-        self.session.delete(data_channel)
-        self.session.commit()
-        record = 'Data channel "%s" successfully deleted' % data_channel.name
+        project_id = data_channel.measurement.project_id
+        if soft:
+            if not tombstone(self.session, DataChannel, data_channel.id, project_id):
+                record = 'Data channel "%s" is already deleted' % data_channel.name
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return False
+            record = 'Data channel "%s" marked as deleted' % data_channel.name
+        else:
+            touch_project(self.session, project_id)
+            self.session.delete(data_channel)
+            self.session.commit()
+            record = 'Data channel "%s" successfully deleted' % data_channel.name
         self.session_manager.log_manager.log_record(record=record, category='Information')
         return True
 
@@ -346,6 +693,7 @@ class MeasurementManager(EntityManager):
     @require_project_opened
     def add_parameter_to_data_channel(self, data_channel, parameter):
         if isinstance(data_channel, DataChannel) and isinstance(parameter, Parameter):
+            parameter = self.session_manager.parameter_manager.intern_parameter(parameter)
             try:
                 data_channel.parameters.append(parameter)
                 self.session.commit()
@@ -383,9 +731,11 @@ class MeasurementManager(EntityManager):
 
     @require_signed_in
     @require_project_opened
-    def get_data_channels(self, measurement, name=None, exact=False):
+    def get_data_channels(self, measurement, name=None, exact=False, include_deleted=False):
         if isinstance(measurement, Measurement):
             q = self.session.query(DataChannel).filter(DataChannel.measurement_id == measurement.id)
+            if not include_deleted:
+                q = q.filter(DataChannel.deleted_at == None)
             if name is not None and len(str(name)) > 2:
                 if exact:
                     q = q.filter(DataChannel.name == str(name))
@@ -421,6 +771,7 @@ class MeasurementManager(EntityManager):
         if isinstance(measured, dt.datetime):
             data_point.measured = measured
         self.session.add(data_point)
+        touch_data_channel(self.session, channel.id, channel.measurement.project_id)
         self.session.commit()
         record = 'Data point added to channel "%s"' % channel.name
         self.session_manager.log_manager.log_record(record=record, category='Information')
@@ -433,6 +784,7 @@ class MeasurementManager(EntityManager):
             record = 'Expected valid DataPoint object for delete operation'
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return False
+        touch_data_channel(self.session, data_point.channel_id, data_point.channel.measurement.project_id)
         self.session.delete(data_point)
         self.session.commit()
         record = 'Data point successfully deleted'
@@ -466,7 +818,9 @@ class MeasurementManager(EntityManager):
                         'point_measured': measured[i],
                         'session_id': self.session_manager.session_data.id,
                         } for i in range(float_value.size)]
-        self.engine.execute(DataPoint.__table__.insert(), data_points)
+        self.session.execute(DataPoint.__table__.insert(), data_points)
+        touch_data_channel(self.session, channel.id, channel.measurement.project_id)
+        self.session.commit()
         elapsed = timeit.default_timer() - start_time
         record = '%i data points added to channel "%s" in %3.3f s' % (len(data_points), channel.name, elapsed)
         self.session_manager.log_manager.log_record(record=record, category='Information')
@@ -485,6 +839,7 @@ class MeasurementManager(EntityManager):
             q = q.filter(DataPoint.point_index.in_(point_index))
         count = q.delete(synchronize_session='fetch')
         # count = q.delete(synchronize_session=False) # try this if performance is low
+        touch_data_channel(self.session, channel.id, channel.measurement.project_id)
         self.session.commit()
         elapsed = timeit.default_timer() - start_time
         record = '%i data points deleted from channel "%s" in %3.3f s' % (count, channel.name, elapsed)
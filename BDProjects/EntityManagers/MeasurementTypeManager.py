@@ -1,12 +1,14 @@
 from __future__ import division, print_function
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.exc import NoResultFound
 
 from BDProjects.Entities import MeasurementType
 
 from .EntityManager import EntityManager
 from ._helpers import require_signed_in
+from ._hierarchy import measurement_type_path, subtree_criterion
+from ._hierarchy import rebase_measurement_type_paths, repair_measurement_type_paths
+from ._hierarchy import rebuild_measurement_type_paths, expire_measurement_type_paths
 
 
 class MeasurementTypeManager(EntityManager):
@@ -33,7 +35,17 @@ class MeasurementTypeManager(EntityManager):
                     return None
         try:
             self.session.add(measurement_type)
+            self.session.flush()
+            parent_path = None
+            if measurement_type.parent_id is not None:
+                parent_path = self.session.query(MeasurementType.path).filter(
+                    MeasurementType.id == measurement_type.parent_id).scalar()
+            if measurement_type.parent_id is not None and parent_path is None:
+                self._rebuild_paths()
+            else:
+                measurement_type.path = measurement_type_path(parent_path, measurement_type.id)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('measurement_type')
             record = 'Measurement type "%s" created' % measurement_type.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
         except IntegrityError:
@@ -48,7 +60,11 @@ class MeasurementTypeManager(EntityManager):
     def delete_measurement_type(self, measurement_type):
         if isinstance(measurement_type, MeasurementType):
             self.session.delete(measurement_type)
+            self.session.flush()
+            repair_measurement_type_paths(self.session)
             self.session.commit()
+            self.session_manager.name_cache.invalidate('measurement_type')
+            self.session_manager.name_cache.invalidate('equipment_types')
             record = 'Measurement type "%s" deleted' % measurement_type.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
@@ -57,23 +73,64 @@ class MeasurementTypeManager(EntityManager):
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return False
 
+    @require_signed_in
+    def move_measurement_type(self, measurement_type, parent=None):
+        """
+        Moves measurement type with all its subtypes under new parent (to the top level if parent is None).
+        Paths of the whole subtree are updated with single statement.
+        """
+        if not isinstance(measurement_type, MeasurementType) or \
+                not (parent is None or isinstance(parent, MeasurementType)):
+            record = 'Wrong argument for measurement type move operation'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return False
+        if measurement_type.path is None or (parent is not None and parent.path is None):
+            self._rebuild_paths()
+        old_path = measurement_type.path
+        parent_path = None
+        if parent is not None:
+            parent_path = parent.path
+            if parent_path.startswith(old_path):
+                record = 'Can not move measurement type "%s" under its own subtype' % measurement_type.name
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return False
+        measurement_type.parent_id = None if parent is None else parent.id
+        self.session.flush()
+        rebase_measurement_type_paths(self.session, old_path, measurement_type_path(parent_path, measurement_type.id))
+        self.session.commit()
+        record = 'Measurement type "%s" moved' % measurement_type.name
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return True
+
+    def _rebuild_paths(self):
+        """
+        Rebuilds materialized paths missing in database created by older version and not migrated yet.
+        """
+        rebuild_measurement_type_paths(self.session)
+        expire_measurement_type_paths(self.session)
+        record = 'Missing measurement type paths rebuilt, run "migrate" maintenance command to upgrade database'
+        self.session_manager.log_manager.log_record(record=record, category='Warning')
+
     @require_signed_in
     def get_measurement_types_tree(self, root=None):
+        """
+        Returns nested dict of measurement type names. If root name is given returns tree of its subtypes.
+        The tree is built from single query ordered by materialized path.
+        """
+        q = self.session.query(MeasurementType.id, MeasurementType.name, MeasurementType.parent_id)
+        if root is not None:
+            root_path = self.session.query(MeasurementType.path).filter(MeasurementType.name == str(root)).scalar()
+            if root_path is None:
+                return {}
+            q = q.filter(subtree_criterion(MeasurementType.path, root_path), MeasurementType.path != root_path)
+        rows = q.order_by(MeasurementType.path).all()
+        nodes = dict((row[0], {}) for row in rows)
         measurement_types = {}
-        if root is None:
-            roots = self.session.query(MeasurementType.name).filter(MeasurementType.parent_id == None).all()
-        else:
-            roots = []
-            try:
-                root_id = self.session.query(MeasurementType.id).filter(
-                    MeasurementType.name == str(root)).one()
-                if root_id:
-                    roots = self.session.query(MeasurementType.name).filter(
-                        MeasurementType.parent_id == root_id[0]).all()
-            except NoResultFound:
-                pass
-        for root in roots:
-            measurement_types[root[0]] = self.get_measurement_types(root[0])
+        for type_id, name, parent_id in rows:
+            if parent_id in nodes:
+                nodes[parent_id][name] = nodes[type_id]
+            else:
+                measurement_types[name] = nodes[type_id]
         return measurement_types
 
     @require_signed_in
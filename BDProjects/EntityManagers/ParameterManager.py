@@ -4,11 +4,16 @@ import datetime as dt
 import numpy as np
 import numbers
 
+from sqlalchemy import event
+
 from BDProjects import datetime_to_float, float_to_datetime
 from BDProjects.Entities import ParameterType, Parameter
 
 from .EntityManager import EntityManager
 from ._helpers import require_signed_in
+from ._bulk import load_parameter_trees, copy_parameter_tree, dangling_parameters_query, collect_dangling_parameters
+from ._fingerprint import default_fingerprint_tolerance, refresh_fingerprints
+from ._fingerprint import collect_changed_parameters, refresh_changed_fingerprints
 
 default_parameter_types = {'Generic': 'Unspecified parameter',
                            # Single value parameters
@@ -26,11 +31,58 @@ default_parameter_types = {'Generic': 'Unspecified parameter',
                            'NonUniform numeric grid': 'NonUniform numeric grid',
                            }
 
+# NonUniform grid points are stored as little-endian float64 blob
+grid_dtype = np.dtype('<f8')
+
 
 class ParameterManager(EntityManager):
 
     def __init__(self, session_manager):
         super(ParameterManager, self).__init__(session_manager)
+        self.interning = False
+        self.__parameter_type_ids = None
+        self.__parameter_type_names = None
+        self.session.info['fingerprint_tolerance'] = self.fingerprint_tolerance
+        if not event.contains(self.session, 'after_flush', collect_changed_parameters):
+            event.listen(self.session, 'after_flush', collect_changed_parameters)
+            event.listen(self.session, 'after_flush_postexec', refresh_changed_fingerprints)
+
+    @property
+    def fingerprint_tolerance(self):
+        return self.session_manager.session_manager.connector.config.get('fingerprint_tolerance',
+                                                                         default_fingerprint_tolerance)
+
+    @property
+    def parameter_type_ids(self):
+        """
+        Registry of parameter type IDs by name. Loaded once per client and refreshed when types are
+        created or deleted, or when unknown type name is requested.
+        """
+        if self.__parameter_type_ids is None:
+            self.refresh_parameter_types()
+        return self.__parameter_type_ids
+
+    @property
+    def parameter_type_names(self):
+        if self.__parameter_type_names is None:
+            self.refresh_parameter_types()
+        return self.__parameter_type_names
+
+    def refresh_parameter_types(self):
+        self.__parameter_type_ids = dict(self.session.query(ParameterType.name, ParameterType.id))
+        self.__parameter_type_names = dict((type_id, name) for name, type_id in self.__parameter_type_ids.items())
+
+    def parameter_type_id(self, parameter_type):
+        if isinstance(parameter_type, ParameterType):
+            parameter_type = parameter_type.name
+        if parameter_type not in self.parameter_type_ids:
+            self.refresh_parameter_types()
+        return self.parameter_type_ids.get(parameter_type, None)
+
+    def parameter_type_name(self, parameter):
+        if parameter.type_id not in self.parameter_type_names:
+            self.refresh_parameter_types()
+        return self.parameter_type_names.get(parameter.type_id, None)
 
     @require_signed_in
     def create_parameter_type(self, parameter_type, description=None):
@@ -40,6 +92,7 @@ class ParameterManager(EntityManager):
                 parameter_type_object.user_id = self.session_manager.user.id
                 self.session.add(parameter_type_object)
                 self.session.commit()
+                self.refresh_parameter_types()
                 if parameter_type_object.name not in default_parameter_types:
                     record = 'Parameter type "%s" successfully created' % parameter_type_object.name
                     self.session_manager.log_manager.log_record(record=record, category='Information')
@@ -63,24 +116,24 @@ class ParameterManager(EntityManager):
             return False
         self.session.delete(parameter_type)
         self.session.commit()
+        self.refresh_parameter_types()
         record = 'Parameter type "%s" deleted' % parameter_type.name
         self.session_manager.log_manager.log_record(record=record, category='Information')
         return True
 
     @require_signed_in
-    def _create_parameter(self, name, parameter_type, float_value=None, string_value=None,
+    def _create_parameter(self, name, parameter_type, float_value=None, string_value=None, binary_value=None,
                           index=0, unit_name=None, description=None, parent=None, commit=True,
                           suppres_log_message=False):
-        parameter_type_object, parameter_type_exists = self._check_parameter_type_name(parameter_type, description)
+        parameter_type_id = self.parameter_type_id(parameter_type)
         if unit_name is None:
             unit_name = ''
         else:
             unit_name = str(unit_name)
-        if not parameter_type_exists:
-            record = 'Parameter type "%s" not exist' % parameter_type_object.name
+        if parameter_type_id is None:
+            record = 'Parameter type "%s" not exist' % parameter_type
             self.session_manager.log_manager.log_record(record=record, category='Warning')
         else:
-            parameter_type_id = parameter_type_object.id
             parent_id = None
             if parent is not None:
                 if isinstance(parent, Parameter):
@@ -109,6 +162,8 @@ class ParameterManager(EntityManager):
                 parameter.string_value = string_value
             if float_value is not None:
                 parameter.float_value = float_value
+            if binary_value is not None:
+                parameter.binary_value = binary_value
             if commit:
                 self.commit_parameter(parameter)
                 if not suppres_log_message:
@@ -132,18 +187,49 @@ class ParameterManager(EntityManager):
             self.session_manager.log_manager.log_record(record=record, category='Warning')
             return False
         if parameter.parent:
-            if 'range' in parameter.parent.type.name and (parameter.name == 'start' or parameter.name == 'stop'):
+            parent_type_name = self.parameter_type_name(parameter.parent)
+            if 'range' in parent_type_name and (parameter.name == 'start' or parameter.name == 'stop'):
                 record = 'Can not delete START or STOP from RANGE parameter. Delete RANGE parameter itself.'
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
                 return False
+            if parent_type_name == 'Uniform numeric grid' and parameter.name in ('start', 'stop', 'num'):
+                record = 'Can not delete START, STOP or NUM from GRID parameter. Delete GRID parameter itself.'
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return False
         self.session.delete(parameter)
         self.session.commit()
         record = 'Parameter "%s" deleted' % parameter.name
         self.session_manager.log_manager.log_record(record=record, category='Information')
         return True
 
+    @require_signed_in
+    def load_parameter_tree(self, parameter):
+        """
+        Loads whole parameter subtree with single query. Returns the same parameter with children populated.
+        """
+        if not isinstance(parameter, Parameter):
+            record = 'Wrong argument for Parameter tree load operation'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        load_parameter_trees(self.session, [parameter])
+        return parameter
+
+    @require_signed_in
+    def load_parameter_trees(self, parameters):
+        """
+        Loads subtrees of all given parameters with single query. Returns list of all loaded parameters.
+        """
+        if not all(isinstance(parameter, Parameter) for parameter in parameters):
+            record = 'Wrong argument for Parameter tree load operation'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        return load_parameter_trees(self.session, parameters)
+
     @require_signed_in
     def copy_parameter(self, parameter, suppress_parent_warning=False, commit=True):
+        """
+        Copies parameter with its whole subtree in a single transaction with one INSERT per tree level.
+        """
         if not isinstance(parameter, Parameter):
             record = 'Wrong argument for Parameter copy operation'
             self.session_manager.log_manager.log_record(record=record, category='Warning')
@@ -151,19 +237,10 @@ class ParameterManager(EntityManager):
         if parameter.parent and not suppress_parent_warning:
             record = 'Parameter belongs to its PARENT. This information will be lost in parameter copy.'
             self.session_manager.log_manager.log_record(record=record, category='Warning')
-        new = self._create_parameter(name=parameter.name,
-                                     parameter_type=parameter.type,
-                                     float_value=parameter.float_value,
-                                     string_value=parameter.string_value,
-                                     index=parameter.index,
-                                     unit_name=parameter.unit_name,
-                                     description=parameter.description,
-                                     parent=None,
-                                     commit=commit,
-                                     suppres_log_message=True)
-        for child in parameter.children:
-            child_copy = self.copy_parameter(child, suppress_parent_warning=True, commit=commit)
-            child_copy.parent_id = new.id
+        new_id = copy_parameter_tree(self.session, parameter, self.session_manager.session_data.id)
+        new = self.session.query(Parameter).filter(Parameter.id == new_id).one()
+        if new.fingerprint is None:
+            refresh_fingerprints(self.session, [new], self.fingerprint_tolerance)
         if commit:
             self.session.commit()
             record = 'Parameter "%s" copied' % parameter.name
@@ -186,6 +263,37 @@ class ParameterManager(EntityManager):
             parameter_type_exists = True
         return parameter_type_object, parameter_type_exists
 
+    @require_signed_in
+    def intern_parameter(self, parameter):
+        """
+        In interning mode returns the oldest existing top-level parameter tree identical to the given one,
+        so attaching it to samples, measurements, channels or equipment shares one tree instead of a copy.
+        Interned trees are shared and must be treated as immutable. Otherwise returns parameter itself.
+        """
+        if not self.interning or not isinstance(parameter, Parameter):
+            return parameter
+        if parameter.parent_id is not None or parameter.fingerprint is None:
+            return parameter
+        canonical = self.session.query(Parameter).filter(Parameter.fingerprint == parameter.fingerprint,
+                                                         Parameter.parent_id == None).order_by(Parameter.id).first()
+        if canonical is None or canonical is parameter:
+            return parameter
+        record = 'Parameter "%s" interned (id=%d)' % (parameter.name, canonical.id)
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return canonical
+
+    @require_signed_in
+    def find_identical_parameters(self, parameter):
+        """
+        Returns parameters with the same fingerprint, i.e. with identical subtrees, using index lookup.
+        """
+        if not isinstance(parameter, Parameter) or parameter.fingerprint is None:
+            record = 'Expected valid Parameter object with fingerprint'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return []
+        return self.session.query(Parameter).filter(Parameter.fingerprint == parameter.fingerprint,
+                                                    Parameter.id != parameter.id).all()
+
     def get_parameter_types(self, name=None):
         q = self.session.query(ParameterType)
         if name is not None and len(str(name)) > 2:
@@ -256,30 +364,152 @@ class ParameterManager(EntityManager):
         self.create_datetime_parameter(name='stop', value=stop, parent=range_parameter, commit=commit)
         return range_parameter
 
+    def create_uniform_grid_parameter(self, name, start, stop, num, unit_name=None, description=None,
+                                      parent=None, commit=True):
+        if not (isinstance(start, numbers.Number) and isinstance(stop, numbers.Number)):
+            raise ValueError('Expected numeric value for start and stop')
+        if not isinstance(num, numbers.Integral) or num < 1:
+            raise ValueError('Expected positive integer number of grid points')
+        grid_parameter = self._create_parameter(name, parameter_type='Uniform numeric grid', unit_name=unit_name,
+                                                description=description, parent=parent, commit=commit)
+        self.create_numeric_parameter(name='start', value=start, parent=grid_parameter, commit=commit)
+        self.create_numeric_parameter(name='stop', value=stop, parent=grid_parameter, commit=commit)
+        self.create_numeric_parameter(name='num', value=num, parent=grid_parameter, commit=commit)
+        return grid_parameter
+
+    def create_nonuniform_grid_parameter(self, name, array, unit_name=None, description=None,
+                                         parent=None, commit=True):
+        array = np.ascontiguousarray(array, dtype=grid_dtype)
+        if array.ndim != 1:
+            raise ValueError('Expected one-dimensional array of grid points')
+        return self._create_parameter(name, parameter_type='NonUniform numeric grid',
+                                      binary_value=array.tobytes(), unit_name=unit_name, description=description,
+                                      parent=parent, commit=commit)
+
+    @require_signed_in
+    def create_parameters_from_dict(self, mapping, parent=None):
+        """
+        Creates parameter trees from nested dict in one flush and one commit. Parameter types are inferred from
+        values: nested dicts, numbers, bools, strings, datetimes, (start, stop) tuples as ranges,
+        (start, stop, num) tuples as uniform grids and one-dimensional arrays as nonuniform grids.
+        Returns list of created top-level parameters.
+        """
+        if not isinstance(mapping, dict):
+            record = 'Expected dict of parameter values'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        parent_id = None
+        if parent is not None:
+            if not isinstance(parent, Parameter):
+                record = 'Parent must be valid Parameter'
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
+            parent_id = parent.id
+        parameters = self.build_parameters_from_dict(mapping)
+        for parameter in parameters:
+            parameter.parent_id = parent_id
+        self.session.add_all(parameters)
+        self.session.commit()
+        record = 'Created %d parameters from dict' % len(parameters)
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return parameters
+
+    @require_signed_in
+    def build_parameters_from_dict(self, mapping):
+        """
+        Builds unsaved parameter trees from nested dict with types inferred as in create_parameters_from_dict.
+        The caller adds them to the session and refreshes their fingerprints after flush.
+        """
+        type_ids = self.parameter_type_ids
+        session_id = self.session_manager.session_data.id
+        return [self._parameter_from_value(name, value, type_ids, session_id) for name, value in mapping.items()]
+
+    def _parameter_from_value(self, name, value, type_ids, session_id):
+        def new_parameter(parameter_type, parameter_name=name, **kwargs):
+            return Parameter(name=str(parameter_name), type_id=type_ids[parameter_type], unit_name='', index=0,
+                             session_id=session_id, **kwargs)
+
+        def bounds(value_type, values, convert=float):
+            return [new_parameter(value_type, child_name, float_value=convert(child_value))
+                    for child_name, child_value in zip(('start', 'stop', 'num'), values)]
+
+        if isinstance(value, dict):
+            parameter = new_parameter('Dictionary')
+            parameter.children = [self._parameter_from_value(child_name, child_value, type_ids, session_id)
+                                  for child_name, child_value in value.items()]
+        elif isinstance(value, (bool, np.bool_)):
+            parameter = new_parameter('Boolean value', float_value=float(bool(value)))
+        elif isinstance(value, numbers.Number):
+            parameter = new_parameter('Numeric value', float_value=float(value))
+        elif isinstance(value, str):
+            parameter = new_parameter('String value', string_value=value)
+        elif isinstance(value, dt.datetime):
+            parameter = new_parameter('DateTime value', float_value=datetime_to_float(value))
+        elif isinstance(value, tuple) and len(value) == 2 and all(isinstance(v, dt.datetime) for v in value):
+            parameter = new_parameter('DateTime range')
+            parameter.children = bounds('DateTime value', value, datetime_to_float)
+        elif isinstance(value, tuple) and len(value) == 2 and all(isinstance(v, numbers.Number) for v in value):
+            parameter = new_parameter('Numeric range')
+            parameter.children = bounds('Numeric value', value)
+        elif isinstance(value, tuple) and len(value) == 3 and all(isinstance(v, numbers.Number) for v in value) \
+                and isinstance(value[2], numbers.Integral) and value[2] > 0:
+            parameter = new_parameter('Uniform numeric grid')
+            parameter.children = bounds('Numeric value', value)
+        elif isinstance(value, np.ndarray) and value.ndim == 1:
+            array = np.ascontiguousarray(value, dtype=grid_dtype)
+            parameter = new_parameter('NonUniform numeric grid', binary_value=array.tobytes())
+        else:
+            raise ValueError('Can not infer parameter type for "%s" value' % name)
+        return parameter
+
+    @require_signed_in
+    def to_dict(self, parameters):
+        """
+        Reads parameter trees back into nested dict in the form accepted by create_parameters_from_dict.
+        Subtrees are loaded with single query.
+        """
+        if isinstance(parameters, Parameter):
+            parameters = [parameters]
+        if not all(isinstance(parameter, Parameter) for parameter in parameters):
+            record = 'Wrong argument for Parameter to dict conversion'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        load_parameter_trees(self.session, parameters)
+        return dict((parameter.name, _parameter_to_value(parameter, self.parameter_type_names))
+                    for parameter in parameters)
+
     @require_signed_in
-    def get_dangling_parameters(self, delete=False):
-        q = self.session.query(Parameter).filter(Parameter.parent == None)
-        q = q.filter(Parameter.measurements == None)
-        q = q.filter(Parameter.samples == None)
-        q = q.filter(Parameter.equipment == None)
-        q = q.filter(Parameter.data_channels == None)
+    def get_dangling_parameters(self, delete=False, batch_size=1000):
+        """
+        Finds top-level parameters not used by any sample, measurement, data channel or equipment.
+        If delete is True removes them with their subtrees in batches and returns number of deleted
+        top-level parameters, as before; the number of all deleted nodes is logged.
+        """
         if delete:
-            result = q.delete(synchronize_session='fetch')
-            self.session.commit()
-            record = 'Deleted %i dangling Parameters' % result
+            counts = collect_dangling_parameters(self.session, batch_size)
+            result = counts['trees']
+            record = 'Deleted %i dangling Parameters with %i nested ones' % (result, counts['parameters'] - result)
             self.session_manager.log_manager.log_record(record=record, category='Information')
         else:
-            result = q.all()
+            result = self.session.query(Parameter).filter(
+                Parameter.id.in_(dangling_parameters_query(self.session))).order_by(Parameter.id).all()
             self.session.commit()
             record = 'Found %i dangling Parameters' % len(result)
             self.session_manager.log_manager.log_record(record=record, category='Information')
         return result
 
 
-def get_range_parameter_value(parameter):
+def _type_name(parameter, type_names):
+    if type_names is None:
+        return parameter.type.name
+    return type_names[parameter.type_id]
+
+
+def get_range_parameter_value(parameter, type_names=None):
     if not isinstance(parameter, Parameter):
         raise ValueError('Expected valid Parameter object')
-    if parameter.type.name not in ['DateTime range', 'Numeric range']:
+    type_name = _type_name(parameter, type_names)
+    if type_name not in ['DateTime range', 'Numeric range']:
         raise ValueError('Expected valid Parameter object of range type')
     start = None
     stop = None
@@ -288,7 +518,46 @@ def get_range_parameter_value(parameter):
             start = child.float_value
         elif child.name == 'stop':
             stop = child.float_value
-    if parameter.type.name == 'DateTime range':
+    if type_name == 'DateTime range':
         start = float_to_datetime(start)
         stop = float_to_datetime(stop)
     return start, stop
+
+
+def _parameter_to_value(parameter, type_names):
+    type_name = type_names[parameter.type_id]
+    if type_name == 'Dictionary':
+        return dict((child.name, _parameter_to_value(child, type_names)) for child in parameter.children)
+    if type_name == 'String value':
+        return parameter.string_value
+    if type_name == 'Boolean value':
+        return bool(parameter.float_value)
+    if type_name == 'DateTime value':
+        return float_to_datetime(parameter.float_value)
+    if type_name in ('Numeric range', 'DateTime range', 'Uniform numeric grid'):
+        values = dict((child.name, _parameter_to_value(child, type_names)) for child in parameter.children)
+        if type_name == 'Uniform numeric grid':
+            return values['start'], values['stop'], int(values['num'])
+        return values['start'], values['stop']
+    if type_name == 'NonUniform numeric grid':
+        return np.frombuffer(parameter.binary_value, dtype=grid_dtype)
+    if parameter.float_value is None:
+        return parameter.string_value
+    return parameter.float_value
+
+
+def get_grid_parameter_value(parameter, type_names=None):
+    """
+    Returns grid points as NumPy array. Uniform grid is expanded from its start, stop and num values,
+    NonUniform grid is a read-only view of the stored blob without copying.
+    type_names maps type IDs to names (e.g. ParameterManager.parameter_type_names) to avoid loading parameter type.
+    """
+    if not isinstance(parameter, Parameter):
+        raise ValueError('Expected valid Parameter object')
+    type_name = _type_name(parameter, type_names)
+    if type_name == 'NonUniform numeric grid':
+        return np.frombuffer(parameter.binary_value, dtype=grid_dtype)
+    if type_name != 'Uniform numeric grid':
+        raise ValueError('Expected valid Parameter object of grid type')
+    values = dict((child.name, child.float_value) for child in parameter.children)
+    return np.linspace(values['start'], values['stop'], int(values['num']))
@@ -1,16 +1,34 @@
 from __future__ import division, print_function
 
 import os
+import json
+import zipfile
 import datetime
+import timeit
 
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
+from BDProjects import __version__
 from BDProjects.Entities import Session
 from BDProjects.Entities import Project, SessionProject
+from BDProjects.Entities import Log
+from BDProjects.Entities import Sample
+from BDProjects.Entities import MeasurementType, Equipment
+from BDProjects.Entities import Measurement, MeasurementsCollection
+from BDProjects.Entities import DataChannel, DataPoint
+from BDProjects.Entities.Sample import association_table as sample_parameter_table
+from BDProjects.Entities.Measurement import measurement_sample_table, measurement_parameter_table
+from BDProjects.Entities.Measurement import measurement_collection_table
+from BDProjects.Entities.DataPoint import channel_parameter_table
 
 from .EntityManager import EntityManager
 from BDProjects.EntityManagers import LogManager
 from ._helpers import require_signed_in
+from ._bundle import bundle_format, manifest_name, data_point_fields
+from ._bundle import datetime_to_spec, spec_to_datetime, parameter_to_spec, insert_parameter_specs
+from ._bundle import save_array, load_array, data_points_to_arrays, arrays_to_data_points
+from ._bulk import clone_project_rows, delete_project_rows, tombstone, insert_returning_ids
 
 
 class ProjectManager(EntityManager):
@@ -18,6 +36,7 @@ class ProjectManager(EntityManager):
     def __init__(self, session_manager):
         super(ProjectManager, self).__init__(session_manager)
         self._log_manager_backup = None
+        self.__summaries = {}
 
     @require_signed_in
     def create_project(self, name, data_dir, description=None):
@@ -36,6 +55,10 @@ class ProjectManager(EntityManager):
             except IntegrityError:
                 self.session.rollback()
                 project = self.session.query(Project).filter(Project.name == str(name)).all()[0]
+                if project.deleted_at is not None:
+                    record = 'Project "%s" is deleted and waits for purge' % project.name
+                    self.session_manager.log_manager.log_record(record=record, category='Warning')
+                    return None
                 record = 'Project "%s" already exists' % project.name
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
             return project
@@ -45,12 +68,41 @@ class ProjectManager(EntityManager):
             return None
 
     @require_signed_in
-    def delete_project(self, project):
+    def delete_project(self, project, bulk=False, soft=False, chunk_size=10000, progress=None):
+        """
+        Deletes project with all its data. With bulk=True dependent rows are removed with chunked
+        set-based DELETE statements instead of loading them into the ORM session,
+        progress(table_name, deleted_rows) is called after every chunk.
+        With soft=True project is only marked as deleted and is physically removed later by purge job.
+        """
         if isinstance(project, Project):
             if project in self.session:
-                self.session.delete(project)
-                self.session.commit()
-                record = 'Project "%s" successfully deleted' % project.name
+                if soft:
+                    if self.project is project:
+                        self.close_project()
+                    if not tombstone(self.session, Project, project.id):
+                        record = 'Project "%s" is already deleted' % project.name
+                        self.session_manager.log_manager.log_record(record=record, category='Warning')
+                        return False
+                    self.invalidate_project_summary(project)
+                    record = 'Project "%s" marked as deleted' % project.name
+                elif bulk:
+                    start_time = timeit.default_timer()
+                    self.session.refresh(project)
+                    self.session.expunge(project)
+                    if self.project is project:
+                        self.project = None
+                        self.session_manager.log_manager = self._log_manager_backup
+                    counts = delete_project_rows(self.session, project.id, chunk_size, progress)
+                    self.invalidate_project_summary(project)
+                    self.session.expire_all()
+                    elapsed = timeit.default_timer() - start_time
+                    record = 'Project "%s" (%i measurements, %i data points) deleted in bulk in %3.3f s' % (
+                        project.name, counts['measurements'], counts['data_points'], elapsed)
+                else:
+                    self.session.delete(project)
+                    self.session.commit()
+                    record = 'Project "%s" successfully deleted' % project.name
                 self.session_manager.log_manager.log_record(record=record,
                                                             category='Information')
                 return True
@@ -66,8 +118,10 @@ class ProjectManager(EntityManager):
             return False
 
     @require_signed_in
-    def get_projects(self, name=None, exact=False):
+    def get_projects(self, name=None, exact=False, include_deleted=False):
         q = self.session.query(Project)
+        if not include_deleted:
+            q = q.filter(Project.deleted_at == None)
         if name is not None:
             if exact:
                 q = q.filter(Project.name == str(name))
@@ -174,3 +228,371 @@ class ProjectManager(EntityManager):
                 record = 'Project "%s" is not opened' % str(project)
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
+
+    @require_signed_in
+    def get_project_summary(self, project=None, cached=False):
+        """
+        Returns dictionary with project statistics computed by a handful of aggregate queries.
+        If cached is True data points are counted incrementally: the snapshot keeps count and revision
+        of every data channel and only channels with changed revision are recounted.
+        Channel revision is incremented in the same transaction by every change of its data points,
+        so changes made by other clients are seen as well.
+        """
+        if project is None:
+            project = self.project
+        if not isinstance(project, Project):
+            record = 'Provide a valid project to summarize, or None for current project'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        samples_num, samples_created = self.session.query(func.count(Sample.id), func.max(Sample.created)).filter(
+            Sample.project_id == project.id, Sample.deleted_at == None).one()
+        q = self.session.query(MeasurementType.name, func.count(Measurement.id),
+                               func.max(Measurement.started), func.max(Measurement.finished))
+        q = q.select_from(Measurement).outerjoin(MeasurementType, Measurement.measurement_type_id == MeasurementType.id)
+        q = q.filter(Measurement.project_id == project.id, Measurement.deleted_at == None)
+        q = q.group_by(Measurement.measurement_type_id, MeasurementType.name)
+        measurements_by_type = {}
+        activity = [samples_created]
+        for name, count, started, finished in q.all():
+            measurements_by_type[name] = count
+            activity += [started, finished]
+        q = self.session.query(Equipment.name, func.count(Measurement.id))
+        q = q.select_from(Measurement).outerjoin(Equipment, Measurement.equipment_id == Equipment.id)
+        q = q.filter(Measurement.project_id == project.id, Measurement.deleted_at == None)
+        q = q.group_by(Measurement.equipment_id, Equipment.name)
+        measurements_by_equipment = dict(q.all())
+        collections_num = self.session.query(func.count(MeasurementsCollection.id)).filter(
+            MeasurementsCollection.project_id == project.id).scalar()
+        activity.append(self.session.query(func.max(Log.created)).filter(Log.project_id == project.id).scalar())
+        channels = self.session.query(DataChannel.id, DataChannel.revision).join(
+            Measurement, DataChannel.measurement_id == Measurement.id).filter(
+            Measurement.project_id == project.id, Measurement.deleted_at == None,
+            DataChannel.deleted_at == None).all()
+        snapshot = self.__summaries.get(project.id, None) if cached else None
+        if snapshot is None:
+            q = self.session.query(DataPoint.channel_id, func.count(DataPoint.id))
+            q = q.join(DataChannel, DataPoint.channel_id == DataChannel.id)
+            q = q.join(Measurement, DataChannel.measurement_id == Measurement.id)
+            q = q.filter(Measurement.project_id == project.id, Measurement.deleted_at == None,
+                         DataChannel.deleted_at == None)
+            counts = dict(q.group_by(DataPoint.channel_id).all())
+            stale = set(channel_id for channel_id, _ in channels)
+        else:
+            stale = set(channel_id for channel_id, channel_revision in channels
+                        if channel_id not in snapshot or snapshot[channel_id][0] != channel_revision)
+            counts = {}
+            stale_ids = sorted(stale)
+            for i in range(0, len(stale_ids), 500):
+                q = self.session.query(DataPoint.channel_id, func.count(DataPoint.id))
+                q = q.filter(DataPoint.channel_id.in_(stale_ids[i:i + 500])).group_by(DataPoint.channel_id)
+                counts.update(q.all())
+        channel_counts = {}
+        for channel_id, channel_revision in channels:
+            if channel_id in stale:
+                channel_counts[channel_id] = (channel_revision, counts.get(channel_id, 0))
+            else:
+                channel_counts[channel_id] = snapshot[channel_id]
+        points_num = sum(count for _, count in channel_counts.values())
+        channels_num = len(channels)
+        activity = [moment for moment in activity if moment is not None]
+        summary = {'samples': samples_num,
+                   'measurements': sum(measurements_by_type.values()),
+                   'measurements_by_type': measurements_by_type,
+                   'measurements_by_equipment': measurements_by_equipment,
+                   'data_channels': channels_num,
+                   'data_points': points_num,
+                   'collections': collections_num,
+                   'last_activity': max(activity) if activity else None}
+        self.__summaries[project.id] = channel_counts
+        return summary
+
+    def invalidate_project_summary(self, project=None):
+        """
+        Drops cached data points counts of the project (of all projects if None).
+        """
+        if project is None:
+            self.__summaries = {}
+        else:
+            project_id = project.id if isinstance(project, Project) else project
+            self.__summaries.pop(project_id, None)
+
+    @require_signed_in
+    def export_project(self, project, path, chunk_size=100000):
+        """
+        Exports project to a single zip archive with JSON manifest and data arrays in NumPy binary format.
+        Data points are streamed chunk by chunk, so memory usage is bounded by chunk_size.
+        """
+        start_time = timeit.default_timer()
+        if not isinstance(project, Project):
+            record = 'Wrong argument for project export operation'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return False
+        manifest = {'format': bundle_format,
+                    'version': __version__,
+                    'project': {'name': project.name, 'description': project.description},
+                    'samples': [],
+                    'measurements': [],
+                    'collections': []}
+        type_names = self.session_manager.parameter_manager.parameter_type_names
+        points_num = 0
+        with zipfile.ZipFile(str(path), 'w', zipfile.ZIP_DEFLATED) as bundle:
+            q = self.session.query(Sample).filter(Sample.project_id == project.id, Sample.deleted_at == None)
+            for sample in q.order_by(Sample.id):
+                manifest['samples'].append({'id': sample.id,
+                                            'name': sample.name,
+                                            'description': sample.description,
+                                            'parameters': [parameter_to_spec(parameter, type_names)
+                                                           for parameter in sample.parameters]})
+            q = self.session.query(Measurement).filter(Measurement.project_id == project.id,
+                                                       Measurement.deleted_at == None)
+            for measurement in q.order_by(Measurement.id):
+                measurement_spec = {'id': measurement.id,
+                                    'name': measurement.name,
+                                    'description': measurement.description,
+                                    'measurement_type': None,
+                                    'equipment': None,
+                                    'started': datetime_to_spec(measurement.started),
+                                    'finished': datetime_to_spec(measurement.finished),
+                                    'progress': measurement.progress,
+                                    'input_data': measurement.input_data_id,
+                                    'samples': [sample.id for sample in measurement.samples
+                                                if sample.deleted_at is None],
+                                    'parameters': [parameter_to_spec(parameter, type_names)
+                                                   for parameter in measurement.parameters],
+                                    'channels': []}
+                if measurement.measurement_type is not None:
+                    measurement_spec['measurement_type'] = measurement.measurement_type.name
+                if measurement.equipment is not None:
+                    measurement_spec['equipment'] = {'name': measurement.equipment.name,
+                                                     'serial_number': measurement.equipment.serial_number}
+                for channel in measurement.data_channels:
+                    if channel.deleted_at is not None:
+                        continue
+                    channel_spec = {'id': channel.id,
+                                    'name': channel.name,
+                                    'description': channel.description,
+                                    'unit_name': channel.unit_name,
+                                    'parameters': [parameter_to_spec(parameter, type_names)
+                                                   for parameter in channel.parameters],
+                                    'chunks': self._export_data_points(bundle, channel, chunk_size)}
+                    points_num += sum(chunk['size'] for chunk in channel_spec['chunks'])
+                    measurement_spec['channels'].append(channel_spec)
+                manifest['measurements'].append(measurement_spec)
+            q = self.session.query(MeasurementsCollection).filter(MeasurementsCollection.project_id == project.id)
+            for collection in q.order_by(MeasurementsCollection.id):
+                manifest['collections'].append({'id': collection.id,
+                                                'name': collection.name,
+                                                'description': collection.description,
+                                                'measurements': [measurement.id
+                                                                 for measurement in collection.measurements
+                                                                 if measurement.deleted_at is None]})
+            bundle.writestr(manifest_name, json.dumps(manifest, indent=1))
+        elapsed = timeit.default_timer() - start_time
+        record = 'Project "%s" (%i data points) exported to "%s" in %3.3f s' % (project.name, points_num,
+                                                                               path, elapsed)
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return True
+
+    def _export_data_points(self, bundle, channel, chunk_size):
+        chunks = []
+        last_id = 0
+        while True:
+            q = self.session.query(DataPoint.id, DataPoint.point_index, DataPoint.float_value,
+                                   DataPoint.string_value, DataPoint.measured)
+            q = q.filter(DataPoint.channel_id == channel.id, DataPoint.id > last_id)
+            rows = q.order_by(DataPoint.id).limit(chunk_size).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            arrays = data_points_to_arrays([row[1:] for row in rows])
+            prefix = 'data/%d/%06d_' % (channel.id, len(chunks))
+            for field in arrays:
+                save_array(bundle, prefix + field + '.npy', arrays[field])
+            chunks.append({'prefix': prefix, 'size': len(rows), 'fields': sorted(arrays.keys())})
+        return chunks
+
+    @require_signed_in
+    def import_project(self, path, name=None, data_dir=None):
+        """
+        Imports project from archive created by export_project. Measurement types and equipment
+        are resolved by name in the target database. Rows of every kind are inserted in bulk with IDs
+        assigned by the database and remapped in memory, data points chunk by chunk. Everything is done
+        in one transaction, which is rolled back if the bundle turns out to be broken.
+        """
+        start_time = timeit.default_timer()
+        path = str(path)
+        if not zipfile.is_zipfile(path):
+            record = 'File "%s" is not a valid project bundle' % path
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        with zipfile.ZipFile(path, 'r') as bundle:
+            try:
+                manifest = json.loads(bundle.read(manifest_name).decode('utf-8'))
+            except (KeyError, ValueError):
+                manifest = None
+            if not isinstance(manifest, dict) or manifest.get('format', None) != bundle_format:
+                record = 'File "%s" is not a valid project bundle' % path
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
+            try:
+                if name is None:
+                    name = manifest['project']['name']
+                if data_dir is None:
+                    data_dir = os.path.dirname(os.path.abspath(path))
+                if self.session.query(Project.id).filter(Project.name == str(name)).first() is not None:
+                    record = 'Project "%s" already exists' % name
+                    self.session_manager.log_manager.log_record(record=record, category='Warning')
+                    return None
+                project, points_num, missing = self._import_bundle(bundle, manifest, name, data_dir)
+                self.session.commit()
+            except (KeyError, TypeError, ValueError, zipfile.BadZipfile, SQLAlchemyError):
+                self.session.rollback()
+                record = 'Import of project bundle "%s" failed, changes rolled back' % path
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
+        for record in missing:
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+        elapsed = timeit.default_timer() - start_time
+        record = 'Project "%s" (%i data points) imported from "%s" in %3.3f s' % (project.name, points_num,
+                                                                                 path, elapsed)
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return project
+
+    def _import_bundle(self, bundle, manifest, name, data_dir):
+        session_id = self.session_manager.session_data.id
+        parameter_manager = self.session_manager.parameter_manager
+        project = Project(name=str(name), description=manifest['project']['description'],
+                          data_dir=str(data_dir), created_session_id=session_id)
+        self.session.add(project)
+        self.session.flush()
+
+        def insert(table, specs, row):
+            ids = insert_returning_ids(self.session, table, [row(spec) for spec in specs])
+            return dict(zip([spec['id'] for spec in specs], ids))
+
+        def insert_links(table, rows):
+            if rows:
+                self.session.execute(table.insert(), rows)
+
+        sample_ids = insert(Sample.__table__, manifest['samples'], lambda spec: {
+            'name': spec['name'], 'description': spec['description'],
+            'project_id': project.id, 'session_id': session_id})
+        collection_ids = insert(MeasurementsCollection.__table__, manifest['collections'], lambda spec: {
+            'name': spec['name'], 'description': spec['description'],
+            'project_id': project.id, 'session_id': session_id})
+        missing, resolved = [], {}
+
+        def measurement_row(spec):
+            equipment = spec['equipment']
+            type_key = ('measurement_type', spec['measurement_type'])
+            equipment_key = ('equipment', None if equipment is None else (equipment['name'],
+                                                                           equipment['serial_number']))
+            if type_key not in resolved:
+                resolved[type_key] = self._resolve_measurement_type(spec['measurement_type'], missing)
+            if equipment_key not in resolved:
+                resolved[equipment_key] = self._resolve_equipment(equipment, missing)
+            input_data = spec['input_data']
+            return {'name': spec['name'], 'description': spec['description'],
+                    'started': spec_to_datetime(spec['started']), 'finished': spec_to_datetime(spec['finished']),
+                    'progress': spec['progress'], 'project_id': project.id, 'session_id': session_id,
+                    'measurement_type_id': resolved[type_key], 'equipment_id': resolved[equipment_key],
+                    'input_data_id': None if input_data is None else collection_ids.get(input_data, None)}
+
+        measurement_ids = insert(Measurement.__table__, manifest['measurements'], measurement_row)
+        channel_specs = [(measurement_ids[measurement_spec['id']], channel_spec)
+                         for measurement_spec in manifest['measurements']
+                         for channel_spec in measurement_spec['channels']]
+        channel_ids = insert_returning_ids(self.session, DataChannel.__table__, [
+            {'name': spec['name'], 'description': spec['description'], 'unit_name': spec['unit_name'],
+             'measurement_id': measurement_id, 'session_id': session_id} for measurement_id, spec in channel_specs])
+        insert_links(measurement_sample_table, [
+            {'measurement_id': measurement_ids[spec['id']], 'sample_id': sample_ids[sample_id]}
+            for spec in manifest['measurements'] for sample_id in spec['samples']])
+        insert_links(measurement_collection_table, [
+            {'collection_id': collection_ids[spec['id']], 'measurement_id': measurement_ids[measurement_id]}
+            for spec in manifest['collections'] for measurement_id in spec['measurements']])
+        owners = [(sample_parameter_table, 'sample_id', sample_ids[spec['id']], spec['parameters'])
+                  for spec in manifest['samples']]
+        owners += [(measurement_parameter_table, 'measurement_id', measurement_ids[spec['id']], spec['parameters'])
+                   for spec in manifest['measurements']]
+        owners += [(channel_parameter_table, 'channel_id', channel_id, spec['parameters'])
+                   for channel_id, (_, spec) in zip(channel_ids, channel_specs)]
+        parameter_ids = iter(insert_parameter_specs(self.session, [parameter_spec for _, _, _, specs in owners
+                                                                   for parameter_spec in specs],
+                                                    parameter_manager.parameter_type_ids, session_id,
+                                                    parameter_manager.fingerprint_tolerance))
+        links = {}
+        for table, owner_name, owner_id, specs in owners:
+            for _ in specs:
+                links.setdefault(table, []).append({owner_name: owner_id, 'parameter_id': next(parameter_ids)})
+        for table, rows in links.items():
+            insert_links(table, rows)
+        points_num = 0
+        for channel_id, (_, channel_spec) in zip(channel_ids, channel_specs):
+            for chunk in channel_spec['chunks']:
+                arrays = dict((field, load_array(bundle, chunk['prefix'] + field + '.npy'))
+                              for field in chunk['fields'] if field in data_point_fields)
+                data_points = arrays_to_data_points(arrays, channel_id, session_id)
+                insert_links(DataPoint.__table__, data_points)
+                points_num += len(data_points)
+        return project, points_num, missing
+
+    @require_signed_in
+    def clone_project(self, project, new_name, include_data=False, data_dir=None):
+        """
+        Clones project samples, measurements, data channels and their parameter trees. IDs of copies are
+        assigned by the database. Data points are copied only if include_data is True, inside the database
+        with INSERT ... SELECT statements. Everything is done in one transaction.
+        """
+        if not isinstance(project, Project):
+            record = 'Wrong argument for project clone operation'
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        if self.session.query(Project.deleted_at).filter(Project.id == project.id).scalar() is not None:
+            record = 'Project "%s" is deleted and waits for purge' % project.name
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        if self.session.query(Project.id).filter(Project.name == str(new_name)).first() is not None:
+            record = 'Project "%s" already exists' % new_name
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        start_time = timeit.default_timer()
+        if data_dir is None:
+            data_dir = project.data_dir
+        session_id = self.session_manager.session_data.id
+        clone = Project(name=str(new_name), description=project.description, data_dir=str(data_dir),
+                        created_session_id=session_id)
+        self.session.add(clone)
+        self.session.flush()
+        try:
+            counts = clone_project_rows(self.session, project.id, clone.id, session_id, include_data=include_data)
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            record = 'Project "%s" clone failed' % project.name
+            self.session_manager.log_manager.log_record(record=record, category='Warning')
+            return None
+        self.session.expire_all()
+        elapsed = timeit.default_timer() - start_time
+        record = 'Project "%s" cloned to "%s" (%i samples, %i measurements, %i data points) in %3.3f s' % (
+            project.name, clone.name, counts['samples'], counts['measurements'], counts['data_points'], elapsed)
+        self.session_manager.log_manager.log_record(record=record, category='Information')
+        return clone
+
+    def _resolve_measurement_type(self, name, missing):
+        if name is None:
+            return None
+        measurement_type_id = self.session.query(MeasurementType.id).filter(MeasurementType.name == name).scalar()
+        if measurement_type_id is None:
+            missing.append('Measurement type "%s" not found' % name)
+        return measurement_type_id
+
+    def _resolve_equipment(self, equipment, missing):
+        if equipment is None:
+            return None
+        equipment_id = self.session.query(Equipment.id).filter(
+            Equipment.name == equipment['name'],
+            Equipment.serial_number == equipment['serial_number']).scalar()
+        if equipment_id is None:
+            missing.append('Equipment "%s (s/n: %s)" not found' % (equipment['name'], equipment['serial_number']))
+        return equipment_id
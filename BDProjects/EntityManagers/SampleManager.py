@@ -1,6 +1,8 @@
 from __future__ import division, print_function
 
-from sqlalchemy import and_
+import numpy as np
+
+from sqlalchemy import and_, func, case, literal
 from sqlalchemy.exc import IntegrityError
 
 from BDProjects.Entities import Sample
@@ -8,6 +10,9 @@ from BDProjects.Entities import Parameter
 
 from .EntityManager import EntityManager
 from ._helpers import require_signed_in, require_project_opened
+from ._bulk import tombstone, load_parameter_trees, sample_parameter_table
+from ._search import parameter_criteria, parameter_owners
+from ._loading import loading_options
 
 
 class SampleManager(EntityManager):
@@ -33,19 +38,30 @@ class SampleManager(EntityManager):
             self.session.rollback()
             sample = self.session.query(Sample).filter(and_(Sample.name == name,
                                                             Sample.project_id == project.id)).all()[0]
+            if sample.deleted_at is not None:
+                record = 'Sample "%s" is deleted and waits for purge' % sample.name
+                self.session_manager.log_manager.log_record(record=record, category='Warning')
+                return None
             record = 'Sample "%s" already exists' % sample.name
             self.session_manager.log_manager.log_record(record=record, category='Warning')
         return sample
 
     @require_signed_in
     @require_project_opened
-    def delete_sample(self, sample):
+    def delete_sample(self, sample, soft=False):
         project = self.session_manager.project_manager.project
         check_sample = isinstance(sample, Sample) and sample.project_id == project.id
         if check_sample:
-            self.session.delete(sample)
-            self.session.commit()
-            record = 'Sample "%s" successfully deleted' % sample.name
+            if soft:
+                if not tombstone(self.session, Sample, sample.id):
+                    record = 'Sample "%s" is already deleted' % sample.name
+                    self.session_manager.log_manager.log_record(record=record, category='Warning')
+                    return False
+                record = 'Sample "%s" marked as deleted' % sample.name
+            else:
+                self.session.delete(sample)
+                self.session.commit()
+                record = 'Sample "%s" successfully deleted' % sample.name
             self.session_manager.log_manager.log_record(record=record, category='Information')
             return True
         else:
@@ -55,9 +71,12 @@ class SampleManager(EntityManager):
 
     @require_signed_in
     @require_project_opened
-    def get_samples(self, name=None, exact=False):
+    def get_samples(self, name=None, exact=False, include_deleted=False, profile=None):
         project = self.session_manager.project_manager.project
         q = self.session.query(Sample).filter(Sample.project_id == project.id)
+        q = q.options(*loading_options(Sample, profile, self.session_manager.strict_loading))
+        if not include_deleted:
+            q = q.filter(Sample.deleted_at == None)
         if name is not None and len(str(name)) > 2:
             if exact:
                 q = q.filter(Sample.name == str(name))
@@ -66,10 +85,67 @@ class SampleManager(EntityManager):
                 q = q.filter(Sample.name.ilike(template))
         return q.all()
 
+    @require_signed_in
+    @require_project_opened
+    def find_samples_by_parameter(self, name=None, min=None, max=None, equals=None, unit=None, criteria=None,
+                                  profile=None):
+        """
+        Finds samples of opened project having parameter (top-level or nested) with given name, unit
+        and value in [min, max] or equal to given value. Additional criteria dicts with the same keys
+        must all match as well.
+        """
+        project = self.session_manager.project_manager.project
+        q = self.session.query(Sample).filter(Sample.project_id == project.id, Sample.deleted_at == None)
+        q = q.options(*loading_options(Sample, profile, self.session_manager.strict_loading))
+        for number, criterion in enumerate(parameter_criteria(name, min, max, equals, unit, criteria)):
+            q = q.filter(Sample.id.in_(parameter_owners(self.session, sample_parameter_table, 'sample_id',
+                                                        criterion, number)))
+        return q.order_by(Sample.id).all()
+
+    @require_signed_in
+    @require_project_opened
+    def get_parameter_matrix(self, parameter_names, samples=None):
+        """
+        Returns 2-D float array of parameter values of samples (rows) against parameter names (columns)
+        together with row and column labels. Nested parameters are addressed with dotted paths
+        like "Anneal.Temperature". Missing and non-numeric values are NaN, for repeated parameters
+        the maximum is taken. The matrix is built with single aggregate query.
+        """
+        project = self.session_manager.project_manager.project
+        parameter_names = [str(name) for name in parameter_names]
+        prefixes = set()
+        for name in parameter_names:
+            parts = name.split('.')
+            prefixes.update('.'.join(parts[:i + 1]) for i in range(len(parts)))
+        tree = self.session.query(sample_parameter_table.c.sample_id.label('sample_id'),
+                                  Parameter.id.label('id'),
+                                  Parameter.name.label('path'),
+                                  Parameter.float_value.label('float_value')).join(
+            Parameter, Parameter.id == sample_parameter_table.c.parameter_id).filter(
+            Parameter.name.in_(prefixes)).cte(name='sample_parameter_path', recursive=True)
+        path = tree.c.path + literal('.') + Parameter.name
+        tree = tree.union_all(self.session.query(tree.c.sample_id, Parameter.id, path, Parameter.float_value).join(
+            tree, Parameter.parent_id == tree.c.id).filter(path.in_(prefixes)))
+        columns = [func.max(case((tree.c.path == name, tree.c.float_value))) for name in parameter_names]
+        q = self.session.query(Sample.id, Sample.name, *columns).outerjoin(tree, tree.c.sample_id == Sample.id)
+        q = q.filter(Sample.project_id == project.id, Sample.deleted_at == None)
+        if samples is not None:
+            q = q.filter(Sample.id.in_([sample.id for sample in samples]))
+        rows = dict((row[0], row[1:]) for row in q.group_by(Sample.id, Sample.name).order_by(Sample.id))
+        if samples is None:
+            sample_ids = list(rows)
+        else:
+            sample_ids = [sample.id for sample in samples if sample.id in rows]
+        matrix = np.array([[np.nan if value is None else value for value in rows[sample_id][1:]]
+                           for sample_id in sample_ids], dtype=np.float64).reshape(len(sample_ids),
+                                                                                    len(parameter_names))
+        return matrix, [rows[sample_id][0] for sample_id in sample_ids], parameter_names
+
     @require_signed_in
     @require_project_opened
     def add_parameter_to_sample(self, sample, parameter):
         if isinstance(sample, Sample) and isinstance(parameter, Parameter):
+            parameter = self.session_manager.parameter_manager.intern_parameter(parameter)
             try:
                 sample.parameters.append(parameter)
                 self.session.commit()
@@ -106,13 +182,16 @@ class SampleManager(EntityManager):
             return False
 
     @require_signed_in
-    def get_sample_parameters(self, sample, parameter_name=None):
+    def get_sample_parameters(self, sample, parameter_name=None, load_trees=False):
         if isinstance(sample, Sample):
-            q = self.session.query(Parameter).join((Sample, Parameter.samples))
+            q = self.session.query(Parameter).join(Parameter.samples)
             q = q.filter(Sample.id == sample.id)
             if parameter_name is not None and len(str(parameter_name)) > 2:
                 template = '%' + str(parameter_name) + '%'
                 q = q.filter(Parameter.name.ilike(template))
-            return q.all()
+            parameters = q.all()
+            if load_trees:
+                load_parameter_trees(self.session, parameters)
+            return parameters
         else:
             raise ValueError('Wrong argument value')
@@ -4,17 +4,19 @@ import datetime
 import socket
 import uuid
 
-from sqlalchemy import exists, func
+from sqlalchemy import event, exists, func, or_
 from sqlalchemy.exc import IntegrityError
-from passlib.apps import custom_app_context as pwd_context
 
 from BDProjects import default_date_time_format
-from BDProjects.Entities import Role, User, Session
+from BDProjects.Entities import Role, User, Session, SessionProject
+from BDProjects.Passwords import hash_passwords, PasswordVerification
 
 from .EntityManager import EntityManager
 from BDProjects.EntityManagers import LogManager, ParameterManager, ProjectManager
 from BDProjects.EntityManagers import EquipmentManager, MeasurementTypeManager, MeasurementManager, SampleManager
 from ._helpers import require_signed_in, require_administrator, require_not_system_user
+from ._bulk import close_sessions, expire_sessions
+from ._cache import LRUCache
 
 system_users = {
     'bot': {
@@ -26,6 +28,9 @@ system_users = {
     }
 }
 
+default_session_timeout = 24 * 3600
+default_heartbeat_interval = 60
+
 default_roles = [
     {'name': 'administrator',
      'description': 'BDProjects admin'},
@@ -36,13 +41,27 @@ default_roles = [
 ]
 
 
+def _mark_flushed(session, flush_context):
+    session.info['flushed'] = True
+
+
+def _clear_flushed(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('flushed', None)
+
+
 class UserManager(EntityManager):
 
     def __init__(self, session_manager):
         super(UserManager, self).__init__(session_manager)
+        self.__heartbeat = (None, None)
         self.session_data = self._generate_session_data()
         self.user = self.session_manager.user
         self.log_manager = self.session_manager.log_manager
+        self.name_cache = LRUCache()
+        if not event.contains(self.session, 'after_flush', _mark_flushed):
+            event.listen(self.session, 'after_flush', _mark_flushed)
+            event.listen(self.session, 'after_transaction_end', _clear_flushed)
         self.project_manager = ProjectManager(self)
         self.measurement_type_manager = MeasurementTypeManager(self)
         self.parameter_manager = ParameterManager(self)
@@ -50,6 +69,22 @@ class UserManager(EntityManager):
         self.sample_manager = SampleManager(self)
         self.measurement_manager = MeasurementManager(self)
 
+    @property
+    def password_context(self):
+        return self.session_manager.connector.password_context
+
+    @property
+    def session_timeout(self):
+        return self.session_manager.connector.config.get('session_timeout', default_session_timeout)
+
+    @property
+    def heartbeat_interval(self):
+        return self.session_manager.connector.config.get('heartbeat_interval', default_heartbeat_interval)
+
+    @property
+    def strict_loading(self):
+        return self.session_manager.connector.config.get('strict_loading', False)
+
     @require_administrator
     @require_not_system_user
     def create_user(self, login, password, email, name_first=None, name_last=None, roles=None, active=True):
@@ -58,7 +93,7 @@ class UserManager(EntityManager):
             roles = ['user']
         for role_name in roles:
             user_roles += self.session.query(Role).filter(Role.name == role_name).all()
-        password_hash = pwd_context.encrypt(password)
+        password_hash = self.password_context.hash(password)
         user = User(name_first=name_first, name_last=name_last,
                     email=email, login=login, password_hash=password_hash, roles=user_roles, active=active)
         try:
@@ -73,6 +108,69 @@ class UserManager(EntityManager):
             self.log_manager.log_record(record=record, category='Warning')
             return self.session.query(User).filter(User.login == str(login)).one()
 
+    @require_administrator
+    @require_not_system_user
+    def create_users(self, users, processes=None):
+        """
+        Creates users in batch. Each item of users is a dict with create_user arguments.
+        The whole batch is validated before any user is built, passwords are hashed in a process pool
+        and all new users are committed at once. Returns list of users in the same order,
+        already existing users (matched by login or email) are returned as is.
+        Unknown role names are logged and ignored.
+        """
+        if not isinstance(users, (list, tuple)) or not all(
+                isinstance(user_data, dict) and all(key in user_data for key in ('login', 'email', 'password'))
+                for user_data in users):
+            record = 'Wrong argument given to create users'
+            self.log_manager.log_record(record=record, category='Warning')
+            return None
+        roles = dict((role.name, role) for role in self.session.query(Role).all())
+        logins = [str(user_data['login']) for user_data in users]
+        emails = [str(user_data['email']) for user_data in users]
+        existing = self.session.query(User).filter(or_(User.login.in_(logins), User.email.in_(emails))).all()
+        existing_logins = dict((user.login, user) for user in existing)
+        existing_emails = dict((user.email, user) for user in existing)
+        new_users, new_roles, passwords, result = [], [], [], []
+        for user_data, login, email in zip(users, logins, emails):
+            if login in existing_logins or email in existing_emails:
+                result.append(existing_logins.get(login, None) or existing_emails[email])
+                continue
+            user_roles = user_data.get('roles', None)
+            if user_roles is None:
+                user_roles = ['user']
+            for name in user_roles:
+                if name not in roles:
+                    record = 'Role "%s" not found for user @%s' % (name, login)
+                    self.log_manager.log_record(record=record, category='Warning')
+            user = User(name_first=user_data.get('name_first', None), name_last=user_data.get('name_last', None),
+                        email=email, login=login, active=user_data.get('active', True))
+            existing_logins[login] = user
+            existing_emails[email] = user
+            new_users.append(user)
+            new_roles.append([roles[name] for name in user_roles if name in roles])
+            result.append(user)
+            passwords.append(user_data['password'])
+        password_hashes = hash_passwords(passwords,
+                                         scheme=self.session_manager.connector.password_scheme,
+                                         rounds=self.session_manager.connector.password_rounds,
+                                         processes=processes)
+        for user, password_hash in zip(new_users, password_hashes):
+            user.password_hash = password_hash
+        try:
+            self.session.add_all(new_users)
+            for user, user_roles in zip(new_users, new_roles):
+                user.roles = user_roles
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            record = 'Batch of %d users conflicts with existing users' % len(new_users)
+            self.log_manager.log_record(record=record, category='Warning')
+            return None
+        record = '%d users successfully created by @%s (%d already existed)' % (len(new_users), self.user.login,
+                                                                                len(users) - len(new_users))
+        self.log_manager.log_record(record=record, category='Information')
+        return result
+
     @require_signed_in
     @require_not_system_user
     def delete_user(self, user):
@@ -124,21 +222,89 @@ class UserManager(EntityManager):
 
     @require_not_system_user
     def sign_in(self, login, password):
+        user = self._get_user_to_sign_in(login)
+        if user is None:
+            return False
+        return self._finish_sign_in(user, login, self.password_context.verify(password, user.password_hash))
+
+    @require_not_system_user
+    def sign_in_async(self, login, password):
+        """
+        Non-blocking variant of sign_in. Password is verified on a worker thread.
+        Returns PendingSignIn object, call its result() method to complete signing in.
+        """
+        user = self._get_user_to_sign_in(login)
+        if user is None:
+            return False
+        verification = PasswordVerification(password, user.password_hash,
+                                            scheme=self.session_manager.connector.password_scheme,
+                                            rounds=self.session_manager.connector.password_rounds)
+        return PendingSignIn(self, user, login, verification)
+
+    @require_not_system_user
+    def resume_session(self, token):
+        """
+        Attaches to already opened session by its token without password verification.
+        Project opened in that session becomes the current project. Sessions of system or deactivated users
+        and sessions idle for more than session timeout can not be resumed.
+        """
         if self.signed_in():
             record = 'You are already signed in. Please sign out first'
             self.log_manager.log_record(record=record, category='Warning')
             return False
+        session_data = self.session.query(Session).filter(Session.token == str(token),
+                                                          Session.active == 1).first()
+        if session_data is None:
+            record = 'Session #%s not found or closed' % str(token)
+            self.log_manager.log_record(record=record, category='Warning')
+            return False
+        if 'system' in [role.name for role in session_data.user.roles]:
+            record = 'Attempt to resume session using system user credentials'
+            self.log_manager.log_record(record=record, category='Warning')
+            return False
+        if not session_data.user.active:
+            record = 'Session #%s belongs to deactivated user @%s' % (session_data.token, session_data.user.login)
+            self.log_manager.log_record(record=record, category='Warning')
+            return False
+        deadline = datetime.datetime.now() - datetime.timedelta(seconds=self.session_timeout)
+        if (session_data.last_seen or session_data.opened) < deadline:
+            close_sessions(self.session, Session.id == session_data.id)
+            record = 'Session #%s expired' % session_data.token
+            self.log_manager.log_record(record=record, category='Warning')
+            return False
+        self.user = session_data.user
+        self.session_data = session_data
+        self.log_manager = LogManager(self)
+        self.project_manager.session_data = self.session_data
+        self.project_manager.user = self.user
+        record = '@%s resumed session (#%s)' % (self.user.login, self.session_data.token)
+        self.log_manager.log_record(record=record, category='Information')
+        session_project = self.session.query(SessionProject).filter(
+            SessionProject.session_id == session_data.id,
+            SessionProject.closed == None).first()
+        if session_project is not None:
+            self.project_manager.project = session_project.project
+            self.project_manager._log_manager_backup = self.log_manager
+            self.log_manager = LogManager(self.project_manager)
+        return True
+
+    def _get_user_to_sign_in(self, login):
+        if self.signed_in():
+            record = 'You are already signed in. Please sign out first'
+            self.log_manager.log_record(record=record, category='Warning')
+            return None
         user = self.session.query(User).filter(User.login == str(login)).all()
         email = self.session.query(User).filter(User.email == str(login)).all()
         if user:
-            user = user[0]
+            return user[0]
         elif email:
-            user = email[0]
-        else:
-            record = 'Login failed. Username: @%s' % str(login)
-            self.log_manager.log_record(record=record, category='Warning')
-            return False
-        if pwd_context.verify(password, user.password_hash):
+            return email[0]
+        record = 'Login failed. Username: @%s' % str(login)
+        self.log_manager.log_record(record=record, category='Warning')
+        return None
+
+    def _finish_sign_in(self, user, login, password_verified):
+        if password_verified and not self.signed_in():
             self.user = user
             self.session_data = self._generate_session_data()
             self.session.add(self.session_data)
@@ -154,7 +320,6 @@ class UserManager(EntityManager):
             self.log_manager.log_record(record=record, category='Warning')
             return False
 
-
     @require_signed_in
     def sign_out(self):
         record = '@%s (#%s) is going to sign out' % (self.user.login, self.session_data.token)
@@ -170,9 +335,11 @@ class UserManager(EntityManager):
 
     def signed_in(self):
         if isinstance(self.session_data, Session):
-            sessions = self.session.query(Session).filter(Session.token == self.session_data.token,
-                                                          Session.active == 1).all()
+            with self.session.no_autoflush:
+                sessions = self.session.query(Session).filter(Session.token == self.session_data.token,
+                                                              Session.active == 1).all()
             if sessions:
+                self._heartbeat(sessions[0])
                 return True
             else:
                 self.user = self.session_manager.user
@@ -181,6 +348,24 @@ class UserManager(EntityManager):
                 return False
         return False
 
+    def _heartbeat(self, session_data):
+        """
+        Updates session last_seen at most once per heartbeat interval. The update runs in its own transaction
+        on a separate connection, so caller changes pending in the shared session are never committed by it.
+        It is skipped while the shared session holds unflushed or flushed but uncommitted changes,
+        which would otherwise lock out the separate connection on SQLite.
+        """
+        now = datetime.datetime.now()
+        session_id, last_seen = self.__heartbeat
+        if session_id == session_data.id and (now - last_seen).total_seconds() < self.heartbeat_interval:
+            return
+        if self.session.new or self.session.dirty or self.session.deleted or self.session.info.get('flushed'):
+            return
+        with self.engine.begin() as connection:
+            connection.execute(Session.__table__.update().where(Session.__table__.c.id == session_data.id).values(
+                last_seen=now))
+        self.__heartbeat = (session_data.id, now)
+
     @require_signed_in
     def check_if_user_is_administrator(self):
         for role in self.user.roles:
@@ -311,9 +496,7 @@ class UserManager(EntityManager):
                 self.log_manager.log_record(record=record, category='Warning')
                 return False
             self.log_manager.log_record(record=record, category='Warning')
-            opened_sessions = self.count_opened_sessions(user)
-            for session in self.opened_sessions(user):
-                self.close_session(session)
+            opened_sessions = self._close_sessions(Session.user_id == user.id)
             record = '@%s was logged off (closed %d sessions)' % (user.login, opened_sessions)
             self.log_manager.log_record(record=record, category='Warning')
             return True
@@ -321,14 +504,58 @@ class UserManager(EntityManager):
     @require_administrator
     def logoff_users(self, users):
         if isinstance(users, (list, tuple)):
-            for user in users:
-                self.logoff_user(user)
+            self.close_sessions(users=users)
 
     @require_administrator
     def logoff_all(self):
-        record = 'Kick-off ALL signed in users'
+        count = self._close_sessions()
+        record = 'Kick-off ALL signed in users (closed %d sessions)' % count
+        self.log_manager.log_record(record=record, category='Warning')
+        return count
+
+    @require_administrator
+    def close_sessions(self, users=None, sessions=None):
+        """
+        Closes in bulk all active sessions of given users (or given sessions, or all sessions if both are None)
+        together with projects opened in them. Returns number of closed sessions.
+        """
+        criteria = []
+        if users is not None:
+            user_ids = [user.id for user in users if isinstance(user, User)]
+            criteria.append(Session.user_id.in_(user_ids))
+        if sessions is not None:
+            session_ids = [session.id for session in sessions if isinstance(session, Session)]
+            criteria.append(Session.id.in_(session_ids))
+        count = self._close_sessions(*criteria)
+        record = 'Closed %d sessions in bulk' % count
         self.log_manager.log_record(record=record, category='Warning')
-        self.logoff_users(self.signed_in_users())
+        return count
+
+    @require_administrator
+    def expire_sessions(self, timeout=None):
+        """
+        Closes in bulk all sessions idle for more than timeout seconds.
+        """
+        if timeout is None:
+            timeout = self.session_timeout
+        session_data = self.session_data
+        count = expire_sessions(self.session, timeout)
+        self._reset_closed_session(session_data)
+        record = 'Closed %d sessions idle for more than %d s' % (count, timeout)
+        self.log_manager.log_record(record=record, category='Information')
+        return count
+
+    def _close_sessions(self, *criteria):
+        session_data = self.session_data
+        count = close_sessions(self.session, *criteria)
+        self._reset_closed_session(session_data)
+        return count
+
+    def _reset_closed_session(self, session_data):
+        if isinstance(session_data, Session) and not session_data.active:
+            if self.project_manager.project is not None:
+                self.project_manager.project = None
+                self.log_manager = self.project_manager._log_manager_backup
 
     def _generate_session_data(self):
         if isinstance(self.user, User):
@@ -344,3 +571,28 @@ class UserManager(EntityManager):
         else:
             session_data = None
         return session_data
+
+
+class PendingSignIn(object):
+
+    def __init__(self, user_manager, user, login, verification):
+        self.__user_manager = user_manager
+        self.__user = user
+        self.__login = login
+        self.__verification = verification
+        self.__signed_in = None
+
+    def done(self):
+        return self.__verification.done()
+
+    def result(self, timeout=None):
+        """
+        Waits for password verification and completes signing in.
+        Returns None if verification is not finished within timeout.
+        """
+        if self.__signed_in is None:
+            password_verified = self.__verification.result(timeout)
+            if password_verified is None:
+                return None
+            self.__signed_in = self.__user_manager._finish_sign_in(self.__user, self.__login, password_verified)
+        return self.__signed_in
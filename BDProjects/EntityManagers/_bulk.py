@@ -0,0 +1,582 @@
+from __future__ import division, print_function
+
+import datetime
+
+from sqlalchemy import or_, and_, func, literal
+from sqlalchemy.orm.attributes import set_committed_value
+
+from BDProjects.Entities import Role
+from BDProjects.Entities import Session, SessionProject
+from BDProjects.Entities import Project
+from BDProjects.Entities import Log
+from BDProjects.Entities import Parameter
+from BDProjects.Entities import Sample
+from BDProjects.Entities import Measurement, MeasurementsCollection
+from BDProjects.Entities import DataChannel, DataPoint
+from BDProjects.Entities.User import user_role_table
+from BDProjects.Entities.Sample import association_table as sample_parameter_table
+from BDProjects.Entities.Measurement import measurement_sample_table, measurement_parameter_table
+from BDProjects.Entities.Measurement import measurement_collection_table
+from BDProjects.Entities.DataPoint import channel_parameter_table
+from BDProjects.Entities.Equipment import equipment_parameters_table
+
+parameter_link_tables = [(sample_parameter_table, 'sample_id'),
+                         (measurement_parameter_table, 'measurement_id'),
+                         (channel_parameter_table, 'channel_id'),
+                         (equipment_parameters_table, 'equipment_id')]
+
+
+def close_sessions(session, *criteria):
+    """
+    Closes all active sessions matching criteria and projects opened in them. Sessions of system users
+    are never closed. Issues exactly two UPDATE statements and commits. Returns number of closed sessions.
+    """
+    now = datetime.datetime.now()
+    system_user_ids = session.query(user_role_table.c.user_id).join(
+        Role, Role.id == user_role_table.c.role_id).filter(Role.name == 'system')
+    criteria = criteria + (~Session.user_id.in_(system_user_ids.statement),)
+    sessions_query = session.query(Session.id).filter(Session.active == 1, *criteria)
+    session.query(SessionProject).filter(SessionProject.closed == None,
+                                         SessionProject.session_id.in_(sessions_query.statement)).update(
+        {SessionProject.closed: now}, synchronize_session=False)
+    count = session.query(Session).filter(Session.active == 1, *criteria).update(
+        {Session.active: False, Session.closed: now}, synchronize_session=False)
+    session.commit()
+    return count
+
+
+def expire_sessions(session, timeout):
+    """
+    Closes active sessions not seen for more than timeout seconds. Returns number of closed sessions.
+    """
+    deadline = datetime.datetime.now() - datetime.timedelta(seconds=timeout)
+    return close_sessions(session, or_(Session.last_seen < deadline,
+                                       and_(Session.last_seen == None, Session.opened < deadline)))
+
+
+def parameter_subtree(session, roots):
+    """
+    Returns recursive CTE with IDs of parameters from roots selectable and all their descendants.
+    """
+    subtree = session.query(Parameter.id.label('id')).filter(Parameter.id.in_(roots)).cte(
+        name='parameter_subtree', recursive=True)
+    children = session.query(Parameter.id.label('id')).join(subtree, Parameter.parent_id == subtree.c.id)
+    return subtree.union(children)
+
+
+def parameter_ancestors(session, ids):
+    """
+    Returns recursive CTE with IDs of parameters from ids selectable and all their ancestors.
+    """
+    ancestors = session.query(Parameter.id.label('id'), Parameter.parent_id.label('parent_id')).filter(
+        Parameter.id.in_(ids)).cte(name='parameter_ancestors', recursive=True)
+    parents = session.query(Parameter.id.label('id'), Parameter.parent_id.label('parent_id')).join(
+        ancestors, Parameter.id == ancestors.c.parent_id)
+    return ancestors.union(parents)
+
+
+def load_parameter_trees(session, parameters):
+    """
+    Loads whole subtrees of given parameters with single recursive CTE query and populates
+    children and parent relationships in memory, so walking the trees issues no further SELECTs.
+    Returns list of all parameters in the subtrees.
+    """
+    parameters = list(parameters)
+    if not parameters:
+        return []
+    subtree = parameter_subtree(session, [parameter.id for parameter in parameters])
+    nodes = session.query(Parameter).filter(Parameter.id.in_(session.query(subtree.c.id))).order_by(Parameter.id).all()
+    nodes_by_id = dict((node.id, node) for node in nodes)
+    children = dict((node.id, []) for node in nodes)
+    for node in nodes:
+        if node.parent_id in children:
+            children[node.parent_id].append(node)
+    for node in nodes:
+        set_committed_value(node, 'children', children[node.id])
+        if node.parent_id in nodes_by_id:
+            set_committed_value(node, 'parent', nodes_by_id[node.parent_id])
+    return nodes
+
+
+def copy_parameter_tree(session, parameter, session_id):
+    """
+    Copies parameter with its whole subtree. The source tree is loaded with single query and copied
+    level by level with executemany INSERT ... RETURNING, parent IDs of every level are taken from IDs
+    returned for the previous one. Does not commit. Returns ID of the copy.
+    """
+    load_parameter_trees(session, [parameter])
+    new_ids = {}
+    level = [parameter]
+    while level:
+        rows = [{'type_id': node.type_id,
+                 'parent_id': new_ids.get(node.parent_id, None),
+                 'name': node.name,
+                 'description': node.description,
+                 'unit_name': node.unit_name,
+                 'index': node.index,
+                 'string_value': node.string_value,
+                 'float_value': node.float_value,
+                 'binary_value': node.binary_value,
+                 'fingerprint': node.fingerprint,
+                 'session_id': session_id} for node in level]
+        for node, new_id in zip(level, insert_returning_ids(session, Parameter.__table__, rows)):
+            new_ids[node.id] = new_id
+        level = [child for node in level for child in node.children]
+    return new_ids[parameter.id]
+
+
+def insert_returning_ids(session, table, rows):
+    """
+    Inserts rows letting the database assign IDs. Does not commit. Returns list of assigned IDs in rows order.
+    Uses single executemany INSERT ... RETURNING where the backend can return IDs in parameters order
+    (SQLAlchemy >= 2.0 with PostgreSQL, SQLite, ...), otherwise inserts row by row reading inserted primary keys.
+    """
+    if not rows:
+        return []
+    dialect = session.get_bind().dialect
+    if getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False):
+        result = session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows)
+        return [row_id for row_id, in result]
+    return [session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def copy_rows(session, table, source, overrides=None):
+    """
+    Copies rows of table selected by source query with single INSERT ... SELECT statement.
+    overrides maps column names to SQL expressions, columns mapped to None are omitted.
+    Returns number of inserted rows.
+    """
+    if overrides is None:
+        overrides = {}
+    names, columns = [], []
+    for column in table.c:
+        expression = overrides.get(column.name, column)
+        if expression is not None:
+            names.append(column.name)
+            columns.append(expression.label(column.name))
+    result = session.execute(table.insert().from_select(names, source.with_entities(*columns).statement))
+    return result.rowcount
+
+
+def copy_rows_returning_ids(session, table, source, overrides):
+    """
+    Inserts copies of rows of table selected by source query (or given as list of dictionaries)
+    letting the database assign IDs of copies.
+    overrides maps column names to values or to functions of source row, columns mapped to None are omitted.
+    Returns dictionary mapping source row IDs to IDs of their copies.
+    """
+    rows = source if isinstance(source, list) else [row._asdict() for row in source.order_by(table.c.id)]
+    copies = []
+    for row in rows:
+        copy = dict(row)
+        del copy['id']
+        for name, value in overrides.items():
+            if value is None:
+                copy.pop(name, None)
+            elif callable(value):
+                copy[name] = value(row)
+            else:
+                copy[name] = value
+        copies.append(copy)
+    return dict(zip([row['id'] for row in rows], insert_returning_ids(session, table, copies)))
+
+
+def clone_project_rows(session, source_id, target_id, session_id, include_data=False):
+    """
+    Copies samples, parameter trees, measurements and data channels (optionally data points) of project
+    source_id into project target_id. Tombstoned rows are skipped. IDs of copies are assigned by the database
+    and returned to map source IDs to IDs of copies, so inserts of concurrent clients can not collide with them.
+    Data points are copied with one INSERT ... SELECT statement per data channel.
+    Returns dictionary with numbers of copied rows.
+    """
+    now = datetime.datetime.now()
+    sample_table = Sample.__table__
+    measurement_table = Measurement.__table__
+    channel_table = DataChannel.__table__
+    parameter_table = Parameter.__table__
+
+    samples = session.query(sample_table).filter(sample_table.c.project_id == source_id,
+                                                 sample_table.c.deleted_at == None)
+    sample_ids = copy_rows_returning_ids(session, sample_table, samples,
+                                         {'project_id': target_id, 'session_id': session_id, 'created': now})
+    measurements = session.query(measurement_table).filter(measurement_table.c.project_id == source_id,
+                                                           measurement_table.c.deleted_at == None)
+    overrides = {'project_id': target_id, 'session_id': session_id, 'input_data_id': None}
+    if not include_data:
+        overrides.update({'started': now, 'finished': None, 'progress': 0.0})
+    measurement_ids = copy_rows_returning_ids(session, measurement_table, measurements, overrides)
+    measurement_source = measurements.with_entities(measurement_table.c.id).statement
+    channels = session.query(channel_table).filter(channel_table.c.measurement_id.in_(measurement_source),
+                                                   channel_table.c.deleted_at == None)
+    channel_ids = copy_rows_returning_ids(session, channel_table, channels,
+                                          {'measurement_id': lambda row: measurement_ids[row['measurement_id']],
+                                           'session_id': session_id})
+    sample_source = samples.with_entities(sample_table.c.id).statement
+    rows = session.query(measurement_sample_table.c.measurement_id, measurement_sample_table.c.sample_id).filter(
+        measurement_sample_table.c.sample_id.in_(sample_source),
+        measurement_sample_table.c.measurement_id.in_(measurement_source)).all()
+    if rows:
+        session.execute(measurement_sample_table.insert(), [
+            {'measurement_id': measurement_ids[measurement_id], 'sample_id': sample_ids[sample_id]}
+            for measurement_id, sample_id in rows])
+
+    channel_source = channels.with_entities(channel_table.c.id).statement
+    links = [(sample_parameter_table, sample_parameter_table.c.sample_id, sample_source, sample_ids),
+             (measurement_parameter_table, measurement_parameter_table.c.measurement_id, measurement_source,
+              measurement_ids),
+             (channel_parameter_table, channel_parameter_table.c.channel_id, channel_source, channel_ids)]
+    roots = [session.query(link_table.c.parameter_id).filter(owner_column.in_(owner_source))
+             for link_table, owner_column, owner_source, owner_ids in links]
+    subtree = parameter_subtree(session, roots[0].union(*roots[1:]))
+    parameters = [row._asdict() for row in session.query(parameter_table).filter(
+        parameter_table.c.id.in_(session.query(subtree.c.id))).order_by(parameter_table.c.id)]
+    subtree_ids = set(row['id'] for row in parameters)
+    parameter_ids = {}
+    level = [row for row in parameters if row['parent_id'] not in subtree_ids]
+    while level:
+        parameter_ids.update(copy_rows_returning_ids(session, parameter_table, level,
+                                                     {'parent_id': lambda row: parameter_ids.get(row['parent_id']),
+                                                      'session_id': session_id}))
+        level = [row for row in parameters if row['parent_id'] in parameter_ids and row['id'] not in parameter_ids]
+    for link_table, owner_column, owner_source, owner_ids in links:
+        rows = session.query(owner_column, link_table.c.parameter_id).filter(owner_column.in_(owner_source)).all()
+        if rows:
+            session.execute(link_table.insert(), [
+                {owner_column.name: owner_ids[owner_id], 'parameter_id': parameter_ids[parameter_id]}
+                for owner_id, parameter_id in rows])
+
+    data_points = 0
+    if include_data:
+        data_point_table = DataPoint.__table__
+        for channel_id, copy_id in channel_ids.items():
+            source = session.query(data_point_table).filter(data_point_table.c.channel_id == channel_id)
+            data_points += copy_rows(session, data_point_table, source,
+                                     {'id': None,
+                                      'channel_id': literal(copy_id),
+                                      'session_id': literal(session_id)})
+    return {'samples': len(sample_ids),
+            'measurements': len(measurement_ids),
+            'data_channels': len(channel_ids),
+            'parameters': len(parameter_ids),
+            'data_points': data_points}
+
+
+def delete_in_chunks(session, table, criterion, chunk_size, progress=None):
+    """
+    Deletes rows of table matching criterion with set-based DELETE statements of at most chunk_size rows,
+    committing after every chunk to bound lock time. Calls progress(table_name, deleted_rows) after every chunk.
+    Returns number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        ids = [row[0] for row in session.query(table.c.id).filter(criterion).limit(chunk_size)]
+        if not ids:
+            break
+        session.execute(table.delete().where(table.c.id.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+        if progress is not None:
+            progress(table.name, deleted)
+    return deleted
+
+
+def delete_channel_rows(session, criterion, chunk_size, progress=None):
+    """
+    Deletes data channels matching criterion together with their data points and parameter associations.
+    Returns dictionary with numbers of deleted rows.
+    """
+    channel_table = DataChannel.__table__
+    channel_ids = session.query(channel_table.c.id).filter(criterion).statement
+    counts = {'data_points': delete_in_chunks(session, DataPoint.__table__,
+                                              DataPoint.__table__.c.channel_id.in_(channel_ids),
+                                              chunk_size, progress)}
+    delete_in_chunks(session, channel_parameter_table, channel_parameter_table.c.channel_id.in_(channel_ids),
+                     chunk_size, progress)
+    counts['data_channels'] = delete_in_chunks(session, channel_table, criterion, chunk_size, progress)
+    return counts
+
+
+def delete_measurement_rows(session, criterion, chunk_size, progress=None):
+    """
+    Deletes measurements matching criterion together with their data channels, data points
+    and association rows in dependency order. Returns dictionary with numbers of deleted rows.
+    """
+    measurement_table = Measurement.__table__
+    measurement_ids = session.query(measurement_table.c.id).filter(criterion).statement
+    counts = delete_channel_rows(session, DataChannel.__table__.c.measurement_id.in_(measurement_ids),
+                                 chunk_size, progress)
+    for link_table in [measurement_parameter_table, measurement_sample_table, measurement_collection_table]:
+        delete_in_chunks(session, link_table, link_table.c.measurement_id.in_(measurement_ids),
+                         chunk_size, progress)
+    counts['measurements'] = delete_in_chunks(session, measurement_table, criterion, chunk_size, progress)
+    return counts
+
+
+def delete_sample_rows(session, criterion, chunk_size, progress=None):
+    """
+    Deletes samples matching criterion together with their association rows. Returns number of deleted samples.
+    """
+    sample_table = Sample.__table__
+    sample_ids = session.query(sample_table.c.id).filter(criterion).statement
+    for link_table in [measurement_sample_table, sample_parameter_table]:
+        delete_in_chunks(session, link_table, link_table.c.sample_id.in_(sample_ids), chunk_size, progress)
+    return delete_in_chunks(session, sample_table, criterion, chunk_size, progress)
+
+
+def delete_project_rows(session, project_id, chunk_size, progress=None):
+    """
+    Deletes project with all its samples, measurements, collections, data and logs
+    using chunked set-based DELETE statements. Returns dictionary with numbers of deleted rows.
+    """
+    collection_table = MeasurementsCollection.__table__
+    counts = delete_measurement_rows(session, Measurement.__table__.c.project_id == project_id,
+                                     chunk_size, progress)
+    collection_ids = session.query(collection_table.c.id).filter(collection_table.c.project_id == project_id)
+    session.query(Measurement).filter(Measurement.input_data_id.in_(collection_ids.statement)).update(
+        {Measurement.input_data_id: None}, synchronize_session=False)
+    session.commit()
+    delete_in_chunks(session, measurement_collection_table,
+                     measurement_collection_table.c.collection_id.in_(collection_ids.statement),
+                     chunk_size, progress)
+    counts['collections'] = delete_in_chunks(session, collection_table,
+                                             collection_table.c.project_id == project_id, chunk_size, progress)
+    counts['samples'] = delete_sample_rows(session, Sample.__table__.c.project_id == project_id,
+                                           chunk_size, progress)
+    counts['logs'] = delete_in_chunks(session, Log.__table__, Log.__table__.c.project_id == project_id,
+                                      chunk_size, progress)
+    delete_in_chunks(session, SessionProject.__table__, SessionProject.__table__.c.project_id == project_id,
+                     chunk_size, progress)
+    session.query(Project).filter(Project.id == project_id).delete(synchronize_session=False)
+    session.commit()
+    return counts
+
+
+def tombstone(session, entity, entity_id, project_id=None):
+    """
+    Marks row of entity as deleted. Returns False if it is already tombstoned.
+    If project_id is given its change marker is incremented in the same transaction when the row is marked.
+    """
+    count = session.query(entity).filter(entity.id == entity_id, entity.deleted_at == None).update(
+        {entity.deleted_at: datetime.datetime.now()}, synchronize_session=False)
+    if count and project_id is not None:
+        touch_project(session, project_id)
+    session.commit()
+    return count > 0
+
+
+def touch_project(session, project_id):
+    """
+    Increments change marker of project. Must be executed in the same transaction as the change of its data,
+    so cached summaries of all clients can tell whether they are stale.
+    """
+    project_table = Project.__table__
+    session.execute(project_table.update().where(project_table.c.id == project_id).values(
+        revision=func.coalesce(project_table.c.revision, 0) + 1))
+
+
+def touch_data_channel(session, channel_id, project_id):
+    """
+    Increments change marker of data channel and of its project. Must be executed in the same transaction
+    as the change of channel data points, so cached summaries recount only the changed channels.
+    """
+    channel_table = DataChannel.__table__
+    session.execute(channel_table.update().where(channel_table.c.id == channel_id).values(
+        revision=func.coalesce(channel_table.c.revision, 0) + 1))
+    touch_project(session, project_id)
+
+
+def purge_deleted_rows(session, chunk_size, progress=None, deleted_before=None):
+    """
+    Physically removes tombstoned projects, measurements, data channels and samples
+    deleted before given moment (all tombstoned rows if None). Returns dictionary with numbers of purged rows.
+    """
+    def deleted(entity):
+        criterion = entity.__table__.c.deleted_at != None
+        if deleted_before is not None:
+            criterion = and_(criterion, entity.__table__.c.deleted_at < deleted_before)
+        return criterion
+
+    counts = {'projects': 0, 'measurements': 0, 'data_channels': 0, 'samples': 0, 'data_points': 0}
+    for project_id, in session.query(Project.id).filter(deleted(Project)).all():
+        project_counts = delete_project_rows(session, project_id, chunk_size, progress)
+        counts['projects'] += 1
+        counts['data_points'] += project_counts['data_points']
+    touched = set(project_id for project_id, in session.query(Measurement.project_id).filter(
+        deleted(Measurement)).distinct())
+    touched.update(project_id for project_id, in session.query(Measurement.project_id).join(
+        DataChannel, DataChannel.measurement_id == Measurement.id).filter(deleted(DataChannel)).distinct())
+    measurement_counts = delete_measurement_rows(session, deleted(Measurement), chunk_size, progress)
+    counts['measurements'] = measurement_counts['measurements']
+    counts['data_points'] += measurement_counts['data_points']
+    channel_counts = delete_channel_rows(session, deleted(DataChannel), chunk_size, progress)
+    counts['data_channels'] = channel_counts['data_channels']
+    counts['data_points'] += channel_counts['data_points']
+    counts['samples'] = delete_sample_rows(session, deleted(Sample), chunk_size, progress)
+    for project_id in touched:
+        touch_project(session, project_id)
+    session.commit()
+    return counts
+
+
+def parameter_node_paths(session, root_ids):
+    """
+    Loads subtrees of given roots with single query and returns dictionary mapping root IDs to dictionaries
+    of lists of node IDs by node path. Path is tuple of (name, index, fingerprint) of the node and its ancestors
+    below the root, so equal paths of trees with equal fingerprints denote identical nodes.
+    """
+    root_ids = set(root_ids)
+    parameter_table = Parameter.__table__
+    subtree = parameter_subtree(session, root_ids)
+    rows = session.query(parameter_table.c.id, parameter_table.c.parent_id, parameter_table.c.name,
+                         parameter_table.c.index, parameter_table.c.fingerprint).filter(
+        parameter_table.c.id.in_(session.query(subtree.c.id))).order_by(parameter_table.c.id).all()
+    nodes = dict((row[0], row) for row in rows)
+    paths = {}
+
+    def path(node_id):
+        if node_id not in paths:
+            node = nodes[node_id]
+            if node_id in root_ids:
+                paths[node_id] = (node_id, ())
+            else:
+                root_id, parent_path = path(node.parent_id)
+                paths[node_id] = (root_id, parent_path + ((node.name, node.index, node.fingerprint),))
+        return paths[node_id]
+
+    trees = dict((root_id, {}) for root_id in root_ids)
+    for node_id in nodes:
+        root_id, node_path = path(node_id)
+        trees[root_id].setdefault(node_path, []).append(node_id)
+    return trees
+
+
+def merge_duplicate_parameters(session, chunk_size=1000, progress=None):
+    """
+    Merges identical top-level parameter trees (equal fingerprints) into the oldest one.
+    Association rows pointing to any node of duplicate trees are rewritten to the matching node
+    of the kept tree, duplicate trees are deleted. Groups whose trees can not be paired node by node
+    are skipped. Commits after every chunk_size merged groups and calls progress(merged_groups, deleted_parameters).
+    Returns dictionary with numbers of merged groups, rewritten association rows and deleted parameters.
+    """
+    parameter_table = Parameter.__table__
+    counts = {'groups': 0, 'associations': 0, 'parameters': 0}
+    q = session.query(parameter_table.c.fingerprint, func.min(parameter_table.c.id)).filter(
+        parameter_table.c.parent_id == None, parameter_table.c.fingerprint != None).group_by(
+        parameter_table.c.fingerprint).having(func.count(parameter_table.c.id) > 1)
+    for fingerprint, canonical_id in q.all():
+        duplicate_ids = [parameter_id for parameter_id, in session.query(parameter_table.c.id).filter(
+            parameter_table.c.fingerprint == fingerprint, parameter_table.c.parent_id == None,
+            parameter_table.c.id != canonical_id)]
+        trees = parameter_node_paths(session, [canonical_id] + duplicate_ids)
+        canonical_tree = trees.pop(canonical_id)
+        shape = dict((node_path, len(node_ids)) for node_path, node_ids in canonical_tree.items())
+        if any(dict((node_path, len(node_ids)) for node_path, node_ids in tree.items()) != shape
+               for tree in trees.values()):
+            continue
+        targets = {}
+        for tree in trees.values():
+            for node_path, node_ids in tree.items():
+                targets.update(zip(node_ids, canonical_tree[node_path]))
+        subtree_ids = sorted(targets)
+        for link_table, owner_name in parameter_link_tables:
+            owner_column = link_table.c[owner_name]
+            rows = []
+            for offset in range(0, len(subtree_ids), chunk_size):
+                rows += session.query(link_table.c.id, owner_column, link_table.c.parameter_id).filter(
+                    link_table.c.parameter_id.in_(subtree_ids[offset:offset + chunk_size])).all()
+            if not rows:
+                continue
+            target_ids = set(targets[parameter_id] for _, _, parameter_id in rows)
+            linked = set(session.query(owner_column, link_table.c.parameter_id).filter(
+                link_table.c.parameter_id.in_(target_ids)).all())
+            redundant_ids, rewritten = [], {}
+            for row_id, owner_id, parameter_id in sorted(rows):
+                link = (owner_id, targets[parameter_id])
+                if link in linked:
+                    redundant_ids.append(row_id)
+                else:
+                    rewritten.setdefault(link[1], []).append(row_id)
+                    linked.add(link)
+            if redundant_ids:
+                session.execute(link_table.delete().where(link_table.c.id.in_(redundant_ids)))
+            for target_id, row_ids in rewritten.items():
+                session.execute(link_table.update().where(link_table.c.id.in_(row_ids)).values(
+                    parameter_id=target_id))
+            counts['associations'] += len(rows)
+        for offset in range(0, len(subtree_ids), chunk_size):
+            session.execute(parameter_table.delete().where(
+                parameter_table.c.id.in_(subtree_ids[offset:offset + chunk_size])))
+        counts['parameters'] += len(subtree_ids)
+        counts['groups'] += 1
+        if counts['groups'] % chunk_size == 0:
+            session.commit()
+            if progress is not None:
+                progress(counts['groups'], counts['parameters'])
+    session.commit()
+    return counts
+
+
+def dangling_parameters_query(session):
+    """
+    Returns query of IDs of top-level parameters not referenced by any sample, measurement,
+    data channel or equipment. Built as LEFT OUTER JOIN anti-joins over indexed parameter_id columns.
+    """
+    parameter_table = Parameter.__table__
+    q = session.query(parameter_table.c.id).filter(parameter_table.c.parent_id == None)
+    for link_table, owner_name in parameter_link_tables:
+        q = q.outerjoin(link_table, link_table.c.parameter_id == parameter_table.c.id).filter(link_table.c.id == None)
+    return q
+
+
+def expunge_parameters(session, parameter_ids):
+    """
+    Removes parameters with given IDs deleted by bulk statements from session identity map.
+    """
+    parameter_ids = set(parameter_ids)
+    for key, instance in list(session.identity_map.items()):
+        if isinstance(instance, Parameter) and key[1][0] in parameter_ids:
+            session.expunge(instance)
+
+
+def collect_dangling_parameters(session, batch_size=1000, max_batches=None, progress=None, after_id=0):
+    """
+    Deletes dangling top-level parameters together with their whole subtrees, at most batch_size trees
+    per DELETE statement, committing after every batch. Trees with descendants still referenced are kept,
+    deleted parameters are expunged from the session.
+    Stops after max_batches batches if given, so collection can run incrementally resuming from
+    after_id (ID of the last examined tree). Calls progress(trees, parameters) after every batch.
+    Returns dictionary with numbers of deleted trees and parameters and last_id to resume from,
+    which is 0 once all parameters were examined.
+    """
+    parameter_table = Parameter.__table__
+    counts = {'trees': 0, 'parameters': 0, 'last_id': after_id}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        root_ids = [parameter_id for parameter_id, in dangling_parameters_query(session).filter(
+            parameter_table.c.id > counts['last_id']).order_by(parameter_table.c.id).limit(batch_size)]
+        if not root_ids:
+            counts['last_id'] = 0
+            break
+        counts['last_id'] = root_ids[-1]
+        batches += 1
+        tree = session.query(parameter_table.c.id.label('id'), parameter_table.c.id.label('root_id')).filter(
+            parameter_table.c.id.in_(root_ids)).cte(name='dangling_subtree', recursive=True)
+        tree = tree.union_all(session.query(parameter_table.c.id, tree.c.root_id).join(
+            tree, parameter_table.c.parent_id == tree.c.id))
+        roots = dict(session.query(tree.c.id, tree.c.root_id).all())
+        descendant_ids = [parameter_id for parameter_id, root_id in roots.items() if parameter_id != root_id]
+        referenced_roots = set()
+        if descendant_ids:
+            for link_table, owner_name in parameter_link_tables:
+                referenced_roots.update(roots[parameter_id] for parameter_id, in session.query(
+                    link_table.c.parameter_id).filter(link_table.c.parameter_id.in_(descendant_ids)))
+        parameter_ids = [parameter_id for parameter_id, root_id in roots.items() if root_id not in referenced_roots]
+        if parameter_ids:
+            session.execute(parameter_table.delete().where(parameter_table.c.id.in_(parameter_ids)))
+            expunge_parameters(session, parameter_ids)
+        session.commit()
+        counts['trees'] += len(root_ids) - len(referenced_roots)
+        counts['parameters'] += len(parameter_ids)
+        if progress is not None:
+            progress(counts['trees'], counts['parameters'])
+    return counts
@@ -0,0 +1,140 @@
+from __future__ import division, print_function
+
+import io
+import base64
+import numpy as np
+
+from BDProjects import datetime_to_float, float_to_datetime
+from BDProjects.Entities import Parameter
+from ._bulk import insert_returning_ids
+from ._fingerprint import parameter_fingerprint
+
+bundle_format = 'BDProjects project bundle'
+manifest_name = 'manifest.json'
+data_point_fields = ['point_index', 'float_value', 'string_value', 'string_null', 'measured']
+
+
+def datetime_to_spec(value):
+    if value is None:
+        return None
+    return datetime_to_float(value)
+
+
+def spec_to_datetime(value):
+    if value is None:
+        return None
+    return float_to_datetime(value)
+
+
+def binary_to_spec(value):
+    if value is None:
+        return None
+    return base64.b64encode(value).decode('ascii')
+
+
+def spec_to_binary(value):
+    if value is None:
+        return None
+    return base64.b64decode(value)
+
+
+def parameter_to_spec(parameter, type_names):
+    """
+    Converts Parameter tree to its spec. type_names maps parameter type IDs to names.
+    """
+    return {'name': parameter.name,
+            'type': type_names[parameter.type_id],
+            'description': parameter.description,
+            'unit_name': parameter.unit_name,
+            'index': parameter.index,
+            'float_value': parameter.float_value,
+            'string_value': parameter.string_value,
+            'binary_value': binary_to_spec(parameter.binary_value),
+            'children': [parameter_to_spec(child, type_names) for child in parameter.children]}
+
+
+class _ParameterRow(object):
+
+    def __init__(self, row):
+        self.__dict__.update(row)
+
+
+def insert_parameter_specs(session, specs, type_ids, session_id, tolerance):
+    """
+    Inserts parameter trees from specs level by level with executemany INSERT ... RETURNING,
+    parent IDs of every level are taken from IDs returned for the previous one.
+    Fingerprints are computed from specs before insert. Returns list of root IDs in specs order.
+    """
+    def prepare(spec):
+        row = {'type_id': type_ids.get(spec['type'], type_ids['Generic']),
+               'name': spec['name'],
+               'description': spec['description'],
+               'unit_name': spec['unit_name'],
+               'index': spec['index'],
+               'float_value': spec['float_value'],
+               'string_value': spec['string_value'],
+               'binary_value': spec_to_binary(spec.get('binary_value', None)),
+               'session_id': session_id}
+        children = [prepare(child) for child in spec['children']]
+        row['fingerprint'] = parameter_fingerprint(_ParameterRow(row), [child[0]['fingerprint']
+                                                                         for child in children], tolerance)
+        return row, children
+
+    root_ids = None
+    level = [(prepare(spec), None) for spec in specs]
+    while level:
+        rows = []
+        for (row, _), parent_id in level:
+            row['parent_id'] = parent_id
+            rows.append(row)
+        ids = insert_returning_ids(session, Parameter.__table__, rows)
+        if root_ids is None:
+            root_ids = ids
+        level = [(child, new_id) for ((_, children), _), new_id in zip(level, ids) for child in children]
+    return root_ids or []
+
+
+def save_array(bundle, name, array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    bundle.writestr(name, buffer.getvalue())
+
+
+def load_array(bundle, name):
+    return np.load(io.BytesIO(bundle.read(name)), allow_pickle=False)
+
+
+def data_points_to_arrays(rows):
+    """
+    Converts rows of (point_index, float_value, string_value, measured) to NumPy arrays.
+    Missing float values and dates are stored as NaN, missing strings as empty strings
+    flagged in string_null mask.
+    """
+    arrays = {'point_index': np.array([row[0] for row in rows], dtype=np.int64),
+              'float_value': np.array([np.nan if row[1] is None else row[1] for row in rows], dtype=np.float64),
+              'measured': np.array([np.nan if row[3] is None else datetime_to_float(row[3]) for row in rows],
+                                   dtype=np.float64)}
+    strings = [row[2] for row in rows]
+    if any(string is not None for string in strings):
+        arrays['string_value'] = np.array(['' if string is None else string for string in strings])
+        arrays['string_null'] = np.array([string is None for string in strings], dtype=bool)
+    return arrays
+
+
+def arrays_to_data_points(arrays, channel_id, session_id):
+    size = arrays['point_index'].size
+    strings = arrays.get('string_value', None)
+    if strings is not None:
+        nulls = arrays.get('string_null', strings == '')
+    data_points = []
+    for i in range(size):
+        float_value = arrays['float_value'][i]
+        measured = arrays['measured'][i]
+        string_value = None if strings is None or nulls[i] else str(strings[i])
+        data_points.append({'channel_id': channel_id,
+                            'point_index': int(arrays['point_index'][i]),
+                            'float_value': None if np.isnan(float_value) else float(float_value),
+                            'string_value': string_value,
+                            'measured': None if np.isnan(measured) else float_to_datetime(float(measured)),
+                            'session_id': session_id})
+    return data_points
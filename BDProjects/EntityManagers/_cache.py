@@ -0,0 +1,46 @@
+from __future__ import division, print_function
+
+from collections import OrderedDict
+
+default_name_cache_size = 1024
+
+
+class LRUCache(object):
+    """
+    Least recently used cache with (kind, key) tuple keys, so entries of one kind can be dropped together.
+    """
+
+    def __init__(self, maxsize=default_name_cache_size):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, kind, key):
+        try:
+            value = self.__items.pop((kind, key))
+        except KeyError:
+            self.misses += 1
+            return None
+        self.__items[(kind, key)] = value
+        self.hits += 1
+        return value
+
+    def put(self, kind, key, value):
+        self.__items.pop((kind, key), None)
+        self.__items[(kind, key)] = value
+        while len(self.__items) > self.maxsize:
+            self.__items.popitem(last=False)
+
+    def invalidate(self, kind, key=None):
+        if key is not None:
+            self.__items.pop((kind, key), None)
+        else:
+            for item_key in [item_key for item_key in self.__items if item_key[0] == kind]:
+                del self.__items[item_key]
+
+    def clear(self):
+        self.__items.clear()
@@ -0,0 +1,160 @@
+from __future__ import division, print_function
+
+import math
+import json
+import hashlib
+
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.orm.attributes import set_committed_value
+
+from BDProjects.Entities import Parameter
+from ._bulk import load_parameter_trees, parameter_ancestors
+
+default_fingerprint_tolerance = 1e-9
+
+
+def quantize(value, tolerance):
+    if value is None:
+        return None
+    if math.isnan(value) or math.isinf(value):
+        return repr(value)
+    value = float(value)
+    quotient = value / tolerance
+    if math.isinf(quotient):
+        # value is far beyond tolerance resolution, exact hex representation is canonical
+        return float.hex(value)
+    return int(round(quotient))
+
+
+def parameter_fingerprint(parameter, child_fingerprints, tolerance):
+    """
+    Returns SHA-256 hex digest of parameter fields with float value rounded to tolerance.
+    Children fingerprints are sorted, so the result does not depend on children order.
+    Binary value, if any, enters as its own SHA-256 digest.
+    """
+    content = [parameter.name, parameter.type_id, parameter.unit_name, parameter.index, parameter.description,
+               quantize(parameter.float_value, tolerance), parameter.string_value, sorted(child_fingerprints)]
+    if parameter.binary_value is not None:
+        content.append(hashlib.sha256(parameter.binary_value).hexdigest())
+    return hashlib.sha256(json.dumps(content).encode('utf-8')).hexdigest()
+
+
+def _store_fingerprints(session, fingerprints):
+    table = Parameter.__table__
+    statement = table.update().where(table.c.id == bindparam('parameter_id')).values(
+        fingerprint=bindparam('parameter_fingerprint'), value_altered=table.c.value_altered)
+    session.execute(statement, [{'parameter_id': parameter_id, 'parameter_fingerprint': fingerprint}
+                                for parameter_id, fingerprint in fingerprints.items()])
+
+
+def refresh_ancestor_fingerprints(session, parent_ids, tolerance):
+    """
+    Recomputes fingerprints of existing parameters parent_ids and all their ancestors from stored fingerprints
+    of their children. Ancestors and fingerprints of their children are loaded with two queries,
+    new fingerprints are stored with single executemany UPDATE.
+    """
+    parent_ids = set(parent_ids)
+    parent_ids.discard(None)
+    if not parent_ids:
+        return
+    ancestors = parameter_ancestors(session, parent_ids)
+    nodes = session.query(Parameter).filter(Parameter.id.in_(session.query(ancestors.c.id))).all()
+    if not nodes:
+        return
+    nodes_by_id = dict((node.id, node) for node in nodes)
+    child_fingerprints = dict((node.id, {}) for node in nodes)
+    q = session.query(Parameter.id, Parameter.parent_id, Parameter.fingerprint)
+    for child_id, parent_id, fingerprint in q.filter(Parameter.parent_id.in_(list(nodes_by_id))):
+        child_fingerprints[parent_id][child_id] = fingerprint
+    depths = {}
+
+    def depth(node):
+        if node.id not in depths:
+            parent = nodes_by_id.get(node.parent_id)
+            depths[node.id] = 0 if parent is None else depth(parent) + 1
+        return depths[node.id]
+
+    fingerprints = {}
+    for node in sorted(nodes, key=depth, reverse=True):
+        fingerprints[node.id] = parameter_fingerprint(node, list(child_fingerprints[node.id].values()), tolerance)
+        set_committed_value(node, 'fingerprint', fingerprints[node.id])
+        if node.parent_id in child_fingerprints:
+            child_fingerprints[node.parent_id][node.id] = fingerprints[node.id]
+    _store_fingerprints(session, fingerprints)
+
+
+def refresh_fingerprints(session, parameters, tolerance, parent_ids=()):
+    """
+    Recomputes fingerprints of whole subtrees of given flushed parameters and of their ancestors,
+    together with ancestors of extra parent_ids if given.
+    Subtrees are loaded with single query, fingerprints are stored with single executemany UPDATE.
+    """
+    parameters = list(parameters)
+    load_parameter_trees(session, parameters)
+    fingerprints = {}
+
+    def compute(node):
+        if node.id not in fingerprints:
+            fingerprints[node.id] = parameter_fingerprint(node, [compute(child) for child in node.children],
+                                                          tolerance)
+            set_committed_value(node, 'fingerprint', fingerprints[node.id])
+        return fingerprints[node.id]
+
+    for parameter in parameters:
+        compute(parameter)
+    if fingerprints:
+        _store_fingerprints(session, fingerprints)
+    parent_ids = set(parent_ids)
+    parent_ids.update(parameter.parent_id for parameter in parameters)
+    refresh_ancestor_fingerprints(session, parent_ids.difference(fingerprints), tolerance)
+
+
+def collect_changed_parameters(session, flush_context):
+    """
+    after_flush hook remembering parameters inserted, updated or deleted by the flush.
+    Their fingerprints are recomputed by refresh_changed_fingerprints once flushed objects are persistent.
+    """
+    changed, parent_ids = session.info.setdefault('changed_parameters', ([], set()))
+    for parameter in session.new:
+        if isinstance(parameter, Parameter):
+            changed.append(parameter)
+    for parameter in session.dirty:
+        if isinstance(parameter, Parameter) and session.is_modified(parameter, include_collections=False):
+            changed.append(parameter)
+            parent_ids.update(inspect(parameter).attrs.parent_id.history.deleted)
+    for parameter in session.deleted:
+        if isinstance(parameter, Parameter):
+            parent_ids.add(parameter.parent_id)
+
+
+def refresh_changed_fingerprints(session, flush_context):
+    """
+    after_flush_postexec hook recomputing fingerprints of parameters changed by the flush and of their ancestors,
+    so stored fingerprints can not go stale. Tolerance is taken from session info.
+    """
+    changed, parent_ids = session.info.pop('changed_parameters', ([], set()))
+    tolerance = session.info.get('fingerprint_tolerance', default_fingerprint_tolerance)
+    changed = [parameter for parameter in changed if inspect(parameter).persistent]
+    refresh_fingerprints(session, changed, tolerance, parent_ids)
+
+
+def backfill_fingerprints(session, tolerance, batch_size=1000, progress=None):
+    """
+    Computes missing fingerprints of top-level parameter trees in batches, committing after every batch.
+    Calls progress(computed_trees) after every batch. Returns number of processed trees.
+    """
+    processed = 0
+    after_id = 0
+    while True:
+        roots = session.query(Parameter).filter(Parameter.parent_id == None, Parameter.id > after_id,
+                                                Parameter.fingerprint == None).order_by(Parameter.id).limit(
+            batch_size).all()
+        if not roots:
+            break
+        refresh_fingerprints(session, roots, tolerance)
+        session.commit()
+        processed += len(roots)
+        after_id = roots[-1].id
+        if progress is not None:
+            progress(processed)
+    return processed
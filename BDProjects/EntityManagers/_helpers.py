@@ -32,12 +32,14 @@ def require_not_system_user(protected_function):
     def wrapper(self, *args, **kwargs):
         user = args[0]
         if isinstance(user, User):
-            login = user.login
+            logins = [user.login]
+        elif isinstance(user, (list, tuple)):
+            logins = [str(item.get('login', None)) if isinstance(item, dict) else str(item) for item in user]
         else:
-            login = str(user)
+            logins = [str(user)]
         system_users = self.session.query(Role).filter(Role.name == 'system').one().users
         for system_user in system_users:
-            if system_user.login == login:
+            if system_user.login in logins:
                 record = 'Attempt to %s using system user credentials' % protected_function.__name__.replace('_', ' ')
                 self.session_manager.log_manager.log_record(record=record, category='Warning')
                 return None
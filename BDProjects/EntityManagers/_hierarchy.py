@@ -0,0 +1,121 @@
+from __future__ import division, print_function
+
+from sqlalchemy import or_, and_, func, literal, bindparam
+
+from BDProjects.Entities import EquipmentCategory, MeasurementType
+from BDProjects.Entities.Equipment import equipment_category_closure_table
+
+path_segment_width = 10
+
+
+def insert_category_closure(session, category_id, parent_id):
+    """
+    Adds closure rows of new equipment category: the row to itself and rows to all ancestors of its parent.
+    """
+    closure = equipment_category_closure_table
+    session.execute(closure.insert().values(ancestor_id=category_id, descendant_id=category_id, depth=0))
+    if parent_id is not None:
+        ancestors = session.query(closure.c.ancestor_id, literal(category_id), closure.c.depth + 1).filter(
+            closure.c.descendant_id == parent_id)
+        session.execute(closure.insert().from_select(['ancestor_id', 'descendant_id', 'depth'],
+                                                     ancestors.statement))
+
+
+def delete_stale_category_closure(session):
+    """
+    Deletes closure rows referring to deleted equipment categories.
+    """
+    closure = equipment_category_closure_table
+    category_ids = session.query(EquipmentCategory.id)
+    session.execute(closure.delete().where(or_(~closure.c.ancestor_id.in_(category_ids.statement),
+                                               ~closure.c.descendant_id.in_(category_ids.statement))))
+
+
+def rebuild_category_closure(session):
+    """
+    Recomputes equipment category closure table from parent IDs with single recursive INSERT ... SELECT.
+    Does not commit. Returns number of closure rows.
+    """
+    closure = equipment_category_closure_table
+    paths = session.query(EquipmentCategory.id.label('ancestor_id'), EquipmentCategory.id.label('descendant_id'),
+                          literal(0).label('depth')).cte(name='category_paths', recursive=True)
+    paths = paths.union_all(session.query(paths.c.ancestor_id, EquipmentCategory.id, paths.c.depth + 1).join(
+        paths, EquipmentCategory.parent_id == paths.c.descendant_id))
+    session.execute(closure.delete())
+    session.execute(closure.insert().from_select(['ancestor_id', 'descendant_id', 'depth'],
+                                                 session.query(paths.c.ancestor_id, paths.c.descendant_id,
+                                                               paths.c.depth).statement))
+    return session.query(closure).count()
+
+
+def measurement_type_path(parent_path, type_id):
+    """
+    Returns materialized path of measurement type: zero-padded IDs of all its ancestors and itself.
+    Paths consist of digits only, so they sort the same way under any collation.
+    """
+    return (parent_path or '') + '%0*d' % (path_segment_width, type_id)
+
+
+def path_range(path):
+    """
+    Returns (lower, upper) bounds of paths of the subtree rooted at path: lower <= subtree path < upper.
+    Upper bound is the path incremented as a number of the same width.
+    """
+    return path, '%0*d' % (len(path), int(path) + 1)
+
+
+def subtree_criterion(column, path):
+    lower, upper = path_range(path)
+    return and_(column >= lower, column < upper)
+
+
+def rebase_measurement_type_paths(session, old_path, new_path):
+    """
+    Replaces old_path prefix with new_path in paths of the whole subtree with single UPDATE statement.
+    Paths of measurement types loaded in session are expired.
+    """
+    table = MeasurementType.__table__
+    session.execute(table.update().where(subtree_criterion(table.c.path, old_path)).values(
+        path=literal(new_path) + func.substr(table.c.path, len(old_path) + 1)))
+    expire_measurement_type_paths(session)
+
+
+def expire_measurement_type_paths(session):
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, MeasurementType):
+            session.expire(instance, ['path'])
+
+
+def repair_measurement_type_paths(session):
+    """
+    Rebases subtrees of measurement types left without parent (e.g. after parent deletion) to the top level.
+    """
+    table = MeasurementType.__table__
+    q = session.query(table.c.id, table.c.path).filter(table.c.parent_id == None,
+                                                       func.length(table.c.path) > path_segment_width)
+    for type_id, path in q.all():
+        rebase_measurement_type_paths(session, path, measurement_type_path(None, type_id))
+
+
+def rebuild_measurement_type_paths(session):
+    """
+    Recomputes materialized paths of all measurement types from parent IDs. Does not commit.
+    Returns number of measurement types.
+    """
+    table = MeasurementType.__table__
+    parents = dict(session.query(table.c.id, table.c.parent_id).all())
+    paths = {}
+
+    def path(type_id):
+        if type_id not in paths:
+            parent_id = parents[type_id]
+            paths[type_id] = measurement_type_path(None if parent_id is None else path(parent_id), type_id)
+        return paths[type_id]
+
+    for type_id in parents:
+        path(type_id)
+    if paths:
+        session.execute(table.update().where(table.c.id == bindparam('type_id')).values(
+            path=bindparam('type_path')), [{'type_id': type_id, 'type_path': type_path}
+                                           for type_id, type_path in paths.items()])
+    return len(paths)
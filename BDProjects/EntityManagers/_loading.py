@@ -0,0 +1,65 @@
+from __future__ import division, print_function
+
+from sqlalchemy.orm import joinedload, selectinload, raiseload
+
+from BDProjects.Entities import Session
+from BDProjects.Entities import Sample
+from BDProjects.Entities import Equipment
+from BDProjects.Entities import Measurement
+from BDProjects.Entities import DataChannel
+
+loading_profiles = ('summary', 'full')
+
+
+def measurement_options(profile):
+    options = [joinedload(Measurement.measurement_type),
+               joinedload(Measurement.equipment),
+               joinedload(Measurement.input_data),
+               joinedload(Measurement.session).joinedload(Session.user),
+               selectinload(Measurement.samples),
+               selectinload(Measurement.parameters),
+               selectinload(Measurement.data_channels)]
+    if profile == 'full':
+        options += [selectinload(Measurement.samples).selectinload(Sample.parameters),
+                    selectinload(Measurement.data_channels).selectinload(DataChannel.parameters)]
+    return options
+
+
+def sample_options(profile):
+    options = [joinedload(Sample.project),
+               joinedload(Sample.session).joinedload(Session.user),
+               selectinload(Sample.parameters)]
+    if profile == 'full':
+        options += [selectinload(Sample.measurements)]
+    return options
+
+
+def equipment_options(profile):
+    options = [joinedload(Equipment.manufacturer),
+               joinedload(Equipment.category),
+               joinedload(Equipment.assembly),
+               joinedload(Equipment.session).joinedload(Session.user),
+               selectinload(Equipment.parameters),
+               selectinload(Equipment.measurement_types)]
+    if profile == 'full':
+        options += [selectinload(Equipment.assemblies)]
+    return options
+
+
+def loading_options(entity, profile=None, strict=False):
+    """
+    Returns loader options of named profile for listing entities with constant number of queries.
+    'summary' eagerly loads everything used by entity __str__, 'full' adds second level collections.
+    In strict mode any other relationship access of loaded entities raises instead of issuing lazy query,
+    which reveals N+1 patterns while debugging. Without profile no options are applied.
+    """
+    if profile is None:
+        return []
+    if profile not in loading_profiles:
+        raise ValueError('Unknown loading profile "%s"' % profile)
+    options = {Measurement: measurement_options,
+               Sample: sample_options,
+               Equipment: equipment_options}[entity](profile)
+    if strict:
+        options.append(raiseload('*'))
+    return options
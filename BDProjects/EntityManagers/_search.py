@@ -0,0 +1,85 @@
+from __future__ import division, print_function
+
+import datetime as dt
+import numbers
+
+from sqlalchemy import and_, or_
+
+from BDProjects import datetime_to_float
+from BDProjects.Entities import Parameter
+
+
+def search_value(value):
+    """
+    Converts search bound to the form stored in parameter float_value or string_value.
+    """
+    if isinstance(value, dt.datetime):
+        return datetime_to_float(value)
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, numbers.Number):
+        return float(value)
+    return str(value)
+
+
+def parameter_criterion(name=None, min=None, max=None, equals=None, unit=None):
+    """
+    Returns SQL criterion matching parameters by name, unit and value. Numeric and datetime values
+    are compared with float_value, strings with string_value.
+    """
+    clauses = []
+    if name is not None:
+        clauses.append(Parameter.name == str(name))
+    if unit is not None:
+        clauses.append(Parameter.unit_name == str(unit))
+    if equals is not None:
+        value = search_value(equals)
+        if isinstance(value, float):
+            clauses.append(Parameter.float_value == value)
+        else:
+            clauses.append(Parameter.string_value == value)
+    if min is not None:
+        clauses.append(Parameter.float_value >= search_value(min))
+    if max is not None:
+        clauses.append(Parameter.float_value <= search_value(max))
+    if not clauses:
+        raise ValueError('Expected at least one parameter search condition')
+    return and_(*clauses)
+
+
+def parameter_criteria(name=None, min=None, max=None, equals=None, unit=None, criteria=None):
+    """
+    Returns list of SQL criteria from the main condition and additional criteria dicts with the same keys.
+    """
+    result = []
+    if not (name is None and min is None and max is None and equals is None and unit is None):
+        result.append(parameter_criterion(name, min, max, equals, unit))
+    for criterion in criteria or []:
+        result.append(parameter_criterion(**criterion))
+    if not result:
+        raise ValueError('Expected at least one parameter search condition')
+    return result
+
+
+def parameter_owners(session, link_table, owner_name, criterion, number=0):
+    """
+    Returns query of IDs of owners linked through link_table to a parameter matching criterion or to any
+    of its ancestors, so nested parameters are found as well. Matching parameters are selected first
+    (served by the parameter name and float_value index), then the recursive CTE climbs to the roots.
+    """
+    matched = session.query(Parameter.id.label('id'), Parameter.parent_id.label('parent_id')).filter(
+        criterion).cte(name='matched_parameter_%d' % number, recursive=True)
+    ancestors = session.query(Parameter.id, Parameter.parent_id).join(matched, Parameter.id == matched.c.parent_id)
+    matched = matched.union(ancestors)
+    return session.query(link_table.c[owner_name]).join(matched, link_table.c.parameter_id == matched.c.id)
+
+
+def keyset_criterion(column, value, id_column, id_value, descending=False):
+    """
+    Returns criterion selecting rows following the row with given (value, id) in ordering by column
+    and then by id, so pages are fetched by index seek instead of OFFSET. value may be a scalar subquery
+    selecting the stored value, which avoids mismatches between bound and stored representations.
+    """
+    if descending:
+        return or_(column < value, and_(column == value, id_column < id_value))
+    return or_(column > value, and_(column == value, id_column > id_value))
@@ -0,0 +1,342 @@
+from __future__ import division, print_function
+import argparse
+import datetime
+import threading
+
+from sqlalchemy import inspect, text, func
+
+from BDProjects import Base
+from BDProjects.Client import Connector
+from BDProjects.Entities import LogCategory, Log, MeasurementType, Parameter
+from BDProjects.Entities import Session, Project, Sample, Measurement, DataChannel
+from BDProjects.Entities.Equipment import equipment_category_closure_table
+from BDProjects.EntityManagers._bulk import expire_sessions, purge_deleted_rows, merge_duplicate_parameters
+from BDProjects.EntityManagers._bulk import collect_dangling_parameters
+from BDProjects.EntityManagers._hierarchy import rebuild_category_closure, rebuild_measurement_type_paths
+from BDProjects.EntityManagers._fingerprint import default_fingerprint_tolerance, backfill_fingerprints
+from BDProjects.EntityManagers.UserManager import default_session_timeout, default_heartbeat_interval
+
+
+# columns added to existing tables since the first release, in order of introduction
+new_columns = [(Session, 'last_seen'),
+               (Project, 'deleted_at'),
+               (Measurement, 'deleted_at'),
+               (DataChannel, 'deleted_at'),
+               (Sample, 'deleted_at'),
+               (Parameter, 'fingerprint'),
+               (Parameter, 'binary_value'),
+               (MeasurementType, 'path'),
+               (Project, 'revision'),
+               (DataChannel, 'revision')]
+
+
+def log_maintenance_record(session, record, category='Information'):
+    category_id = session.query(LogCategory.id).filter(LogCategory.category == category).scalar()
+    session.add(Log(record=record, category_id=category_id))
+    session.commit()
+
+
+def sweep_sessions(connector, timeout=None):
+    """
+    Closes sessions idle for more than timeout seconds. Returns number of closed sessions.
+    """
+    if timeout is None:
+        timeout = connector.config.get('session_timeout', default_session_timeout)
+    session = connector.session()
+    try:
+        count = expire_sessions(session, timeout)
+        if count:
+            record = 'Session sweeper closed %d sessions idle for more than %d s' % (count, timeout)
+            log_maintenance_record(session, record)
+    finally:
+        session.close()
+    return count
+
+
+def purge_deleted(connector, chunk_size=10000, older_than=None, progress=None):
+    """
+    Physically removes tombstoned projects, measurements, data channels and samples
+    deleted more than older_than seconds ago (all of them if None). Returns dictionary with numbers of purged rows.
+    """
+    deleted_before = None
+    if older_than is not None:
+        deleted_before = datetime.datetime.now() - datetime.timedelta(seconds=older_than)
+    session = connector.session()
+    try:
+        counts = purge_deleted_rows(session, chunk_size, progress, deleted_before)
+        if any(counts.values()):
+            record = 'Purged %d projects, %d measurements, %d data channels, %d samples and %d data points' % (
+                counts['projects'], counts['measurements'], counts['data_channels'], counts['samples'],
+                counts['data_points'])
+            log_maintenance_record(session, record)
+    finally:
+        session.close()
+    return counts
+
+
+def compact_parameters(connector, chunk_size=1000, progress=None):
+    """
+    One-off job merging identical top-level parameter trees and rewriting association rows.
+    Returns dictionary with numbers of merged groups, rewritten association rows and deleted parameters.
+    """
+    session = connector.session()
+    try:
+        counts = merge_duplicate_parameters(session, chunk_size, progress)
+        if counts['groups']:
+            record = 'Parameter compaction merged %d groups of identical trees and deleted %d parameters' % (
+                counts['groups'], counts['parameters'])
+            log_maintenance_record(session, record)
+    finally:
+        session.close()
+    return counts
+
+
+def collect_parameters(connector, batch_size=1000, max_batches=None, progress=None, after_id=0):
+    """
+    Deletes parameter trees not used by any sample, measurement, data channel or equipment.
+    Stops after max_batches batches if given. Returns dictionary with numbers of deleted trees and parameters
+    and ID of the last examined tree to resume from.
+    """
+    session = connector.session()
+    try:
+        counts = collect_dangling_parameters(session, batch_size, max_batches, progress, after_id)
+        if counts['trees']:
+            record = 'Parameter collector deleted %d dangling trees with %d parameters' % (counts['trees'],
+                                                                                        counts['parameters'])
+            log_maintenance_record(session, record)
+    finally:
+        session.close()
+    return counts
+
+
+def add_missing_column(engine, table, column_name):
+    """
+    Adds column created in newer BDProjects version (with its indexes) to existing database table.
+    Returns True if column was added.
+    """
+    if column_name in [column['name'] for column in inspect(engine).get_columns(table.name)]:
+        return False
+    column = table.c[column_name]
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table.name, column.name,
+                                                                     column.type.compile(engine.dialect))))
+    for index in table.indexes:
+        if column_name in index.columns:
+            index.create(engine)
+    return True
+
+
+def rebuild_hierarchies(connector):
+    """
+    Rebuilds equipment category closure table and measurement type materialized paths of existing database,
+    creating missing table and column if needed. Returns dictionary with numbers of rebuilt rows.
+    """
+    equipment_category_closure_table.create(connector.engine, checkfirst=True)
+    add_missing_column(connector.engine, MeasurementType.__table__, 'path')
+    session = connector.session()
+    try:
+        counts = {'equipment_categories': rebuild_category_closure(session),
+                  'measurement_types': rebuild_measurement_type_paths(session)}
+        session.commit()
+        record = 'Rebuilt equipment category closure with %d rows and paths of %d measurement types' % (
+            counts['equipment_categories'], counts['measurement_types'])
+        log_maintenance_record(session, record)
+    finally:
+        session.close()
+    return counts
+
+
+def fingerprint_parameters(connector, batch_size=1000, progress=None):
+    """
+    Computes missing fingerprints of parameter trees of existing database, creating missing columns if needed.
+    Returns number of fingerprinted top-level trees.
+    """
+    for column_name in ['binary_value', 'fingerprint']:
+        add_missing_column(connector.engine, Parameter.__table__, column_name)
+    tolerance = connector.config.get('fingerprint_tolerance', default_fingerprint_tolerance)
+    session = connector.session()
+    try:
+        count = backfill_fingerprints(session, tolerance, batch_size, progress)
+        if count:
+            record = 'Computed fingerprints of %d parameter trees' % count
+            log_maintenance_record(session, record)
+    finally:
+        session.close()
+    return count
+
+
+def migrate_database(connector):
+    """
+    Upgrades database created by older BDProjects version: creates missing tables, columns and indexes
+    and fills new columns of existing rows. Foreign key ON DELETE rules of existing tables are not changed:
+    bulk delete and purge jobs remove dependent and association rows explicitly and do not rely on them.
+    Returns dictionary with numbers of added columns and backfilled rows.
+    """
+    engine = connector.engine
+    Base.metadata.create_all(engine, checkfirst=True)
+    columns = 0
+    for entity, column_name in new_columns:
+        columns += add_missing_column(engine, entity.__table__, column_name)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    session = connector.session()
+    try:
+        session.query(Session).filter(Session.last_seen == None).update(
+            {Session.last_seen: func.coalesce(Session.closed, Session.opened)}, synchronize_session=False)
+        session.query(Project).filter(Project.revision == None).update({Project.revision: 0},
+                                                                       synchronize_session=False)
+        session.query(DataChannel).filter(DataChannel.revision == None).update({DataChannel.revision: 0},
+                                                                               synchronize_session=False)
+        session.commit()
+        record = 'Database migrated, %d columns added' % columns
+        log_maintenance_record(session, record)
+    finally:
+        session.close()
+    counts = {'columns': columns, 'parameters': fingerprint_parameters(connector)}
+    counts.update(rebuild_hierarchies(connector))
+    return counts
+
+
+class MaintenanceWorker(threading.Thread):
+    """
+    Daemon thread running maintenance job periodically. job is a callable taking connector,
+    subclasses may override run_job instead.
+    """
+
+    def __init__(self, connector, interval, job=None):
+        super(MaintenanceWorker, self).__init__()
+        if job is None and type(self).run_job == MaintenanceWorker.run_job:
+            raise ValueError('Expected maintenance job callable')
+        self.daemon = True
+        self.connector = connector
+        self.interval = interval
+        self.job = job
+        self.__stop_event = threading.Event()
+
+    def run(self):
+        while not self.__stop_event.wait(self.interval):
+            self.run_job()
+
+    def run_job(self):
+        return self.job(self.connector)
+
+    def stop(self, timeout=None):
+        self.__stop_event.set()
+        self.join(timeout)
+
+
+class SessionSweeper(MaintenanceWorker):
+
+    def __init__(self, connector, interval=None, timeout=None):
+        if interval is None:
+            interval = connector.config.get('heartbeat_interval', default_heartbeat_interval)
+        super(SessionSweeper, self).__init__(connector, interval)
+        self.timeout = timeout
+        self.closed_sessions = 0
+
+    def run_job(self):
+        self.closed_sessions += sweep_sessions(self.connector, self.timeout)
+
+
+class DataPurger(MaintenanceWorker):
+    """
+    Purges tombstoned data periodically. If off_hours tuple (start_hour, end_hour) is given,
+    purge runs only when local time is within that window, which may wrap around midnight.
+    """
+
+    def __init__(self, connector, interval=3600, chunk_size=10000, older_than=None, off_hours=None):
+        super(DataPurger, self).__init__(connector, interval)
+        self.chunk_size = chunk_size
+        self.older_than = older_than
+        self.off_hours = off_hours
+        self.purged_data_points = 0
+
+    def in_off_hours(self, moment=None):
+        if self.off_hours is None:
+            return True
+        if moment is None:
+            moment = datetime.datetime.now()
+        start, end = self.off_hours
+        if start <= end:
+            return start <= moment.hour < end
+        return moment.hour >= start or moment.hour < end
+
+    def run_job(self):
+        if self.in_off_hours():
+            self.purged_data_points += purge_deleted(self.connector, self.chunk_size, self.older_than)['data_points']
+
+
+class ParameterCollector(MaintenanceWorker):
+    """
+    Collects dangling parameters incrementally, at most max_batches batches of batch_size trees per run.
+    Every run resumes where the previous one stopped.
+    """
+
+    def __init__(self, connector, interval=3600, batch_size=1000, max_batches=10):
+        super(ParameterCollector, self).__init__(connector, interval)
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.collected_parameters = 0
+        self.last_id = 0
+
+    def run_job(self):
+        counts = collect_parameters(self.connector, self.batch_size, self.max_batches, after_id=self.last_id)
+        self.collected_parameters += counts['parameters']
+        self.last_id = counts['last_id']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m BDProjects.Maintenance',
+                                     description='BDProjects database maintenance jobs')
+    parser.add_argument('config', help='database config file')
+    subparsers = parser.add_subparsers(dest='command')
+    sweep_parser = subparsers.add_parser('sweep-sessions', help='close idle sessions')
+    sweep_parser.add_argument('--timeout', type=int, default=None, help='idle timeout in seconds')
+    purge_parser = subparsers.add_parser('purge-deleted', help='physically remove soft deleted data')
+    purge_parser.add_argument('--chunk-size', type=int, default=10000, help='rows deleted per statement')
+    purge_parser.add_argument('--older-than', type=int, default=None,
+                              help='purge only data deleted more than given number of seconds ago')
+    compact_parser = subparsers.add_parser('compact-parameters', help='merge identical parameter trees')
+    compact_parser.add_argument('--chunk-size', type=int, default=1000, help='groups merged per transaction')
+    collect_parser = subparsers.add_parser('collect-parameters', help='delete dangling parameters')
+    collect_parser.add_argument('--batch-size', type=int, default=1000, help='trees deleted per statement')
+    collect_parser.add_argument('--max-batches', type=int, default=None, help='stop after given number of batches')
+    subparsers.add_parser('rebuild-hierarchies', help='rebuild equipment category and measurement type indexes')
+    fingerprint_parser = subparsers.add_parser('fingerprint-parameters',
+                                               help='compute missing fingerprints of parameter trees')
+    fingerprint_parser.add_argument('--batch-size', type=int, default=1000, help='trees fingerprinted per transaction')
+    subparsers.add_parser('migrate', help='upgrade database created by older BDProjects version')
+    args = parser.parse_args(argv)
+    connector = Connector(config_file_name=args.config)
+    if args.command == 'sweep-sessions':
+        print('Closed %d idle sessions' % sweep_sessions(connector, args.timeout))
+    elif args.command == 'purge-deleted':
+        counts = purge_deleted(connector, args.chunk_size, args.older_than)
+        print('Purged %d projects, %d measurements, %d data channels, %d samples and %d data points' % (
+            counts['projects'], counts['measurements'], counts['data_channels'], counts['samples'],
+            counts['data_points']))
+    elif args.command == 'compact-parameters':
+        counts = compact_parameters(connector, args.chunk_size)
+        print('Merged %d groups of identical parameter trees, deleted %d parameters' % (counts['groups'],
+                                                                                      counts['parameters']))
+    elif args.command == 'collect-parameters':
+        counts = collect_parameters(connector, args.batch_size, args.max_batches)
+        print('Deleted %d dangling parameter trees with %d parameters' % (counts['trees'], counts['parameters']))
+    elif args.command == 'rebuild-hierarchies':
+        counts = rebuild_hierarchies(connector)
+        print('Rebuilt equipment category closure with %d rows and paths of %d measurement types' % (
+            counts['equipment_categories'], counts['measurement_types']))
+    elif args.command == 'fingerprint-parameters':
+        print('Computed fingerprints of %d parameter trees' % fingerprint_parameters(connector, args.batch_size))
+    elif args.command == 'migrate':
+        counts = migrate_database(connector)
+        print('Added %d columns, computed fingerprints of %d parameter trees, '
+              'rebuilt paths of %d measurement types' % (counts['columns'], counts['parameters'],
+                                                         counts['measurement_types']))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
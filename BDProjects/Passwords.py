@@ -0,0 +1,86 @@
+from __future__ import division, print_function
+import threading
+import multiprocessing
+from functools import partial
+
+from passlib.context import CryptContext
+from passlib.apps import custom_app_context
+
+__contexts = {}
+
+
+def password_context(scheme=None, rounds=None):
+    """
+    Returns passlib CryptContext hashing with given scheme and cost.
+    Hashes created with default BDProjects schemes are always verifiable.
+    """
+    if scheme is None:
+        scheme = custom_app_context.default_scheme()
+    key = (scheme, rounds)
+    if key not in __contexts:
+        schemes = [str(scheme)] + [s for s in custom_app_context.schemes() if s != scheme]
+        settings = {}
+        if rounds is not None:
+            settings['%s__rounds' % scheme] = int(rounds)
+        try:
+            __contexts[key] = CryptContext(schemes=schemes, default=str(scheme), **settings)
+        except (KeyError, ValueError, TypeError):
+            raise ValueError('Wrong password hashing scheme or rounds')
+    return __contexts[key]
+
+
+def hash_password(password, scheme=None, rounds=None):
+    return password_context(scheme, rounds).hash(password)
+
+
+def verify_password(password, password_hash, scheme=None, rounds=None):
+    return password_context(scheme, rounds).verify(password, password_hash)
+
+
+def _hash_password(scheme, rounds, password):
+    return hash_password(password, scheme, rounds)
+
+
+def hash_passwords(passwords, scheme=None, rounds=None, processes=None):
+    """
+    Hashes list of passwords in a process pool. Falls back to serial hashing for single password.
+    """
+    passwords = list(passwords)
+    if len(passwords) < 2 or processes == 1:
+        return [hash_password(password, scheme, rounds) for password in passwords]
+    if processes is None:
+        processes = min(multiprocessing.cpu_count(), len(passwords))
+    pool = multiprocessing.Pool(processes)
+    try:
+        password_hashes = pool.map(partial(_hash_password, scheme, rounds), passwords)
+    finally:
+        pool.close()
+        pool.join()
+    return password_hashes
+
+
+class PasswordVerification(object):
+    """
+    Verifies password on a worker thread, so the caller is not blocked by expensive hash computation.
+    """
+
+    def __init__(self, password, password_hash, scheme=None, rounds=None):
+        self.__result = None
+        self.__thread = threading.Thread(target=self._verify, args=(password, password_hash, scheme, rounds))
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def _verify(self, password, password_hash, scheme, rounds):
+        try:
+            self.__result = verify_password(password, password_hash, scheme, rounds)
+        except (ValueError, TypeError):
+            self.__result = False
+
+    def done(self):
+        return not self.__thread.is_alive()
+
+    def result(self, timeout=None):
+        self.__thread.join(timeout)
+        if self.__thread.is_alive():
+            return None
+        return self.__result
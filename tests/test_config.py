@@ -23,7 +23,9 @@ class TestConfig(unittest.TestCase):
                                  'host': '',
                                  'port': '',
                                  'user': '',
-                                 'password': ''
+                                 'password': '',
+                                 'password_scheme': 'sha256_crypt',
+                                 'password_rounds': 1000
                                  }
         self.assertEqual(cp, connection_parameters)
         with self.assertRaises(IOError):
@@ -66,3 +68,9 @@ class TestConfig(unittest.TestCase):
         connection_parameters['port'] = str(connection_parameters['port'])
         cp = read_config(self.temp_config_file_name)
         self.assertEqual(cp, connection_parameters)
+        connection_parameters['port'] = ''
+        connection_parameters['password_scheme'] = 'sha512_crypt'
+        connection_parameters['password_rounds'] = 1000
+        write_config(connection_parameters, self.temp_config_file_name)
+        cp = read_config(self.temp_config_file_name)
+        self.assertEqual(cp, connection_parameters)
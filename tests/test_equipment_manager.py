@@ -0,0 +1,99 @@
+from __future__ import division, print_function
+import unittest
+
+from sqlalchemy import event
+
+from BDProjects.Entities import Measurement
+from BDProjects.Entities.Equipment import equipment_category_closure_table
+from BDProjects.Client import Connector, Installer, Client
+from BDProjects.Maintenance import rebuild_hierarchies, main
+
+
+class TestEquipmentManager(unittest.TestCase):
+
+    def setUp(self):
+        self.config_file_name = 'tests/config.ini'
+        self.connector = Connector(config_file_name=self.config_file_name)
+        Installer(connector=self.connector, overwrite=True)
+        self.client = Client(connector=self.connector)
+        self.client.user_manager.sign_in('administrator', 'admin')
+        self.test_user = self.client.user_manager.create_user('jack', 'pass', 'jack@somesite.com', 'Jack', 'Black')
+        self.client.user_manager.sign_out()
+        self.statements = []
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_equipment_categories_tree(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        em = um.equipment_manager
+        meters = em.create_equipment_category('Meters')
+        electrometers = em.create_equipment_category('Electrometers', parent=meters)
+        em.create_equipment_category('Picoammeters', parent=electrometers)
+        em.create_equipment_category('Oscilloscopes', parent=meters)
+        em.create_equipment_category('Furnaces')
+        em.create_equipment_category('Ovens', parent='Furnaces')
+        tree = {'Meters': {'Electrometers': {'Picoammeters': {}}, 'Oscilloscopes': {}},
+                'Furnaces': {'Ovens': {}}}
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            self.assertEqual(em.get_equipment_categories_tree(), tree)
+            self.assertEqual(em.get_equipment_categories_tree('Meters'), tree['Meters'])
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        self.assertEqual(len([statement for statement in self.statements if 'equipment_category' in statement]), 2)
+        self.assertEqual(em.get_equipment_categories_tree('Not existing'), {})
+        keithley = em.create_equipment('Keithley 6517', category='Electrometers')
+        pico = em.create_equipment('Keithley 6487', category='Picoammeters')
+        em.create_equipment('Tube furnace', category='Furnaces')
+        self.assertEqual(em.get_equipment(category=meters), [keithley, pico])
+        self.assertEqual(em.get_equipment(category='meters'), [keithley, pico])
+        self.assertEqual(em.get_equipment(name='6487', category='Electrometers'), [pico])
+        session = self.client.session
+        rows = session.query(equipment_category_closure_table).count()
+        self.assertEqual(rows, 11)
+        session.execute(equipment_category_closure_table.delete())
+        session.commit()
+        self.assertEqual(rebuild_hierarchies(self.connector)['equipment_categories'], rows)
+        self.assertEqual(em.get_equipment_categories_tree('Meters'), tree['Meters'])
+        em.delete_equipment_category(electrometers)
+        self.assertEqual(em.get_equipment_categories_tree(), {'Furnaces': {'Ovens': {}}, 'Oscilloscopes': {},
+                                                              'Picoammeters': {}})
+        self.assertEqual(session.query(equipment_category_closure_table).count(), 5)
+        main([self.config_file_name, 'rebuild-hierarchies'])
+        um.sign_out()
+
+    def test_measurement_name_cache(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        em = um.equipment_manager
+        mm = um.measurement_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        iv = um.measurement_type_manager.create_measurement_type('IV')
+        cv = um.measurement_type_manager.create_measurement_type('CV')
+        equipment = em.create_equipment('Keithley 6517', category=em.create_equipment_category('Electrometers'))
+        em.add_measurement_type_to_equipment(equipment, iv)
+        self.assertIsInstance(mm.create_measurement('IV 0', 'IV', 'Keithley 6517'), Measurement)
+        self.assertIsNone(mm.create_measurement('CV 0', 'CV', 'Keithley 6517'))
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            for i in range(1, 4):
+                mm.create_measurement('IV %d' % i, 'IV', 'Keithley 6517')
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        lookups = [statement for statement in self.statements
+                   if 'FROM measurement_type' in statement or 'FROM equipment' in statement]
+        self.assertEqual(lookups, [])
+        self.assertEqual(len(mm.get_measurements()), 4)
+        em.add_measurement_type_to_equipment(equipment, cv)
+        self.assertIsInstance(mm.create_measurement('CV 0', 'CV', 'Keithley 6517'), Measurement)
+        em.remove_measurement_type_from_equipment(equipment, iv)
+        self.assertIsNone(mm.create_measurement('IV 4', 'IV', 'Keithley 6517'))
+        self.assertIsInstance(mm.create_measurement('CV 1', 'CV', 'Keithley'), Measurement)
+        em.delete_equipment(equipment)
+        self.assertIsNone(mm.create_measurement('CV 2', 'CV', 'Keithley 6517'))
+        um.sign_out()
@@ -0,0 +1,205 @@
+from __future__ import division, print_function
+import unittest
+import datetime
+import time
+
+from sqlalchemy import inspect, text
+
+from BDProjects.Entities import Session
+from BDProjects.Entities import Project
+from BDProjects.Entities import Sample
+from BDProjects.Entities import Measurement
+from BDProjects.Entities import DataChannel, DataPoint
+from BDProjects.Entities import Parameter
+from BDProjects.Client import Connector, Installer, Client
+from BDProjects.Maintenance import sweep_sessions, SessionSweeper, purge_deleted, DataPurger, main
+from BDProjects.Maintenance import collect_parameters, ParameterCollector, MaintenanceWorker, migrate_database
+
+
+class TestMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        self.config_file_name = 'tests/config.ini'
+        self.connector = Connector(config_file_name=self.config_file_name)
+        Installer(connector=self.connector, overwrite=True)
+        self.client = Client(connector=self.connector)
+        self.client.user_manager.sign_in('administrator', 'admin')
+        self.test_user = self.client.user_manager.create_user('jack', 'pass', 'jack@somesite.com', 'Jack', 'Black')
+        self.client.user_manager.sign_out()
+
+    def _make_session_idle(self, client):
+        past = datetime.datetime.now() - datetime.timedelta(days=2)
+        self.client.session.query(Session).filter(Session.id == client.user_manager.session_data.id).update(
+            {Session.last_seen: past}, synchronize_session=False)
+        self.client.session.commit()
+
+    def test_sweep_sessions(self):
+        client = Client(connector=self.connector)
+        client.user_manager.sign_in('jack', 'pass')
+        self.assertEqual(sweep_sessions(self.connector), 0)
+        self._make_session_idle(client)
+        self.assertEqual(sweep_sessions(self.connector), 1)
+        self.assertFalse(client.user_manager.signed_in())
+        client.user_manager.sign_in('jack', 'pass')
+        self._make_session_idle(client)
+        main([self.config_file_name, 'sweep-sessions', '--timeout', '3600'])
+        self.assertFalse(client.user_manager.signed_in())
+
+    def test_session_sweeper(self):
+        client = Client(connector=self.connector)
+        client.user_manager.sign_in('jack', 'pass')
+        self._make_session_idle(client)
+        sweeper = SessionSweeper(self.connector, interval=0.05)
+        sweeper.start()
+        time.sleep(0.5)
+        sweeper.stop()
+        self.assertFalse(sweeper.is_alive())
+        self.assertEqual(sweeper.closed_sessions, 1)
+        self.assertFalse(client.user_manager.signed_in())
+
+    def test_maintenance_worker(self):
+        self.assertRaises(ValueError, MaintenanceWorker, self.connector, 0.05)
+        runs = []
+        worker = MaintenanceWorker(self.connector, 0.05, job=runs.append)
+        worker.start()
+        time.sleep(0.3)
+        worker.stop()
+        self.assertFalse(worker.is_alive())
+        self.assertTrue(runs)
+        self.assertTrue(all(connector is self.connector for connector in runs))
+
+    def test_purge_deleted(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        prj1 = um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files')
+        prj2 = um.project_manager.create_project(name='Super Project 2', data_dir='tests/data/files')
+        um.project_manager.open_project(prj1.name)
+        measurement_type = um.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        sample1 = um.sample_manager.create_sample('Sample 1')
+        sample2 = um.sample_manager.create_sample('Sample 2')
+        measurements = []
+        for name in ['IV', 'CV']:
+            measurement = um.measurement_manager.create_measurement(name, measurement_type, equipment)
+            um.measurement_manager.add_sample_to_measurement(measurement, sample1)
+            for channel_name in ['Current', 'Voltage']:
+                channel = um.measurement_manager.create_data_channel(channel_name, measurement)
+                for i in range(3):
+                    um.measurement_manager.create_data_point(channel, float_value=i * 0.5, point_index=i)
+            measurements.append(measurement)
+        self.assertTrue(um.sample_manager.delete_sample(sample2, soft=True))
+        self.assertFalse(um.sample_manager.delete_sample(sample2, soft=True))
+        self.assertIsNone(um.sample_manager.create_sample('Sample 2'))
+        self.assertEqual(um.sample_manager.get_samples(), [sample1])
+        self.assertEqual(len(um.sample_manager.get_samples(include_deleted=True)), 2)
+        self.assertTrue(um.measurement_manager.delete_measurement(measurements[1], soft=True))
+        self.assertEqual(um.measurement_manager.get_measurements(), [measurements[0]])
+        self.assertTrue(um.measurement_manager.delete_data_channel(channel, soft=True))
+        self.assertEqual(len(um.measurement_manager.get_data_channels(measurements[1])), 1)
+        summary = um.project_manager.get_project_summary()
+        self.assertEqual(summary['samples'], 1)
+        self.assertEqual(summary['measurements'], 1)
+        self.assertEqual(summary['data_channels'], 2)
+        self.assertEqual(summary['data_points'], 6)
+        prj3 = um.project_manager.clone_project(prj1, 'Super Project 3', include_data=True)
+        summary3 = um.project_manager.get_project_summary(prj3)
+        del summary['last_activity'], summary3['last_activity']
+        self.assertEqual(summary, summary3)
+        self.assertEqual(purge_deleted(self.connector, older_than=3600)['data_points'], 0)
+        counts = purge_deleted(self.connector, chunk_size=2)
+        self.assertEqual(counts, {'projects': 0, 'measurements': 1, 'data_channels': 0, 'samples': 1,
+                                  'data_points': 6})
+        self.assertEqual(self.client.session.query(Measurement).filter(Measurement.project_id == prj1.id).count(), 1)
+        prj1_id = prj1.id
+        self.assertTrue(um.project_manager.delete_project(prj1, soft=True))
+        self.assertIsNone(um.project_manager.project)
+        self.assertEqual(um.project_manager.get_projects(), [prj2, prj3])
+        self.assertIsNone(um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files'))
+        purger = DataPurger(self.connector, interval=0.05, off_hours=(1, 5))
+        self.assertFalse(purger.in_off_hours(datetime.datetime(2020, 1, 1, 12)))
+        purger.off_hours = (22, 6)
+        self.assertTrue(purger.in_off_hours(datetime.datetime(2020, 1, 1, 23)))
+        self.assertTrue(purger.in_off_hours(datetime.datetime(2020, 1, 1, 3)))
+        self.assertFalse(purger.in_off_hours(datetime.datetime(2020, 1, 1, 12)))
+        purger.off_hours = None
+        purger.start()
+        time.sleep(0.5)
+        purger.stop()
+        self.assertEqual(purger.purged_data_points, 6)
+        self.assertEqual(self.client.session.query(Project).filter(Project.id == prj1_id).count(), 0)
+        self.assertEqual(self.client.session.query(Sample).count(), 1)
+        self.assertEqual(self.client.session.query(DataChannel).count(), 2)
+        self.assertEqual(self.client.session.query(DataPoint).count(), 6)
+        main([self.config_file_name, 'purge-deleted'])
+        um.sign_out()
+
+    def test_collect_parameters(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        sample = um.sample_manager.create_sample('Sample')
+        pm.create_parameters_from_dict({'Recipe': {'Temperature': 400.0, 'Time': (0.0, 30.0)}})
+        self.assertEqual(pm.get_dangling_parameters(delete=True), 1)
+        self.assertEqual(self.client.session.query(Parameter).count(), 0)
+        used = pm.create_parameters_from_dict({'Recipe': {'Temperature': 450.0, 'Time': (0.0, 30.0)}})[0]
+        um.sample_manager.add_parameter_to_sample(sample, used)
+        partly_used = pm.create_parameters_from_dict({'Setup': {'Gas': 'N2'}})[0]
+        um.sample_manager.add_parameter_to_sample(sample, partly_used.children[0])
+        dangling = [pm.create_parameters_from_dict({'Recipe %d' % i: {'Temperature': 400.0 + i}})[0]
+                    for i in range(3)]
+        dangling.append(pm.create_numeric_parameter('Pressure', 1.0))
+        self.assertEqual(pm.get_dangling_parameters(), [partly_used] + dangling)
+        first_id = dangling[0].id
+        self.assertEqual(collect_parameters(self.connector, batch_size=2, max_batches=1),
+                         {'trees': 1, 'parameters': 2, 'last_id': first_id})
+        collector = ParameterCollector(self.connector, interval=0.05, batch_size=1, max_batches=1)
+        collector.start()
+        time.sleep(0.5)
+        collector.stop()
+        self.assertEqual(collector.collected_parameters, 5)
+        self.assertEqual(pm.get_dangling_parameters(delete=True), 0)
+        self.client.session.expire_all()
+        self.assertEqual(pm.get_dangling_parameters(), [partly_used])
+        self.assertEqual(self.client.session.query(Parameter).count(), 7)
+        self.assertEqual(sample.parameters, [used, partly_used.children[0]])
+        main([self.config_file_name, 'collect-parameters', '--batch-size', '10'])
+        um.sign_out()
+
+    def test_migrate_database(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        pm.create_parameters_from_dict({'Recipe': {'Temperature': 450.0, 'Gas': 'N2'}})
+        fingerprints = dict(self.client.session.query(Parameter.id, Parameter.fingerprint))
+        um.sign_out()
+        self.client.session.close()
+        old_schema = [('parameter', 'fingerprint', 'ix_parameter_fingerprint'),
+                      ('session', 'last_seen', 'ix_session_last_seen'),
+                      ('measurement', 'deleted_at', 'ix_measurement_deleted_at'),
+                      ('project', 'revision', None)]
+        with self.connector.engine.begin() as connection:
+            for table_name, column_name, index_name in old_schema:
+                if index_name is not None:
+                    connection.execute(text('DROP INDEX %s' % index_name))
+                connection.execute(text('ALTER TABLE %s DROP COLUMN %s' % (table_name, column_name)))
+            connection.execute(text('DROP INDEX ix_measurement_project_started'))
+        self.connector.engine.dispose()
+        counts = migrate_database(self.connector)
+        self.assertEqual(counts['columns'], 4)
+        self.assertEqual(counts['parameters'], 1)
+        inspector = inspect(self.connector.engine)
+        for table_name, column_name, index_name in old_schema:
+            self.assertIn(column_name, [column['name'] for column in inspector.get_columns(table_name)])
+        self.assertIn('ix_measurement_project_started',
+                      [index['name'] for index in inspector.get_indexes('measurement')])
+        self.client.session.expire_all()
+        self.assertEqual(dict(self.client.session.query(Parameter.id, Parameter.fingerprint)), fingerprints)
+        self.assertEqual(self.client.session.query(Session).filter(Session.last_seen == None).count(), 0)
+        self.assertEqual(self.client.session.query(Project).filter(Project.revision == None).count(), 0)
+        self.assertEqual(migrate_database(self.connector)['columns'], 0)
+        main([self.config_file_name, 'migrate'])
@@ -0,0 +1,179 @@
+from __future__ import division, print_function
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+from BDProjects.Entities import Measurement, DataChannel
+from BDProjects.Client import Connector, Installer, Client
+
+
+class TestMeasurementManager(unittest.TestCase):
+
+    def setUp(self):
+        self.config_file_name = 'tests/config.ini'
+        self.connector = Connector(config_file_name=self.config_file_name)
+        Installer(connector=self.connector, overwrite=True)
+        self.client = Client(connector=self.connector)
+        self.client.user_manager.sign_in('administrator', 'admin')
+        self.test_user = self.client.user_manager.create_user('jack', 'pass', 'jack@somesite.com', 'Jack', 'Black')
+        self.client.user_manager.sign_out()
+        self.statements = []
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _open_project(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        em = um.equipment_manager
+        iv = um.measurement_type_manager.create_measurement_type('IV')
+        um.measurement_type_manager.create_measurement_type('CV')
+        equipment = em.create_equipment('Keithley 6517', category=em.create_equipment_category('Electrometers'))
+        em.add_measurement_type_to_equipment(equipment, iv)
+        return um
+
+    def test_create_measurements(self):
+        um = self._open_project()
+        mm = um.measurement_manager
+        wafer = um.sample_manager.create_sample('Wafer 1')
+        um.sample_manager.create_sample('Wafer 2')
+        temperature = um.parameter_manager.create_numeric_parameter('Temperature', 300.0, unit_name='K')
+        manifest = [{'name': 'IV %d' % i,
+                     'measurement_type': 'IV',
+                     'equipment': 'Keithley 6517',
+                     'description': 'Die %d' % i,
+                     'samples': [wafer, 'Wafer 2'],
+                     'parameters': [temperature] if i % 2 else {'Die': i, 'Bias': (0.0, 5.0)},
+                     'channels': ['Voltage', {'name': 'Current', 'unit_name': 'A'}]} for i in range(10)]
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            measurements = mm.create_measurements(manifest)
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        inserts = [statement for statement in self.statements
+                   if statement.startswith('INSERT INTO measurement_sample')
+                   or statement.startswith('INSERT INTO measurement_parameter')]
+        self.assertEqual(len(inserts), 2)
+        allocations = [statement for statement in self.statements
+                       if 'max(measurement.id)' in statement or 'max(data_channel.id)' in statement]
+        self.assertEqual(allocations, [])
+        self.assertEqual([measurement.name for measurement in measurements], ['IV %d' % i for i in range(10)])
+        self.assertEqual(len(mm.get_measurements()), 10)
+        measurement = measurements[3]
+        self.assertEqual(measurement.description, 'Die 3')
+        self.assertEqual(measurement.equipment.name, 'Keithley 6517')
+        self.assertEqual(sorted(sample.name for sample in measurement.samples), ['Wafer 1', 'Wafer 2'])
+        self.assertEqual(measurement.parameters, [temperature])
+        self.assertEqual(sorted(parameter.name for parameter in measurements[4].parameters), ['Bias', 'Die'])
+        channels = mm.get_data_channels(measurement, 'Current', exact=True)
+        self.assertEqual(len(channels), 1)
+        self.assertEqual(channels[0].unit_name, 'A')
+        self.assertEqual(self.client.session.query(DataChannel).count(), 20)
+        invalid = [{'name': 'IV 10', 'measurement_type': 'IV', 'equipment': 'Keithley 6517'},
+                   {'name': 'CV 0', 'measurement_type': 'CV', 'equipment': 'Keithley 6517'}]
+        self.assertIsNone(mm.create_measurements(invalid))
+        invalid[1] = {'name': 'IV 11', 'measurement_type': 'IV', 'equipment': 'Keithley 6517',
+                      'samples': ['Not existing']}
+        self.assertIsNone(mm.create_measurements(invalid))
+        invalid[1] = {'name': 'IV 11', 'measurement_type': 'IV', 'equipment': 'Keithley 6517',
+                      'channels': ['Voltage', 'Voltage']}
+        self.assertIsNone(mm.create_measurements(invalid))
+        self.assertEqual(self.client.session.query(Measurement).count(), 10)
+        self.assertEqual(mm.create_measurements([]), [])
+        dialect = self.connector.engine.dialect
+        dialect.insert_executemany_returning_sort_by_parameter_order = False
+        try:
+            measurements = mm.create_measurements([dict(spec, name='Row %d' % i) for i, spec in enumerate(manifest)])
+        finally:
+            del dialect.insert_executemany_returning_sort_by_parameter_order
+        self.assertEqual([measurement.name for measurement in measurements], ['Row %d' % i for i in range(10)])
+        self.assertEqual(measurements[3].parameters, [temperature])
+        self.assertEqual(len(mm.get_data_channels(measurements[9])), 2)
+        self.assertEqual(self.client.session.query(Measurement).count(), 20)
+        um.sign_out()
+
+    def test_search_measurements(self):
+        um = self._open_project()
+        mm = um.measurement_manager
+        wafer = um.sample_manager.create_sample('Wafer 1')
+        manifest = [{'name': 'IV %02d' % i, 'measurement_type': 'IV', 'equipment': 'Keithley 6517',
+                     'samples': [wafer] if i < 5 else [], 'parameters': {'Temperature': 300.0 + i}}
+                    for i in range(25)]
+        measurements = mm.create_measurements(manifest)
+        measurements[-1].finished = measurements[-1].started
+        um.session.commit()
+        pages, after = [], None
+        while True:
+            page = mm.search_measurements(order_by='-name', limit=10, after=after)
+            if not page:
+                break
+            pages.append(page)
+            after = page[-1]
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), measurements[::-1])
+        page = mm.search_measurements(order_by='started', limit=10, after=measurements[9])
+        self.assertEqual(page, measurements[10:20])
+        self.assertEqual(mm.search_measurements(project='Super Project', name='IV 1'), measurements[10:20])
+        self.assertEqual(mm.search_measurements(sample='Wafer 1'), measurements[:5])
+        self.assertEqual(mm.search_measurements(sample=wafer, name='3'), [measurements[3]])
+        self.assertEqual(mm.search_measurements(type='IV', equipment='Keithley 6517'), measurements)
+        self.assertEqual(mm.search_measurements(type='CV'), [])
+        self.assertEqual(mm.search_measurements(finished=True), measurements[-1:])
+        self.assertEqual(len(mm.search_measurements(finished=False)), 24)
+        self.assertEqual(mm.search_measurements(started_between=(None, measurements[0].started)), measurements)
+        filters = [{'name': 'Temperature', 'min': 310.0}, {'name': 'Temperature', 'max': 312.0}]
+        self.assertEqual(mm.search_measurements(parameter_filters=filters), measurements[10:13])
+        self.assertIsNone(mm.search_measurements(order_by='unknown'))
+        self.assertIsNone(mm.search_measurements(project='Not existing'))
+        um.sign_out()
+
+    def _listing_statements(self, list_entities):
+        self.client.session.expire_all()
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            for entity in list_entities():
+                str(entity)
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        return len(self.statements)
+
+    def test_loading_profiles(self):
+        um = self._open_project()
+        mm = um.measurement_manager
+        wafer = um.sample_manager.create_sample('Wafer 1')
+        manifest = [{'name': 'IV %d' % i, 'measurement_type': 'IV', 'equipment': 'Keithley 6517',
+                     'samples': [wafer], 'parameters': {'Die': i}, 'channels': ['Voltage', 'Current']}
+                    for i in range(20)]
+        mm.create_measurements(manifest[:5])
+        statements = self._listing_statements(lambda: mm.get_measurements(profile='summary'))
+        mm.create_measurements(manifest[5:])
+        self.assertEqual(self._listing_statements(lambda: mm.get_measurements(profile='summary')), statements)
+        self.assertGreater(self._listing_statements(mm.get_measurements), 3 * statements)
+        self.assertEqual(len(mm.search_measurements(sample=wafer, profile='full')), 20)
+        statements = self._listing_statements(lambda: um.sample_manager.get_samples(profile='summary'))
+        um.sample_manager.create_sample('Wafer 2')
+        self.assertEqual(self._listing_statements(lambda: um.sample_manager.get_samples(profile='full')),
+                         statements + 1)
+        em = um.equipment_manager
+        em.create_equipment('Keithley 6487', category='Electrometers')
+        statements = self._listing_statements(lambda: em.get_equipment(profile='summary'))
+        em.create_equipment('Keithley 2400', category='Electrometers')
+        self.assertEqual(self._listing_statements(lambda: em.get_equipment(profile='summary')), statements)
+        self.assertRaises(ValueError, mm.get_measurements, profile='everything')
+        self.connector.config['strict_loading'] = True
+        try:
+            measurement = mm.get_measurements(profile='summary')[0]
+            self.assertIn('Data channels number: 2', str(measurement))
+            self.assertRaises(InvalidRequestError, getattr, measurement, 'collections')
+        finally:
+            del self.connector.config['strict_loading']
+        um.sign_out()
+
+
+if __name__ == '__main__':
+    unittest.main()
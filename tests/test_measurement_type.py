@@ -3,15 +3,16 @@ import unittest
 
 from BDProjects.Entities import MeasurementType
 from BDProjects.Client import Connector, Installer, Client
+from BDProjects.Maintenance import rebuild_hierarchies
 
 
 class TestMeasurementTypeManager(unittest.TestCase):
 
     def setUp(self):
         self.config_file_name = 'tests/config.ini'
-        connector = Connector(config_file_name=self.config_file_name)
-        Installer(connector=connector, overwrite=True)
-        self.client = Client(connector=connector)
+        self.connector = Connector(config_file_name=self.config_file_name)
+        Installer(connector=self.connector, overwrite=True)
+        self.client = Client(connector=self.connector)
         self.client.user_manager.sign_in('administrator', 'admin')
         self.test_user = self.client.user_manager.create_user('jack', 'pass', 'jack@somesite.com', 'Jack', 'Black')
         self.test_user2 = self.client.user_manager.create_user('jessy', 'pass', 'jessy@somesite.com', 'Jessy', 'Kriek')
@@ -122,3 +123,56 @@ class TestMeasurementTypeManager(unittest.TestCase):
             root=meas_type2.name + '_s')
         self.assertEqual(result, {})
         self.client.user_manager.sign_out()
+
+    def test_measurement_type_subtree(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        mtm = um.measurement_type_manager
+        electrical = mtm.create_measurement_type('Electrical')
+        iv = mtm.create_measurement_type('IV', parent=electrical)
+        mtm.create_measurement_type('IV fast', parent=iv)
+        mtm.create_measurement_type('CV', parent='Electrical')
+        optical = mtm.create_measurement_type('Optical')
+        self.assertEqual(mtm.get_measurement_types_tree(),
+                         {'Electrical': {'IV': {'IV fast': {}}, 'CV': {}}, 'Optical': {}})
+        self.assertEqual(mtm.get_measurement_types_tree('IV'), {'IV fast': {}})
+        self.assertEqual(mtm.get_measurement_types_tree('Missing'), {})
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        mm = um.measurement_manager
+        measurements = {}
+        for type_name in ['Electrical', 'IV', 'IV fast', 'CV', 'Optical']:
+            measurement_type = mtm.get_measurement_types(type_name, exact=True)[0]
+            um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+            measurements[type_name] = mm.create_measurement('M ' + type_name, measurement_type, equipment)
+        self.assertEqual(mm.get_measurements(type_subtree='IV'), [measurements['IV'], measurements['IV fast']])
+        self.assertEqual(len(mm.get_measurements(type_subtree=electrical)), 4)
+        self.assertEqual(mm.get_measurements(type_subtree='Missing'), [])
+        self.assertFalse(mtm.move_measurement_type(electrical, iv))
+        self.assertTrue(mtm.move_measurement_type(iv, optical))
+        self.assertEqual(mm.get_measurements(type_subtree=optical),
+                         [measurements['IV'], measurements['IV fast'], measurements['Optical']])
+        self.assertEqual(mtm.get_measurement_types_tree('Electrical'), {'CV': {}})
+        self.assertTrue(mtm.move_measurement_type(iv))
+        self.assertEqual(mtm.get_measurement_types_tree(),
+                         {'Electrical': {'CV': {}}, 'IV': {'IV fast': {}}, 'Optical': {}})
+        self.client.session.query(MeasurementType).update({MeasurementType.path: None})
+        self.client.session.commit()
+        self.assertEqual(rebuild_hierarchies(self.connector)['measurement_types'], 5)
+        self.client.session.expire_all()
+        self.assertEqual(mm.get_measurements(type_subtree='IV'), [measurements['IV'], measurements['IV fast']])
+        self.client.session.query(MeasurementType).update({MeasurementType.path: None})
+        self.client.session.commit()
+        self.assertTrue(mtm.move_measurement_type(iv, electrical))
+        self.assertEqual(mtm.get_measurement_types_tree('Electrical'), {'CV': {}, 'IV': {'IV fast': {}}})
+        self.client.session.query(MeasurementType).update({MeasurementType.path: None})
+        self.client.session.commit()
+        mtm.create_measurement_type('CV fast', parent='CV')
+        self.assertEqual(mtm.get_measurement_types_tree('CV'), {'CV fast': {}})
+        self.assertTrue(mtm.delete_measurement_type(electrical))
+        self.assertEqual(mtm.get_measurement_types_tree(),
+                         {'CV': {'CV fast': {}}, 'IV': {'IV fast': {}}, 'Optical': {}})
+        self.assertEqual(mtm.get_measurement_types_tree('IV'), {'IV fast': {}})
+        um.sign_out()
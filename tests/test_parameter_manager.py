@@ -0,0 +1,368 @@
+from __future__ import division, print_function
+import unittest
+import datetime as dt
+import numpy as np
+
+from sqlalchemy import event
+
+from BDProjects.Entities import Parameter
+from BDProjects.Entities.Sample import association_table as sample_parameter_table
+from BDProjects.Client import Connector, Installer, Client
+from BDProjects.Maintenance import compact_parameters, fingerprint_parameters
+from BDProjects.EntityManagers.ParameterManager import get_range_parameter_value, get_grid_parameter_value
+
+
+class TestParameterManager(unittest.TestCase):
+
+    def setUp(self):
+        self.config_file_name = 'tests/config.ini'
+        self.connector = Connector(config_file_name=self.config_file_name)
+        Installer(connector=self.connector, overwrite=True)
+        self.client = Client(connector=self.connector)
+        self.client.user_manager.sign_in('administrator', 'admin')
+        self.test_user = self.client.user_manager.create_user('jack', 'pass', 'jack@somesite.com', 'Jack', 'Black')
+        self.client.user_manager.sign_out()
+        self.statements = []
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _count_commit(self, session):
+        self.commits += 1
+
+    def _walk(self, parameter):
+        return [parameter.name] + [name for child in parameter.children for name in self._walk(child)]
+
+    def test_load_parameter_tree(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        recipe = pm.create_dict_parameter('Recipe')
+        for i in range(3):
+            step = pm.create_dict_parameter('Step %d' % i, parent=recipe)
+            pm.create_numeric_parameter('Temperature', 400.0 + i, unit_name='C', parent=step)
+            pm.create_numeric_range_parameter('Time', 0.0, 10.0 * i, parent=step)
+        self.assertIsNone(pm.load_parameter_tree('Recipe'))
+        self.client.session.expire_all()
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            self.assertEqual(pm.load_parameter_tree(recipe), recipe)
+            queries = len(self.statements)
+            names = self._walk(recipe)
+            self.assertEqual(len(self.statements), queries)
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        self.assertEqual(len(names), 16)
+        self.assertEqual(recipe.children[1].children[1].children[1].parent.parent.parent, recipe)
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            copy = pm.copy_parameter(recipe)
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        inserts = [statement for statement in self.statements if statement.startswith('INSERT INTO parameter ')]
+        self.assertTrue(all('RETURNING' in statement for statement in inserts))
+        self.assertEqual([statement for statement in self.statements if 'max(parameter.id)' in statement], [])
+        self.assertNotEqual(copy.id, recipe.id)
+        self.assertTrue(copy.equals(recipe))
+        self.assertEqual(sorted(self._walk(copy)), sorted(names))
+        nodes = pm.load_parameter_trees([recipe, copy])
+        self.assertEqual(len(nodes), 32)
+        dialect = self.connector.engine.dialect
+        dialect.insert_executemany_returning_sort_by_parameter_order = False
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            copy = pm.copy_parameter(recipe)
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+            del dialect.insert_executemany_returning_sort_by_parameter_order
+        inserts = [statement for statement in self.statements if statement.startswith('INSERT INTO parameter ')]
+        self.assertEqual(len(inserts), 16)
+        self.assertFalse(any('RETURNING' in statement for statement in inserts))
+        self.assertTrue(copy.equals(recipe))
+        self.assertEqual(sorted(self._walk(copy)), sorted(names))
+        um.sign_out()
+
+    def test_parameter_fingerprint(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        recipe1 = pm.create_dict_parameter('Recipe')
+        pm.create_numeric_parameter('Temperature', 450.0, unit_name='C', parent=recipe1)
+        pm.create_string_parameter('Gas', 'N2', parent=recipe1)
+        recipe2 = pm.create_dict_parameter('Recipe')
+        pm.create_string_parameter('Gas', 'N2', parent=recipe2)
+        temperature = pm.create_numeric_parameter('Temperature', 450.0 + 1e-12, unit_name='C', parent=recipe2)
+        self.assertEqual(len(recipe1.fingerprint), 64)
+        self.assertEqual(recipe1.fingerprint, recipe2.fingerprint)
+        self.assertTrue(recipe1.equals(recipe2))
+        self.assertEqual(pm.find_identical_parameters(recipe1), [recipe2])
+        self.assertEqual(pm.find_identical_parameters('Recipe'), [])
+        pm.delete_parameter(temperature)
+        self.assertNotEqual(recipe1.fingerprint, recipe2.fingerprint)
+        self.assertFalse(recipe1.equals(recipe2))
+        pm.create_numeric_parameter('Temperature', 451.0, unit_name='C', parent=recipe2)
+        self.assertNotEqual(recipe1.fingerprint, recipe2.fingerprint)
+        recipe3 = pm.copy_parameter(recipe1)
+        self.assertEqual(recipe3.fingerprint, recipe1.fingerprint)
+        close = pm.create_parameters_from_dict({'Recipe': {'Temperature': 450.001, 'Gas': 'N2'}})[0]
+        close.children[0].unit_name = 'C'
+        self.client.session.commit()
+        self.assertNotEqual(close.fingerprint, recipe1.fingerprint)
+        self.assertTrue(close.equals(recipe1))
+        close.children[0].float_value = 450.0
+        self.client.session.commit()
+        self.assertEqual(close.fingerprint, recipe1.fingerprint)
+        fingerprints = dict(self.client.session.query(Parameter.id, Parameter.fingerprint))
+        self.client.session.query(Parameter).update({Parameter.fingerprint: None}, synchronize_session=False)
+        self.client.session.commit()
+        self.assertEqual(fingerprint_parameters(self.connector, batch_size=2),
+                         self.client.session.query(Parameter).filter(Parameter.parent_id == None).count())
+        self.client.session.expire_all()
+        self.assertEqual(dict(self.client.session.query(Parameter.id, Parameter.fingerprint)), fingerprints)
+        self.assertEqual(fingerprint_parameters(self.connector), 0)
+        big = pm.create_numeric_parameter('Big', 1e300)
+        small = pm.create_numeric_parameter('Big', -1e300)
+        self.assertEqual(len(big.fingerprint), 64)
+        self.assertNotEqual(big.fingerprint, small.fingerprint)
+        self.assertEqual(pm.create_numeric_parameter('Big', 1e300).fingerprint, big.fingerprint)
+        um.sign_out()
+
+    def _leaf_update_statements(self, depth):
+        pm = self.client.user_manager.parameter_manager
+        mapping = {'Leaf': 1.0}
+        for level in range(depth):
+            mapping = {'Level %d' % level: mapping}
+        node = pm.create_parameters_from_dict(mapping)[0]
+        while node.children:
+            node = node.children[0]
+        node.float_value += 1.0
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            self.client.session.commit()
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        return len(self.statements)
+
+    def test_ancestor_fingerprints(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        self.assertEqual(self._leaf_update_statements(2), self._leaf_update_statements(6))
+        tree = um.parameter_manager.create_parameters_from_dict({'Level 0': {'Level 1': {'Leaf': 2.0}}})[0]
+        self.client.session.expire_all()
+        fingerprints = dict(self.client.session.query(Parameter.id, Parameter.fingerprint))
+        self.client.session.query(Parameter).update({Parameter.fingerprint: None}, synchronize_session=False)
+        self.client.session.commit()
+        fingerprint_parameters(self.connector)
+        self.assertEqual(dict(self.client.session.query(Parameter.id, Parameter.fingerprint)), fingerprints)
+        self.assertTrue(tree.equals(um.parameter_manager.copy_parameter(tree)))
+        um.sign_out()
+
+    def test_grid_parameters(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        uniform = pm.create_uniform_grid_parameter('Bias', -1.0, 1.0, 10001, unit_name='V')
+        points = np.sort(np.random.uniform(-1.0, 1.0, 10000))
+        nonuniform = pm.create_nonuniform_grid_parameter('Bias', points, unit_name='V')
+        self.assertEqual(self.client.session.query(Parameter).count(), 5)
+        self.client.session.expire_all()
+        grid = get_grid_parameter_value(uniform)
+        self.assertEqual(grid.size, 10001)
+        self.assertTrue(np.allclose(grid, np.linspace(-1.0, 1.0, 10001)))
+        grid = get_grid_parameter_value(nonuniform)
+        self.assertTrue(np.array_equal(grid, points))
+        self.assertFalse(grid.flags.writeable)
+        self.assertFalse(pm.delete_parameter(uniform.children[2]))
+        copy = pm.copy_parameter(nonuniform)
+        self.assertTrue(copy.equals(nonuniform))
+        self.assertTrue(np.array_equal(get_grid_parameter_value(copy), points))
+        other = pm.create_nonuniform_grid_parameter('Bias', points[::-1], unit_name='V')
+        self.assertNotEqual(other.fingerprint, nonuniform.fingerprint)
+        self.assertRaises(ValueError, pm.create_uniform_grid_parameter, 'Bias', 0.0, 1.0, 0)
+        self.assertRaises(ValueError, pm.create_nonuniform_grid_parameter, 'Bias', np.zeros((2, 2)))
+        um.sign_out()
+
+    def test_parameters_from_dict(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        started = dt.datetime(2020, 5, 17, 12, 30)
+        mapping = {'Anneal': {'Temperature': 450.0,
+                              'Gas': 'N2',
+                              'Vacuum': True,
+                              'Started': started,
+                              'Time': (0.0, 30.0),
+                              'Period': (started, started + dt.timedelta(hours=1)),
+                              'Ramp': (20.0, 450.0, 100),
+                              'Setpoints': np.array([20.0, 200.0, 450.0])},
+                   'Operator': 'Jack'}
+        holder = pm.create_dict_parameter('Holder')
+        self.commits = 0
+        event.listen(self.client.session, 'after_commit', self._count_commit)
+        try:
+            parameters = pm.create_parameters_from_dict(mapping, parent=holder)
+        finally:
+            event.remove(self.client.session, 'after_commit', self._count_commit)
+        self.assertEqual(self.commits, 2)
+        self.assertEqual(sorted(parameter.name for parameter in parameters), ['Anneal', 'Operator'])
+        self.assertEqual(len(self._walk(holder)), 18)
+        self.client.session.expire_all()
+        result = pm.to_dict(holder)['Holder']
+        setpoints = result['Anneal'].pop('Setpoints')
+        self.assertTrue(np.array_equal(setpoints, mapping['Anneal'].pop('Setpoints')))
+        self.assertEqual(result, mapping)
+        copy = pm.create_parameters_from_dict(pm.to_dict(holder))[0]
+        self.assertTrue(copy.equals(holder))
+        self.assertRaises(ValueError, pm.create_parameters_from_dict, {'Wrong': [1, 2]})
+        um.sign_out()
+
+    def test_parameter_type_registry(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        pm.create_dict_parameter('Warm up')
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            recipe = pm.create_dict_parameter('Recipe')
+            pm.create_numeric_parameter('Temperature', 450.0, unit_name='C', parent=recipe)
+            time = pm.create_numeric_range_parameter('Time', 0.0, 30.0, parent=recipe)
+            self.assertFalse(pm.delete_parameter(time.children[0]))
+            self.assertEqual(get_range_parameter_value(time, pm.parameter_type_names), (0.0, 30.0))
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        self.assertEqual([statement for statement in self.statements if 'FROM parameter_type' in statement], [])
+        flow_type = pm.create_parameter_type('Gas flow', 'Gas flow rate')
+        self.assertEqual(pm.parameter_type_ids['Gas flow'], flow_type.id)
+        flow = pm._create_parameter('Flow', 'Gas flow', float_value=5.0, parent=recipe)
+        self.assertEqual(pm.parameter_type_name(flow), 'Gas flow')
+        pm.delete_parameter_type(flow_type)
+        self.assertNotIn('Gas flow', pm.parameter_type_ids)
+        um.sign_out()
+
+    def test_find_by_parameter(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        measurement_type = um.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        samples, measurements = [], []
+        for i, (temperature, gas) in enumerate([(380.0, 'N2'), (420.0, 'N2'), (450.0, 'Ar'), (500.0, 'N2')]):
+            sample = um.sample_manager.create_sample('Sample %d' % i)
+            recipe = pm.create_parameters_from_dict({'Anneal': {'Temperature': temperature, 'Gas': gas}})[0]
+            um.sample_manager.add_parameter_to_sample(sample, recipe)
+            measurement = um.measurement_manager.create_measurement('IV %d' % i, measurement_type, equipment)
+            um.measurement_manager.add_parameter_to_measurement(
+                measurement, pm.create_numeric_parameter('Temperature', 300.0 + i * 10, unit_name='K'))
+            samples.append(sample)
+            measurements.append(measurement)
+        sm = um.sample_manager
+        self.assertEqual(sm.find_samples_by_parameter('Temperature', min=400, max=450), samples[1:3])
+        self.assertEqual(sm.find_samples_by_parameter('Gas', equals='N2'), [samples[0], samples[1], samples[3]])
+        self.assertEqual(sm.find_samples_by_parameter('Temperature', min=400,
+                                                      criteria=[{'name': 'Gas', 'equals': 'N2'}]),
+                         [samples[1], samples[3]])
+        self.assertEqual(sm.find_samples_by_parameter('Pressure', min=0), [])
+        sm.delete_sample(samples[1], soft=True)
+        self.assertEqual(sm.find_samples_by_parameter('Temperature', min=400, max=450), [samples[2]])
+        mm = um.measurement_manager
+        self.assertEqual(mm.find_measurements_by_parameter('Temperature', max=315, unit='K'), measurements[:2])
+        self.assertEqual(mm.find_measurements_by_parameter('Temperature', equals=320.0), [measurements[2]])
+        self.assertEqual(mm.find_measurements_by_parameter('Temperature', unit='C'), [])
+        self.assertRaises(ValueError, mm.find_measurements_by_parameter)
+        um.sign_out()
+
+    def test_parameter_matrix(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        sm = um.sample_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        samples = [sm.create_sample('Sample %d' % i) for i in range(3)]
+        sm.add_parameter_to_sample(samples[0], pm.create_parameters_from_dict(
+            {'Anneal': {'Temperature': 450.0, 'Time': (0.0, 30.0), 'Gas': 'N2'}})[0])
+        sm.add_parameter_to_sample(samples[0], pm.create_numeric_parameter('Thickness', 100.0))
+        sm.add_parameter_to_sample(samples[1], pm.create_parameters_from_dict({'Anneal': {'Temperature': 400.0}})[0])
+        sm.add_parameter_to_sample(samples[2], pm.create_numeric_parameter('Thickness', 200.0))
+        names = ['Anneal.Temperature', 'Anneal.Time.stop', 'Thickness', 'Anneal.Gas']
+        self.statements = []
+        event.listen(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            matrix, rows, columns = sm.get_parameter_matrix(names)
+        finally:
+            event.remove(self.connector.engine, 'before_cursor_execute', self._count_statement)
+        self.assertEqual(len([statement for statement in self.statements if 'parameter' in statement]), 1)
+        self.assertEqual(rows, ['Sample 0', 'Sample 1', 'Sample 2'])
+        self.assertEqual(columns, names)
+        expected = np.array([[450.0, 30.0, 100.0, np.nan],
+                             [400.0, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, 200.0, np.nan]])
+        self.assertTrue(np.array_equal(matrix, expected, equal_nan=True))
+        matrix, rows, columns = sm.get_parameter_matrix(['Thickness'], samples=[samples[2], samples[1]])
+        self.assertEqual(rows, ['Sample 2', 'Sample 1'])
+        self.assertTrue(np.array_equal(matrix, np.array([[200.0], [np.nan]]), equal_nan=True))
+        um.sign_out()
+
+    def test_intern_parameters(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        samples = [um.sample_manager.create_sample('Sample %d' % i) for i in range(4)]
+        recipes = []
+        for i in range(4):
+            recipe = pm.create_dict_parameter('Recipe')
+            pm.create_numeric_parameter('Temperature', 450.0, unit_name='C', parent=recipe)
+            recipes.append(recipe)
+        for sample, recipe in zip(samples[:3], recipes):
+            um.sample_manager.add_parameter_to_sample(sample, recipe)
+        um.sample_manager.add_parameter_to_sample(samples[0], recipes[2])
+        pm.interning = True
+        self.assertEqual(pm.intern_parameter(recipes[3]), recipes[0])
+        um.sample_manager.add_parameter_to_sample(samples[3], recipes[3])
+        self.assertEqual(samples[3].parameters, [recipes[0]])
+        other = pm.create_numeric_parameter('Temperature', 300.0, unit_name='C')
+        self.assertEqual(pm.intern_parameter(other), other)
+        self.assertEqual(self.client.session.query(Parameter).count(), 9)
+        counts = compact_parameters(self.connector)
+        self.assertEqual(counts, {'groups': 1, 'associations': 3, 'parameters': 6})
+        self.client.session.expire_all()
+        self.assertEqual(self.client.session.query(Parameter).count(), 3)
+        for sample in samples:
+            self.assertEqual([parameter.id for parameter in sample.parameters], [recipes[0].id])
+        um.sign_out()
+
+    def test_compact_nested_links(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        pm = um.parameter_manager
+        um.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        um.project_manager.open_project('Super Project')
+        samples = [um.sample_manager.create_sample('Sample %d' % i) for i in range(2)]
+        recipes, temperatures = [], []
+        for i in range(2):
+            recipe = pm.create_dict_parameter('Recipe')
+            temperatures.append(pm.create_numeric_parameter('Temperature', 450.0, unit_name='C', parent=recipe))
+            pm.create_numeric_parameter('Time', 60.0, unit_name='s', parent=recipe)
+            recipes.append(recipe)
+        um.sample_manager.add_parameter_to_sample(samples[0], recipes[0])
+        um.sample_manager.add_parameter_to_sample(samples[1], temperatures[1])
+        kept_ids = [recipes[0].id, temperatures[0].id]
+        counts = compact_parameters(self.connector)
+        self.assertEqual(counts, {'groups': 1, 'associations': 1, 'parameters': 3})
+        session = self.client.session
+        session.expire_all()
+        self.assertEqual(session.query(Parameter).count(), 3)
+        rows = session.query(sample_parameter_table.c.sample_id, sample_parameter_table.c.parameter_id).order_by(
+            sample_parameter_table.c.sample_id).all()
+        self.assertEqual(rows, [(samples[0].id, kept_ids[0]), (samples[1].id, kept_ids[1])])
+        um.sign_out()
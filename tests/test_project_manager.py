@@ -1,8 +1,20 @@
 from __future__ import division, print_function
 import unittest
+import os
+import shutil
+import tempfile
+import zipfile
+
+from sqlalchemy import event
 
 from BDProjects.Entities import Project
+from BDProjects.Entities import Sample
+from BDProjects.Entities import Measurement, MeasurementsCollection
+from BDProjects.Entities import DataChannel, DataPoint
+from BDProjects.Entities.Sample import association_table as sample_parameter_table
+from BDProjects.Entities.Measurement import measurement_sample_table, measurement_collection_table
 from BDProjects.Client import Connector, Installer, Client
+from BDProjects.Maintenance import purge_deleted
 
 
 class TestProjectManager(unittest.TestCase):
@@ -16,6 +28,10 @@ class TestProjectManager(unittest.TestCase):
         self.test_user = self.client.user_manager.create_user('jack', 'pass', 'jack@somesite.com', 'Jack', 'Black')
         self.test_user2 = self.client.user_manager.create_user('jessy', 'pass', 'jessy@somesite.com', 'Jessy', 'Kriek')
         self.client.user_manager.sign_out()
+        self.statements = []
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
 
     def test_create_project(self):
         result = self.client.user_manager.project_manager.create_project(
@@ -58,6 +74,44 @@ class TestProjectManager(unittest.TestCase):
         self.assertFalse(result)
         self.client.user_manager.sign_out()
 
+    def test_delete_project_bulk(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        prj1 = um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files')
+        prj2 = um.project_manager.create_project(name='Super Project 2', data_dir='tests/data/files')
+        um.project_manager.open_project(prj1.name)
+        measurement_type = um.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        sample = um.sample_manager.create_sample('Sample 1')
+        um.sample_manager.add_parameter_to_sample(sample, um.parameter_manager.create_dict_parameter('Recipe'))
+        for name in ['IV', 'CV']:
+            measurement = um.measurement_manager.create_measurement(name, measurement_type, equipment)
+            um.measurement_manager.add_sample_to_measurement(measurement, sample)
+            collection = um.measurement_manager.create_collection('Collection ' + name)
+            um.measurement_manager.add_measurement_to_collection(collection, measurement)
+            channel = um.measurement_manager.create_data_channel('Current', measurement, unit_name='A')
+            for i in range(5):
+                um.measurement_manager.create_data_point(channel, float_value=i * 0.5, point_index=i)
+        chunks = []
+        self.assertTrue(um.measurement_manager.delete_measurement(
+            measurement, bulk=True, chunk_size=2, progress=lambda table, rows: chunks.append((table, rows))))
+        self.assertEqual([rows for table, rows in chunks if table == 'data_point'], [2, 4, 5])
+        self.assertEqual([rows for table, rows in chunks if table == 'measurement'], [1])
+        summary = um.project_manager.get_project_summary(prj1)
+        self.assertEqual(summary['measurements'], 1)
+        self.assertEqual(summary['data_points'], 5)
+        self.assertEqual(len(sample.measurements), 1)
+        self.assertTrue(um.project_manager.delete_project(prj1, bulk=True, chunk_size=2))
+        self.assertFalse(um.project_manager.delete_project(prj1, bulk=True))
+        self.assertEqual(um.project_manager.get_projects(), [prj2])
+        for entity in [Sample, Measurement, MeasurementsCollection, DataChannel, DataPoint]:
+            self.assertEqual(self.client.session.query(entity).count(), 0)
+        for table in [sample_parameter_table, measurement_sample_table, measurement_collection_table]:
+            self.assertEqual(self.client.session.query(table).count(), 0)
+        um.sign_out()
+
     def test_get_projects(self):
         self.client.user_manager.sign_in('jack', 'pass')
         prj1 = self.client.user_manager.project_manager.create_project(
@@ -163,3 +217,228 @@ class TestProjectManager(unittest.TestCase):
         result = self.client.user_manager.project_manager.project_opened(session='session')
         self.assertFalse(result)
         self.client.user_manager.sign_out()
+
+    def test_get_project_summary(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        prj1 = um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files')
+        um.project_manager.open_project(prj1.name)
+        summary = um.project_manager.get_project_summary()
+        self.assertEqual(summary['samples'], 0)
+        self.assertEqual(summary['measurements'], 0)
+        self.assertEqual(summary['data_points'], 0)
+        measurement_type = um.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        um.sample_manager.create_sample('Sample 1')
+        um.sample_manager.create_sample('Sample 2')
+        measurement = um.measurement_manager.create_measurement('IV', measurement_type, equipment)
+        um.measurement_manager.create_measurement('CV', measurement_type, equipment)
+        um.measurement_manager.create_collection('Collection')
+        channel = um.measurement_manager.create_data_channel('Current', measurement, unit_name='A')
+        channel2 = um.measurement_manager.create_data_channel('Voltage', measurement, unit_name='V')
+        for i in range(3):
+            um.measurement_manager.create_data_point(channel, float_value=i, point_index=i)
+        summary = um.project_manager.get_project_summary(prj1, cached=True)
+        self.assertEqual(summary['samples'], 2)
+        self.assertEqual(summary['measurements'], 2)
+        self.assertEqual(summary['measurements_by_type'], {'Electrical measurement': 2})
+        self.assertEqual(summary['measurements_by_equipment'], {'Keithley 6517': 2})
+        self.assertEqual(summary['data_channels'], 2)
+        self.assertEqual(summary['data_points'], 3)
+        self.assertEqual(summary['collections'], 1)
+        self.assertIsNotNone(summary['last_activity'])
+        um.measurement_manager.create_data_point(channel, float_value=3, point_index=3)
+        summary = um.project_manager.get_project_summary(prj1, cached=True)
+        self.assertEqual(summary['data_points'], 4)
+        summary = um.project_manager.get_project_summary(prj1, cached=True)
+        self.assertEqual(summary['data_points'], 4)
+        um.measurement_manager.delete_data_points(channel, point_index=[0])
+        summary = um.project_manager.get_project_summary(prj1, cached=True)
+        self.assertEqual(summary['data_points'], 3)
+        um.measurement_manager.create_data_point(channel2, float_value=1, point_index=0)
+        event.listen(self.client.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            summary = um.project_manager.get_project_summary(prj1, cached=True)
+        finally:
+            event.remove(self.client.engine, 'before_cursor_execute', self._count_statement)
+        self.assertEqual(summary['data_points'], 4)
+        recounts = [statement for statement in self.statements if 'count(data_point.id)' in statement]
+        self.assertEqual(len(recounts), 1)
+        self.assertIn('data_point.channel_id IN', recounts[0])
+        self.assertIsNone(um.project_manager.get_project_summary('prj1'))
+        um.sign_out()
+
+    def test_project_summary_cross_client(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        prj1 = um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files')
+        prj2 = um.project_manager.create_project(name='Super Project 2', data_dir='tests/data/files')
+        um.project_manager.open_project(prj1.name)
+        client = Client(connector=self.client.connector)
+        other = client.user_manager
+        other.sign_in('jessy', 'pass')
+        other.project_manager.open_project(prj2.name)
+        measurement_type = other.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = other.equipment_manager.create_equipment_category('Electrometers')
+        equipment = other.equipment_manager.create_equipment('Keithley 6517', category=category)
+        other.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        measurement = other.measurement_manager.create_measurement('IV', measurement_type, equipment)
+        channel = other.measurement_manager.create_data_channel('Current', measurement, unit_name='A')
+        channel2 = other.measurement_manager.create_data_channel('Voltage', measurement, unit_name='V')
+        for i in range(3):
+            other.measurement_manager.create_data_point(channel, float_value=i, point_index=i)
+            other.measurement_manager.create_data_point(channel2, float_value=i, point_index=i)
+        self.assertEqual(um.project_manager.get_project_summary(prj2, cached=True)['data_points'], 6)
+        other.project_manager.open_project(prj1.name)
+        other.measurement_manager.delete_data_points(channel, point_index=[0])
+        self.assertEqual(um.project_manager.get_project_summary(prj2, cached=True)['data_points'], 5)
+        other.measurement_manager.delete_data_channel(channel2, soft=True)
+        self.assertEqual(um.project_manager.get_project_summary(prj2, cached=True)['data_points'], 2)
+        revision = self.client.session.query(Project.revision).filter(Project.id == prj2.id).scalar()
+        purge_deleted(self.client.connector)
+        self.assertGreater(self.client.session.query(Project.revision).filter(Project.id == prj2.id).scalar(),
+                           revision)
+        self.assertEqual(um.project_manager.get_project_summary(prj2, cached=True)['data_points'], 2)
+        self.assertEqual(um.project_manager.get_project_summary(prj1, cached=True)['data_points'], 0)
+        other.measurement_manager.delete_measurement(measurement, soft=True)
+        self.assertEqual(um.project_manager.get_project_summary(prj2, cached=True)['data_points'], 0)
+        revision = self.client.session.query(Project.revision).filter(Project.id == prj2.id).scalar()
+        self.assertFalse(other.measurement_manager.delete_measurement(measurement, soft=True))
+        self.assertEqual(client.session.query(Project.revision).filter(Project.id == prj2.id).scalar(), revision)
+        other.sign_out()
+        um.sign_out()
+
+    def test_export_import_project(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        prj1 = um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files')
+        um.project_manager.open_project(prj1.name)
+        measurement_type = um.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        sample = um.sample_manager.create_sample('Sample 1')
+        recipe = um.parameter_manager.create_dict_parameter('Recipe')
+        um.parameter_manager.create_numeric_parameter('Temperature', 450.0, unit_name='C', parent=recipe)
+        um.parameter_manager.create_string_parameter('Gas', 'N2', parent=recipe)
+        um.sample_manager.add_parameter_to_sample(sample, recipe)
+        measurement = um.measurement_manager.create_measurement('IV', measurement_type, equipment)
+        um.measurement_manager.add_sample_to_measurement(measurement, sample)
+        collection = um.measurement_manager.create_collection('Collection')
+        um.measurement_manager.add_measurement_to_collection(collection, measurement)
+        channel = um.measurement_manager.create_data_channel('Current', measurement, unit_name='A')
+        for i in range(5):
+            um.measurement_manager.create_data_point(channel, float_value=i * 0.5, point_index=i)
+        um.measurement_manager.create_data_point(channel, string_value='overload', point_index=5)
+        um.measurement_manager.create_data_point(channel, float_value=3.0, string_value='', point_index=6)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            bundle = os.path.join(tmp_dir, 'bundle.zip')
+            self.assertFalse(um.project_manager.export_project('prj1', bundle))
+            self.assertTrue(um.project_manager.export_project(prj1, bundle, chunk_size=2))
+            self.assertIsNone(um.project_manager.import_project(bundle))
+            self.assertIsNone(um.project_manager.import_project(os.path.join(tmp_dir, 'no_bundle.zip')))
+            no_manifest = os.path.join(tmp_dir, 'no_manifest.zip')
+            with zipfile.ZipFile(no_manifest, 'w') as archive:
+                archive.writestr('readme.txt', 'no manifest')
+            self.assertIsNone(um.project_manager.import_project(no_manifest))
+            broken = os.path.join(tmp_dir, 'broken.zip')
+            with zipfile.ZipFile(bundle, 'r') as source, zipfile.ZipFile(broken, 'w') as archive:
+                for item in source.namelist():
+                    if not item.startswith('data/'):
+                        archive.writestr(item, source.read(item))
+            self.assertIsNone(um.project_manager.import_project(broken, name='Broken Project'))
+            self.assertEqual(um.project_manager.get_projects(name='Broken Project', exact=True), [])
+            self.assertEqual(self.client.session.query(Measurement).count(), 1)
+            prj2 = um.project_manager.import_project(bundle, name='Super Project 2', data_dir=tmp_dir)
+            self.assertIsInstance(prj2, Project)
+        finally:
+            shutil.rmtree(tmp_dir)
+        summary1 = um.project_manager.get_project_summary(prj1)
+        summary2 = um.project_manager.get_project_summary(prj2)
+        del summary1['last_activity'], summary2['last_activity']
+        self.assertEqual(summary1, summary2)
+        sample2 = prj2.samples[0]
+        self.assertTrue(sample2.parameters[0].equals(recipe))
+        self.assertEqual(sample2.parameters[0].fingerprint, recipe.fingerprint)
+        measurement2 = prj2.measurements[0]
+        self.assertEqual(measurement2.samples, [sample2])
+        self.assertEqual(measurement2.collections[0].name, 'Collection')
+        self.assertEqual(measurement2.equipment, equipment)
+        channel2 = measurement2.data_channels[0]
+        self.assertEqual(channel2.unit_name, 'A')
+        points = sorted(channel2.data_points, key=lambda point: point.point_index)
+        self.assertEqual([point.float_value for point in points], [0.0, 0.5, 1.0, 1.5, 2.0, None, 3.0])
+        self.assertEqual(points[5].string_value, 'overload')
+        self.assertEqual(points[6].string_value, '')
+        self.assertIsNone(points[0].string_value)
+        um.sign_out()
+
+    def test_clone_project(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        prj1 = um.project_manager.create_project(name='Super Project 1', data_dir='tests/data/files')
+        um.project_manager.open_project(prj1.name)
+        measurement_type = um.measurement_type_manager.create_measurement_type('Electrical measurement')
+        category = um.equipment_manager.create_equipment_category('Electrometers')
+        equipment = um.equipment_manager.create_equipment('Keithley 6517', category=category)
+        um.equipment_manager.add_measurement_type_to_equipment(equipment, measurement_type)
+        sample = um.sample_manager.create_sample('Sample 1')
+        recipe = um.parameter_manager.create_dict_parameter('Recipe')
+        um.parameter_manager.create_numeric_parameter('Temperature', 450.0, unit_name='C', parent=recipe)
+        um.parameter_manager.create_string_parameter('Gas', 'N2', parent=recipe)
+        um.sample_manager.add_parameter_to_sample(sample, recipe)
+        measurement = um.measurement_manager.create_measurement('IV', measurement_type, equipment)
+        um.measurement_manager.add_sample_to_measurement(measurement, sample)
+        channel = um.measurement_manager.create_data_channel('Current', measurement, unit_name='A')
+        um.measurement_manager.add_parameter_to_data_channel(
+            channel, um.parameter_manager.create_numeric_parameter('Range', 1e-3, unit_name='A'))
+        for i in range(5):
+            um.measurement_manager.create_data_point(channel, float_value=i * 0.5, point_index=i)
+        self.assertIsNone(um.project_manager.clone_project('prj1', 'Super Project 2'))
+        self.assertIsNone(um.project_manager.clone_project(prj1, prj1.name))
+        prj2 = um.project_manager.clone_project(prj1, 'Super Project 2')
+        self.assertIsInstance(prj2, Project)
+        self.assertEqual(prj2.data_dir, prj1.data_dir)
+        sample2 = prj2.samples[0]
+        self.assertNotEqual(sample2.id, sample.id)
+        self.assertNotEqual(sample2.parameters[0].id, recipe.id)
+        self.assertTrue(sample2.parameters[0].equals(recipe))
+        self.assertEqual(sample2.parameters[0].fingerprint, recipe.fingerprint)
+        self.assertEqual(len(sample2.parameters[0].children), 2)
+        measurement2 = prj2.measurements[0]
+        self.assertEqual(measurement2.samples, [sample2])
+        self.assertEqual(measurement2.equipment, equipment)
+        channel2 = measurement2.data_channels[0]
+        self.assertEqual(channel2.parameters[0].float_value, 1e-3)
+        self.assertEqual(channel2.data_points, [])
+        event.listen(self.client.engine, 'before_cursor_execute', self._count_statement)
+        try:
+            prj3 = um.project_manager.clone_project(prj1, 'Super Project 3', include_data=True)
+        finally:
+            event.remove(self.client.engine, 'before_cursor_execute', self._count_statement)
+        allocations = [statement for statement in self.statements
+                       for table_name in ['sample', 'measurement', 'data_channel', 'parameter']
+                       if 'max(%s.id)' % table_name in statement]
+        self.assertEqual(allocations, [])
+        summary1 = um.project_manager.get_project_summary(prj1)
+        summary3 = um.project_manager.get_project_summary(prj3)
+        self.assertEqual(summary3['data_points'], 5)
+        del summary1['last_activity'], summary3['last_activity']
+        self.assertEqual(summary1, summary3)
+        self.assertEqual(len(sample.parameters[0].children), 2)
+        dialect = self.client.engine.dialect
+        dialect.insert_executemany_returning_sort_by_parameter_order = False
+        try:
+            prj4 = um.project_manager.clone_project(prj1, 'Super Project 4', include_data=True)
+        finally:
+            del dialect.insert_executemany_returning_sort_by_parameter_order
+        recipe4 = prj4.samples[0].parameters[0]
+        self.assertTrue(recipe4.equals(recipe))
+        self.assertEqual(set(child.parent_id for child in recipe4.children), {recipe4.id})
+        self.assertEqual(prj4.measurements[0].data_channels[0].parameters[0].float_value, 1e-3)
+        self.assertTrue(um.project_manager.delete_project(prj4, soft=True))
+        self.assertIsNone(um.project_manager.clone_project(prj4, 'Super Project 5'))
+        um.sign_out()
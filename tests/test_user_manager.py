@@ -1,6 +1,9 @@
 from __future__ import division, print_function
 import unittest
+import warnings
+import datetime
 
+from BDProjects.Entities import User, Session, SessionProject, Log
 from BDProjects.Client import Connector, Installer, Client
 
 
@@ -54,6 +57,48 @@ class TestUserManager(unittest.TestCase):
         self.assertEqual(result, result2)
         self.client.user_manager.sign_out()
 
+    def test_create_users(self):
+        users = [{'login': 'user%d' % i, 'password': 'pass%d' % i, 'email': 'user%d@somesite.com' % i}
+                 for i in range(3)]
+        result = self.client.user_manager.create_users(users)
+        self.assertIsNone(result)
+        self.client.user_manager.sign_in('administrator', 'admin')
+        result = self.client.user_manager.create_users(users + [{'login': 'bot', 'password': 'pass',
+                                                                 'email': 'bot@bot.net'}])
+        self.assertIsNone(result)
+        self.assertFalse(self.client.session.new)
+        self.assertIsNone(self.client.user_manager.create_users(users + [{'login': 'nopass'}]))
+        self.client.session.commit()
+        self.assertFalse(self.client.session.query(User).filter(User.login == 'user0').count())
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            result = self.client.user_manager.create_users(users + [{'login': 'jack', 'password': 'pass',
+                                                                     'email': 'jack@somesite.com'}])
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[3], self.test_user)
+        self.assertEqual([user.login for user in result[:3]], ['user0', 'user1', 'user2'])
+        result = self.client.user_manager.create_users([{'login': 'newguy', 'password': 'pass',
+                                                         'email': 'jack@somesite.com'},
+                                                        {'login': 'user3', 'password': 'pass3',
+                                                         'email': 'user3@somesite.com', 'roles': ['user', 'guest']}])
+        self.assertEqual(result[0], self.test_user)
+        self.assertEqual([role.name for role in result[1].roles], ['user'])
+        self.client.user_manager.sign_out()
+        self.assertTrue(self.client.user_manager.sign_in('user1', 'pass1'))
+        self.client.user_manager.sign_out()
+
+    def test_sign_in_async(self):
+        result = self.client.user_manager.sign_in_async('jack_wrong', 'pass')
+        self.assertFalse(result)
+        pending = self.client.user_manager.sign_in_async('jack', 'pass_wrong')
+        self.assertFalse(pending.result())
+        self.assertFalse(self.client.user_manager.signed_in())
+        pending = self.client.user_manager.sign_in_async('jack', 'pass')
+        self.assertTrue(pending.result())
+        self.assertTrue(pending.done())
+        self.assertEqual(self.client.user_manager.user.login, 'jack')
+        self.client.user_manager.sign_out()
+
     def test_sign_in_sign_out(self):
         result = self.client.user_manager.sign_in('bot', 'None')
         self.assertFalse(result)
@@ -70,6 +115,48 @@ class TestUserManager(unittest.TestCase):
         self.assertTrue(result)
         self.assertEqual(self.client.user_manager.user.login, 'jack')
 
+    def test_resume_session(self):
+        self.client.user_manager.sign_in('jack', 'pass')
+        project = self.client.user_manager.project_manager.create_project(name='Super Project',
+                                                                          data_dir='tests/data/files')
+        self.client.user_manager.project_manager.open_project(project.name)
+        token = self.client.user_manager.session_data.token
+        client = Client(connector=self.connector)
+        self.assertFalse(client.user_manager.resume_session(token + '_wrong'))
+        self.assertTrue(client.user_manager.resume_session(token))
+        self.assertFalse(client.user_manager.resume_session(token))
+        self.assertEqual(client.user_manager.user.login, 'jack')
+        self.assertEqual(client.user_manager.session_data.id, self.client.user_manager.session_data.id)
+        self.assertEqual(client.user_manager.project_manager.project.name, project.name)
+        self.assertTrue(client.user_manager.project_manager.project_opened())
+        self.client.user_manager.sign_out()
+        self.assertFalse(client.user_manager.signed_in())
+        self.assertFalse(Client(connector=self.connector).user_manager.resume_session(token))
+
+    def test_resume_session_rejected(self):
+        self.client.user_manager.sign_in('jack', 'pass')
+        token = self.client.user_manager.session_data.token
+        self.test_user.active = False
+        self.client.session.commit()
+        client = Client(connector=self.connector)
+        self.assertFalse(client.user_manager.resume_session(token))
+        self.assertFalse(client.user_manager.signed_in())
+        self.test_user.active = True
+        self.client.session.commit()
+        self.client.session.query(Session).filter(Session.token == token).update(
+            {Session.last_seen: datetime.datetime.now() - datetime.timedelta(days=2)})
+        self.client.session.commit()
+        self.assertFalse(client.user_manager.resume_session(token))
+        self.assertFalse(client.user_manager.signed_in())
+        self.assertFalse(self.client.session.query(Session).filter(Session.token == token,
+                                                                   Session.active == 1).count())
+        bot = self.client.session.query(User).filter(User.login == 'bot').one()
+        bot_session = Session(user_id=bot.id, token='bot_token', host='localhost', active=True)
+        self.client.session.add(bot_session)
+        self.client.session.commit()
+        self.assertFalse(client.user_manager.resume_session('bot_token'))
+        self.assertFalse(client.user_manager.signed_in())
+
     def test_delete_user(self):
         result = self.client.user_manager.delete_user(self.test_user)
         self.assertFalse(result)
@@ -119,7 +206,67 @@ class TestUserManager(unittest.TestCase):
         client.user_manager.logoff_user(self.test_user)
         self.client.user_manager.logoff_user(self.test_user2)
         client.user_manager.sign_in('jessy', 'pass')
-        self.client.user_manager.logoff_all()
+        bot = self.client.session.query(User).filter(User.login == 'bot').one()
+        self.client.session.add(Session(user_id=bot.id, token='bot_token', host='localhost', active=True))
+        self.client.session.commit()
+        logs = self.client.session.query(Log).count()
+        self.assertEqual(self.client.user_manager.logoff_all(), 2)
+        self.assertEqual(self.client.session.query(Log).count(), logs + 1)
+        self.assertFalse(client.user_manager.signed_in())
+        self.assertTrue(self.client.session.query(Session).filter(Session.token == 'bot_token',
+                                                                  Session.active == 1).count())
+
+    def test_close_sessions(self):
+        clients = [Client(connector=self.connector) for _ in range(3)]
+        for client in clients:
+            client.user_manager.sign_in('jessy', 'pass')
+        clients[0].user_manager.project_manager.create_project(name='Super Project', data_dir='tests/data/files')
+        clients[0].user_manager.project_manager.open_project('Super Project')
+        self.assertIsNone(clients[0].user_manager.close_sessions())
+        self.client.user_manager.sign_in('administrator', 'admin')
+        self.assertEqual(self.client.user_manager.close_sessions(sessions=[clients[2].user_manager.session_data]), 1)
+        self.assertFalse(clients[2].user_manager.signed_in())
+        self.assertEqual(self.client.user_manager.close_sessions(users=[self.test_user2]), 2)
+        self.assertFalse(clients[0].user_manager.signed_in())
+        opened_projects = self.client.session.query(SessionProject).filter(SessionProject.closed == None).count()
+        self.assertEqual(opened_projects, 0)
+        self.assertTrue(self.client.user_manager.signed_in())
+        self.assertEqual(self.client.user_manager.close_sessions(), 1)
+        self.assertFalse(self.client.user_manager.signed_in())
+
+    def test_expire_sessions(self):
+        client = Client(connector=self.connector)
+        client.user_manager.sign_in('jessy', 'pass')
+        self.client.user_manager.sign_in('administrator', 'admin')
+        self.assertEqual(self.client.user_manager.expire_sessions(), 0)
+        past = datetime.datetime.now() - datetime.timedelta(hours=2)
+        self.client.session.query(Session).filter(Session.id == client.user_manager.session_data.id).update(
+            {Session.last_seen: past}, synchronize_session=False)
+        self.client.session.commit()
+        self.assertEqual(self.client.user_manager.expire_sessions(timeout=3600), 1)
+        self.assertFalse(client.user_manager.signed_in())
+        self.assertTrue(self.client.user_manager.signed_in())
+        self.client.user_manager.sign_out()
+
+    def test_heartbeat(self):
+        um = self.client.user_manager
+        um.sign_in('jack', 'pass')
+        session_id = um.session_data.id
+        past = datetime.datetime.now() - datetime.timedelta(hours=2)
+        self.client.session.query(Session).filter(Session.id == session_id).update(
+            {Session.last_seen: past}, synchronize_session=False)
+        self.client.session.commit()
+        um._UserManager__heartbeat = (None, None)
+        self.test_user.name_first = 'John'
+        self.assertTrue(um.signed_in())
+        self.client.session.rollback()
+        self.assertEqual(self.test_user.name_first, 'Jack')
+        self.assertEqual(self.client.session.query(Session.last_seen).filter(Session.id == session_id).scalar(), past)
+        self.assertTrue(um.signed_in())
+        self.client.session.expire_all()
+        self.assertGreater(self.client.session.query(Session.last_seen).filter(Session.id == session_id).scalar(),
+                           past)
+        um.sign_out()
 
     def test_log_user_info(self):
         self.client.user_manager.sign_in('administrator', 'admin')